@@ -0,0 +1,341 @@
+# -*- coding: utf-8 -*-
+####################################################################################################
+# Computing configuration variables for the Cluster Variation Method
+# Benchmark suite for the perturbation-experiment engine (2D-CVM-perturb-expt-1-2-2018-01-07.py)
+####################################################################################################
+#
+# For each grid size (16x16, 64x64, 256x256, and 1024x1024 by default) this times:
+#   -  a full count of the configuration variables, with each counting engine:
+#        legacy   - the original cell-by-cell loops
+#        numpy    - the whole-array NumPy engine (computeConfigVariablesBatch)
+#        packed   - the bit-packed engine (computeConfigVariablesPackedBatch), on a grid that is
+#                   generated directly in packed form (initializeGeneratedPackedMatrix), so that
+#                   no full-size int grid is built for it
+#        numba    - the compiled kernel (only when Numba is installed)
+#   -  a thermodynamic evaluation, one grid at a time and as a batch of grids
+#   -  one FE minimization (adjustMatrixFEMinimum; feMinimizationTrials swap trials), with the
+#      local swap update and, for the smaller grids, with the original full recount
+#   -  one perturbation cycle: perturb, re-minimize, and count the changes
+# and reports the time, the throughput in grid nodes per second, and the memory used by the grid
+#   and by the lattice index tables, together with the peak memory of the process.
+# A minimization starts with one full count of the grid, and then makes its swap trials. The
+#   starting count is timed on its own (a call with no trials), and the FE minimization rows
+#   report the time per swap trial with it taken off, so they show how a trial scales with the
+#   grid size: about constant with the local update, and in proportion to N with the full recount.
+#   The local update is timed over feLocalUpdateTrials trials, as feMinimizationTrials of them
+#   take less time than the noise in the starting count of a large grid.
+#
+# Every measurement starts from the same seed, so runs are comparable. The results of the
+#   optimized engines are also checked against the legacy implementations: the counts of every
+#   engine against the legacy loops, the batch thermodynamics against computeThermodynamicVars,
+#   and the local-update minimization against the full-recount minimization. The legacy loops are
+#   slow, so they are only run up to --legacy-max-size. The packed grid is checked against
+#   initializeGeneratedMatrix (from the same seed, unpackUnitArray must give back the same grid),
+#   and packing the unpacked grid again must give back the packed grid.
+#
+# Usage:   python 2D-CVM-perturb-benchmark.py [--sizes 16 64 256 1024] [--repeats 3]
+#                                             [--legacy-max-size 256] [--json results.json]
+#
+####################################################################################################
+
+import os
+import sys
+import imp
+import json
+import timeit
+import resource
+import argparse
+import numpy as np
+
+
+cvmEngineFileName = os.path.join(os.path.dirname(os.path.abspath(__file__)), '2D-CVM-perturb-expt-1-2-2018-01-07.py')
+cvm = imp.load_source('cvmPerturbEngine', cvmEngineFileName)
+
+benchmarkSeed = 2018
+x1TargetVal = 0.45
+h = 1.2
+perturbFrctn = 0.1
+thermBatchSize = 64
+
+# adjustMatrixFEMinimum makes this many swap trials per call, searching feMinimizationMaxRange
+#   units for each candidate
+feMinimizationTrials = 30
+feMinimizationMaxRange = 30
+feLocalUpdateTrials = 1000
+
+
+####################################################################################################
+#
+# Function to seed the global np.random generator; the benchmark grids have no generator of their
+#   own, so the engine draws its random numbers from it (see obtainRandomState)
+#
+####################################################################################################
+
+def seedBenchmark (seedOffset):
+
+    np.random.seed(benchmarkSeed + seedOffset)
+
+
+####################################################################################################
+#
+# Function to time a call; it is made "repeats" times, each time after reseeding, and the median
+#   wall time is returned together with the result of the last call
+#
+####################################################################################################
+
+def timeCall (repeats, seedOffset, callFunction, *args):
+
+    elapsedList = list()
+    for repeatNum in range (0, repeats):
+        seedBenchmark (seedOffset)
+        startTime = timeit.default_timer()
+        callResult = callFunction(*args)
+        elapsedList.append(timeit.default_timer() - startTime)
+
+    elapsedList.sort()
+
+    return (elapsedList[len(elapsedList)//2], callResult)
+
+
+####################################################################################################
+#
+# Function to make a grid (CVMGrid) with the given engine settings
+#
+####################################################################################################
+
+def obtainBenchmarkGrid (gridSize, **runSettings):
+
+    runConfig = cvm.CVMRunConfig ()
+    runConfig.plotMode = 'off'
+    for settingName, settingVal in runSettings.items():
+        setattr(runConfig, settingName, settingVal)
+
+    return (cvm.CVMGrid (gridSize, gridSize, runConfig))
+
+
+####################################################################################################
+#
+# Functions for the timed operations
+#
+####################################################################################################
+
+def countLegacy (arraySizeList, unitArray):
+
+    return (np.array(cvm.computeConfigVariables (arraySizeList, unitArray)[0:14], dtype=np.int64))
+
+
+def countBatch (arraySizeList, unitArray):
+
+    return (cvm.computeConfigVariablesBatch (arraySizeList, unitArray[np.newaxis])[0])
+
+
+def countPacked (arraySizeList, packedArray):
+
+    return (cvm.computeConfigVariablesPackedBatch (arraySizeList, packedArray[np.newaxis])[0])
+
+
+def evaluateThermodynamics (arraySizeList, configVarsCounts):
+
+    return (cvm.computeThermodynamicVars (arraySizeList, h, configVarsCounts))
+
+
+def evaluateThermodynamicsBatch (arraySizeList, configVarsArray):
+
+    return (cvm.computeThermodynamicVarsBatch (arraySizeList, h, configVarsArray))
+
+
+def minimizeFreeEnergy (arraySizeList, unitArray, totalTrials):
+
+    return (cvm.adjustMatrixFEMinimum (arraySizeList, unitArray.copy(), h, feMinimizationMaxRange, totalTrials))
+
+
+def runPerturbationCycle (arraySizeList, unitArray):
+
+    perturbedUnitArray = cvm.perturb (arraySizeList, unitArray, perturbFrctn)
+    startingPerturbedArray = perturbedUnitArray.copy()
+    perturbedEqlbrmUnitArray = cvm.adjustMatrixFEMinimum (arraySizeList, perturbedUnitArray, h, feMinimizationMaxRange, 
+                                                          feMinimizationTrials)
+    totalChangesPerturbations = cvm.countTotalChangesInUnitArray (arraySizeList, startingPerturbedArray, perturbedEqlbrmUnitArray)
+    totalChangesEquilibrium = cvm.countTotalChangesInUnitArray (arraySizeList, unitArray, perturbedEqlbrmUnitArray)
+
+    return (totalChangesPerturbations, totalChangesEquilibrium)
+
+
+####################################################################################################
+#
+# Function to run every benchmark for one grid size; returns a dict of the results
+#
+####################################################################################################
+
+def benchmarkGridSize (gridSize, repeats, legacyMaxSize):
+
+    totalNodes = gridSize*gridSize
+    runLegacy = gridSize <= legacyMaxSize
+
+    numpyGrid  = obtainBenchmarkGrid (gridSize, configVarsBackend='numpy')
+    legacyGrid = obtainBenchmarkGrid (gridSize, useVectorizedConfigVars=False)
+    fullRecountGrid = obtainBenchmarkGrid (gridSize, useLocalFEUpdate=False, configVarsBackend='numpy')
+
+    seedBenchmark (0)
+    unitArray = cvm.initializeExactCompositionMatrix (numpyGrid, h, x1TargetVal)
+    cvmLattice = cvm.obtainCVMLattice (numpyGrid)
+
+# The packed grid is generated directly in packed form, one row at a time
+    seedBenchmark (5)
+    packedArray = cvm.initializeGeneratedPackedMatrix (numpyGrid, h, x1TargetVal)
+    unpackedArray = cvm.unpackUnitArray (numpyGrid, packedArray)
+    seedBenchmark (5)
+    generatedArray = cvm.initializeGeneratedMatrix (numpyGrid, h, x1TargetVal)
+
+# Each timing is (name, seconds, nodes per call, swap trials per call); the nodes or the
+#   trials are None where they do not apply
+    timingsList = list()
+    checksList = list()
+
+# Counting the configuration variables, with each engine
+    (numpyTime, numpyCounts) = timeCall (repeats, 1, countBatch, numpyGrid, unitArray)
+    timingsList.append(('count: numpy', numpyTime, totalNodes, None))
+    (packedTime, packedCounts) = timeCall (repeats, 1, countPacked, numpyGrid, packedArray)
+    timingsList.append(('count: packed', packedTime, totalNodes, None))
+    engineCountsList = [('numpy', numpyCounts), ('packed', countPacked (numpyGrid, cvm.packUnitArray (numpyGrid, unitArray)))]
+    checksList.append(('packed grid: unpacked vs initializeGeneratedMatrix', 
+                       bool(np.array_equal(unpackedArray, generatedArray))))
+    checksList.append(('packed grid: packed again vs generated', 
+                       bool(np.array_equal(cvm.packUnitArray (numpyGrid, unpackedArray), packedArray))))
+    checksList.append(('packed grid: packed counts vs numpy counts of unpacked grid', 
+                       bool(np.array_equal(packedCounts, countBatch (numpyGrid, unpackedArray)))))
+    if cvm.compiledConfigVarsKernel is not None:
+        numbaGrid = obtainBenchmarkGrid (gridSize, configVarsBackend='numba')
+        countBatch (numbaGrid, unitArray)    # the first call compiles the kernel
+        (numbaTime, numbaCounts) = timeCall (repeats, 1, countBatch, numbaGrid, unitArray)
+        timingsList.append(('count: numba', numbaTime, totalNodes, None))
+        engineCountsList.append(('numba', numbaCounts))
+    if runLegacy:
+        (legacyTime, legacyCounts) = timeCall (1, 1, countLegacy, legacyGrid, unitArray)
+        timingsList.append(('count: legacy loops', legacyTime, totalNodes, None))
+        referenceName = 'legacy loops'
+        referenceCounts = legacyCounts
+    else:
+        referenceName = 'numpy'
+        referenceCounts = numpyCounts
+    for (engineName, engineCounts) in engineCountsList:
+        if engineName != referenceName:
+            checksList.append(('counts: %s vs %s' % (engineName, referenceName),
+                               bool(np.array_equal(engineCounts, referenceCounts))))
+
+# Thermodynamics, one grid at a time and as a batch
+    (thermTime, thermVals) = timeCall (repeats, 2, evaluateThermodynamics, numpyGrid, numpyCounts)
+    timingsList.append(('thermodynamics: one grid', thermTime, totalNodes, None))
+    configVarsArray = np.tile(numpyCounts, (thermBatchSize, 1))
+    (thermBatchTime, thermBatchVals) = timeCall (repeats, 2, evaluateThermodynamicsBatch, numpyGrid, configVarsArray)
+    timingsList.append(('thermodynamics: batch of %d' % (thermBatchSize), thermBatchTime, totalNodes*thermBatchSize, None))
+    checksList.append(('thermodynamics: batch vs computeThermodynamicVars',
+                       bool(np.allclose(thermBatchVals[0], thermVals, rtol=1e-12, atol=1e-12))))
+
+# One FE minimization, with the local update (and with the full recount, for the smaller grids);
+#   the starting count (a call with no trials) is taken off the time of the trials
+    minimizeFreeEnergy (numpyGrid, unitArray, 0)    # an untimed first call, so that one-time setup is not timed
+    (startCountTime, startArray) = timeCall (repeats, 3, minimizeFreeEnergy, numpyGrid, unitArray, 0)
+    timingsList.append(('FE minimization: starting count', startCountTime, totalNodes, None))
+    (minimizeTime, longMinimumArray) = timeCall (repeats, 3, minimizeFreeEnergy, numpyGrid, unitArray, feLocalUpdateTrials)
+    timingsList.append(('FE minimization: local update', minimizeTime - startCountTime, None, feLocalUpdateTrials))
+    seedBenchmark (3)
+    localMinimumArray = minimizeFreeEnergy (numpyGrid, unitArray, feMinimizationTrials)
+    if runLegacy:
+        (fullStartCountTime, fullStartArray) = timeCall (1, 3, minimizeFreeEnergy, fullRecountGrid, unitArray, 0)
+        (fullMinimizeTime, fullMinimumArray) = timeCall (1, 3, minimizeFreeEnergy, fullRecountGrid, unitArray, 
+                                                         feMinimizationTrials)
+        timingsList.append(('FE minimization: full recount', fullMinimizeTime - fullStartCountTime, None, 
+                            feMinimizationTrials))
+        checksList.append(('FE minimization: local update vs full recount',
+                           bool(np.array_equal(localMinimumArray, fullMinimumArray))))
+
+# One perturbation cycle (perturb, re-minimize, count the changes)
+    (cycleTime, cycleChanges) = timeCall (repeats, 4, runPerturbationCycle, numpyGrid, localMinimumArray)
+    timingsList.append(('perturbation cycle', cycleTime, totalNodes, None))
+
+    latticeBytes = sum(tableArray.nbytes for tableArray in vars(cvmLattice).values() if isinstance(tableArray, np.ndarray))
+    memoryDict = {'unitArrayBytes': unitArray.nbytes,
+                  'packedArrayBytes': packedArray.nbytes,
+                  'latticeTablesBytes': latticeBytes,
+                  'peakProcessMegabytes': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024.0}
+
+    sizeResultsDict = {'gridSize': gridSize,
+                       'timings': [{'name': timingName, 'seconds': timingSeconds,
+                                    'nodesPerSecond': (timingNodes/timingSeconds if timingSeconds > 0.0 else 0.0)
+                                                      if timingNodes is not None else None,
+                                    'secondsPerTrial': timingSeconds/timingTrials if timingTrials is not None else None}
+                                   for (timingName, timingSeconds, timingNodes, timingTrials) in timingsList],
+                       'checks': [{'name': checkName, 'passed': checkPassed} for (checkName, checkPassed) in checksList],
+                       'memory': memoryDict}
+
+    return (sizeResultsDict)
+
+
+####################################################################################################
+#
+# Function to print the results for one grid size
+#
+####################################################################################################
+
+def printGridSizeResults (sizeResultsDict):
+
+    gridSize = sizeResultsDict['gridSize']
+    memoryDict = sizeResultsDict['memory']
+
+    print ' '
+    print ' Grid size %d x %d' % (gridSize, gridSize)
+    print '   %-44s %12s %16s %16s' % ('operation', 'seconds', 'nodes/second', 'seconds/trial')
+    for timingDict in sizeResultsDict['timings']:
+        nodesPerSecondText = '-' if timingDict['nodesPerSecond'] is None else '%.4g' % (timingDict['nodesPerSecond'])
+        secondsPerTrialText = '-' if timingDict['secondsPerTrial'] is None else '%.4g' % (timingDict['secondsPerTrial'])
+        print '   %-44s %12.6f %16s %16s' % (timingDict['name'], timingDict['seconds'], nodesPerSecondText, 
+                                             secondsPerTrialText)
+    print '   memory: unitArray %d bytes, packed grid %d bytes, lattice tables %d bytes, process peak %.1f MB' % (
+        memoryDict['unitArrayBytes'], memoryDict['packedArrayBytes'], memoryDict['latticeTablesBytes'],
+        memoryDict['peakProcessMegabytes'])
+    for checkDict in sizeResultsDict['checks']:
+        print '   check: %-60s %s' % (checkDict['name'], 'OK' if checkDict['passed'] else 'MISMATCH')
+
+
+####################################################################################################
+#
+# Main procedure
+#
+####################################################################################################
+
+def main():
+
+    argumentParser = argparse.ArgumentParser(description='Benchmark suite for the 2-D CVM perturbation engine')
+    argumentParser.add_argument('--sizes', type=int, nargs='+', default=[16, 64, 256, 1024], help='grid sizes (square)')
+    argumentParser.add_argument('--repeats', type=int, default=3, help='timed repeats per measurement (the median is kept)')
+    argumentParser.add_argument('--legacy-max-size', type=int, default=256, help='largest grid for the legacy loops')
+    argumentParser.add_argument('--json', default=None, help='file to write the results to, as JSON')
+    arguments = argumentParser.parse_args()
+
+    print ' '
+    print ' 2-D CVM benchmark: x1 = %.2f, h = %.2f, seed = %d' % (x1TargetVal, h, benchmarkSeed)
+    print ' Compiled (Numba) kernel available:', cvm.compiledConfigVarsKernel is not None
+
+    benchmarkResultsList = list()
+    for gridSize in arguments.sizes:
+        sizeResultsDict = benchmarkGridSize (gridSize, arguments.repeats, arguments.legacy_max_size)
+        printGridSizeResults (sizeResultsDict)
+        benchmarkResultsList.append(sizeResultsDict)
+
+    print ' '
+    allChecksPassed = all(checkDict['passed'] for sizeResultsDict in benchmarkResultsList for checkDict in sizeResultsDict['checks'])
+    print ' All correctness checks passed' if allChecksPassed else ' SOME CORRECTNESS CHECKS FAILED'
+    print ' '
+
+    if arguments.json is not None:
+        with open(arguments.json, 'w') as jsonFile:
+            json.dump({'seed': benchmarkSeed, 'x1TargetVal': x1TargetVal, 'h': h, 'results': benchmarkResultsList},
+                      jsonFile, indent=2, sort_keys=True)
+        print ' Saved the results to', arguments.json
+
+    if not allChecksPassed:
+        sys.exit(1)
+
+
+if __name__ == "__main__": main()
@@ -8,11 +8,9 @@
 import random
 import itertools
 import numpy as np
-import pylab
-import matplotlib
 from math import exp
 from math import log
-from matplotlib import pyplot as plt
+# pylab (matplotlib) is imported inside the plotting procedures, only when a plot is made
 from random import randrange, uniform #(not sure this is needed, since I'm importing random)
 
 
@@ -3452,6 +3450,7 @@ def computeConfigAndThermVars(arraySizeList, h, x1TargetVal, maxXDif, numTrials,
         print '    Free Engy: %.4f' % (avgFreeEnergy)     
     # Plot the results from that FOR loop (multiple tests of a random grid for a given x1 value)          
     #    print '     and the free energy is in red, also shifted by 0.6.'   
+        import pylab
         pylab.figure(1)
         pylab.plot (xArray,negSArray)    
         pylab.plot (xArray, y2Array, 'm')
@@ -3739,6 +3738,7 @@ def printUnitArrayModificationResults (x1ValsArray, y2ValsArray,
 
     # Plot the results from that FOR loop (adjusting the unitArray to achieve free energy minimization)                                             
                                                                                                 
+    import pylab
     pylab.figure(1)
     pylab.plot (trialNumArray, negSValsArray)          
     pylab.plot (trialNumArray, y2ValsArray-0.8, 'g')     
@@ -5,14 +5,28 @@
 ####################################################################################################
 # Import the following Python packages
 
+import os
+import sys
+import glob
+import json
+import hashlib
+import timeit
 import random
 import itertools
+import cPickle
+import multiprocessing
 import numpy as np
-import pylab
-import matplotlib
+try:
+    import numba
+except ImportError:
+    numba = None
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
 from math import exp
 from math import log
-from matplotlib import pyplot as plt
 from random import randrange, uniform #(not sure this is needed, since I'm importing random)
 
 
@@ -126,14 +140,259 @@ def welcome ():
 ####################################################################################################
 ####################################################################################################
 #
-# Function to obtain the array size specifications (currently DEFINED for the user; not a choice)
+# Class to hold the settings for a run: the debug-print switches (True turns the printing off),
+#   the spacing used in the grid printouts, and the choice of engines for counting the
+#   configuration variables and for reaching the free energy minimum.
+# The defaults are the values used in **main**; see **main** for what each setting selects.
 #
-# Note: The code is ONLY set up to work with a grid consisting of an EVEN number of rows
+####################################################################################################
+####################################################################################################
+
+class CVMRunConfig (object):
+
+    def __init__ (self):
+
+        self.debugPrintOff = True
+        self.detailedDebugPrintOff = True
+        self.ZDebugPrintOff = True
+        self.detailedAdjustMatrixPrintOff = True
+        self.beforeAndAfterAdjustedMatrixPrintOff = True
+        self.blnkspc = ' '
+
+        self.useExactCompositionInit = True
+        self.useVectorizedConfigVars = True
+        self.useLocalFEUpdate = True
+        self.configVarsBackend = 'auto'
+
+        self.plotMode = 'show'
+        self.plotDirectory = 'cvm-plots'
+
+        self.useProfiling = False
+        self.profileFileName = 'cvm-perturb-profile.json'
+
+        self.useKawasakiSampler = False
+        self.kawasakiTemperature = 0.1
+        self.kawasakiTotalSweeps = 20
+        self.kawasakiBurnInSweeps = 10
+        self.kawasakiThinning = 1
+
+        self.conservePerturbX1 = False
+
+        self.equilibriumCacheDirectory = None
+        self.equilibriumCacheMaxBytes = 64*1024*1024
+
+
+####################################################################################################
+####################################################################################################
+#
+# Class to hold the grid geometry, together with the run settings (a CVMRunConfig).
+#
+# A CVMGrid is the tuple (arrayLength, arrayLayers), so it is passed as "arraySizeList" and used
+#   as arraySizeList[0], arraySizeList[1] exactly as before. It also carries:
+#     arraySizeList.arrayLength, arraySizeList.arrayLayers
+#     arraySizeList.pairs       - the total number of PAIRS of zigzag chains
+#     arraySizeList.evenLayers  - True if there is an even number of layers
+#     arraySizeList.runConfig   - the CVMRunConfig for this run
+#     arraySizeList.randomState - the np.random.RandomState that every random choice made for
+#                                 this grid is drawn from (see obtainRandomState); None uses the
+#                                 global np.random generator
+# Since nothing is held in global variables, grids of different sizes (or with different
+#   settings) can be worked on side by side, in one process or in several.
+#
+####################################################################################################
+####################################################################################################
+
+class CVMGrid (tuple):
+
+    def __new__ (cls, arrayLength, arrayLayers, runConfig=None, randomState=None):
+
+        cvmGrid = tuple.__new__(cls, (arrayLength, arrayLayers))
+
+        cvmGrid.arrayLength = arrayLength
+        cvmGrid.arrayLayers = arrayLayers
+        cvmGrid.pairs = int(arrayLayers/2)
+        cvmGrid.evenLayers = (arrayLayers % 2 == 0)
+
+        if runConfig is None: runConfig = CVMRunConfig ()
+        cvmGrid.runConfig = runConfig
+        cvmGrid.randomState = randomState
+
+        return cvmGrid
+
+# Used when a CVMGrid is pickled (e.g., sent to a worker process), so that it is rebuilt by __new__
+    def __getnewargs__ (self):
+
+        return (self.arrayLength, self.arrayLayers, self.runConfig, self.randomState)
+
+
+####################################################################################################
+#
+# Function to return the random number generator for a grid: its own RandomState if it has one,
+#   otherwise the global np.random generator (which has the same methods)
+#
+####################################################################################################
+
+def obtainRandomState (arraySizeList):
+
+    if arraySizeList.randomState is None:
+        return (np.random)
+
+    return (arraySizeList.randomState)
+
+####################################################################################################
+####################################################################################################
+#
+# Profiling
+#
+# When runConfig.useProfiling is set, enableProfiling wraps each of the functions listed in 
+#   profiledPhasesList, so that every call adds to that phase's entry in cvmProfileDict:
+#     [number of calls, total wall time in seconds, number of evaluations]
+#   An evaluation is one grid: a call to a Batch function counts every grid in its stack (the
+#   argument at the listed position), and any other call counts one.
+# The wrappers replace the functions in this module's namespace, so when profiling is off nothing
+#   is wrapped and there is no overhead at all. The times are inclusive: a phase that calls
+#   another phase (e.g., adjustMatrixFEMinimum calling computeSwapDeltaConfigVariables) includes
+#   that time too.
+# At the end of a run, printProfileReport prints the summary table, and saveProfileJson writes the
+#   same numbers to a JSON file.
+#
+####################################################################################################
+####################################################################################################
+
+profiledPhasesList = (('initializeMatrix', None),
+                      ('initializeExactCompositionMatrix', None),
+                      ('adjustMatrix', None),
+                      ('adjustMatrixFEMinimum', None),
+                      ('adjustMatrixFEMinimumBatch', 1),
+                      ('computeSwapDeltaConfigVariables', None),
+                      ('computeConfigVariables', None),
+                      ('computeConfigVariablesBatch', 1),
+                      ('computeThermodynamicVars', None),
+                      ('computeThermodynamicVarsBatch', 2),
+                      ('perturb', None),
+                      ('countTotalChangesInUnitArray', None))
+
+cvmProfileDict = dict()
+
+####################################################################################################
+#
+# Function to build the timing wrapper for one phase
+#
+####################################################################################################
+
+def obtainProfiledFunction (phaseName, phaseFunction, stackArgPosition):
+
+    def profiledFunction (*args, **kwargs):
+        startTime = timeit.default_timer()
+        try:
+            return phaseFunction(*args, **kwargs)
+        finally:
+            elapsedTime = timeit.default_timer() - startTime
+            evaluations = 1 if stackArgPosition is None else len(args[stackArgPosition])
+            phaseEntry = cvmProfileDict.setdefault(phaseName, [0, 0.0, 0])
+            phaseEntry[0] = phaseEntry[0] + 1
+            phaseEntry[1] = phaseEntry[1] + elapsedTime
+            phaseEntry[2] = phaseEntry[2] + evaluations
+
+    profiledFunction.unprofiledFunction = phaseFunction
+    profiledFunction.__name__ = phaseFunction.__name__
+
+    return profiledFunction
+
+
+####################################################################################################
+#
+# Function to wrap every profiled phase (it does nothing if they are already wrapped)
+#
+####################################################################################################
+
+def enableProfiling ():
+
+    moduleNamespace = globals()
+    for (phaseName, stackArgPosition) in profiledPhasesList:
+        phaseFunction = moduleNamespace[phaseName]
+        if not hasattr(phaseFunction, 'unprofiledFunction'):
+            moduleNamespace[phaseName] = obtainProfiledFunction (phaseName, phaseFunction, stackArgPosition)
+
+
+####################################################################################################
+#
+# Function to add the profile from another process (e.g., one sweep cell) into cvmProfileDict
+#
+####################################################################################################
+
+def mergeProfile (otherProfileDict):
+
+    for phaseName, otherEntry in otherProfileDict.items():
+        phaseEntry = cvmProfileDict.setdefault(phaseName, [0, 0.0, 0])
+        for k in range (0, 3):
+            phaseEntry[k] = phaseEntry[k] + otherEntry[k]
+
+
+####################################################################################################
+#
+# Function to print the summary table
+#
+####################################################################################################
+
+def printProfileReport (totalWallTime):
+
+    print ' '
+    print ' Profile (wall times are inclusive, and summed over all worker processes)'
+    print ' '
+    print '   phase                                 calls    evals     total s    ms/call     evals/s'
+    for (phaseName, stackArgPosition) in profiledPhasesList:
+        if phaseName not in cvmProfileDict:
+            continue
+        (calls, phaseTime, evaluations) = cvmProfileDict[phaseName]
+        evalsPerSecond = evaluations/phaseTime if phaseTime > 0.0 else 0.0
+        print '   %-34s %8d %8d %11.3f %10.3f %11.1f' % (phaseName, calls, evaluations, phaseTime, 
+                                                           1000.0*phaseTime/calls, evalsPerSecond)
+    print ' '
+    print '   total wall time of the run: %.3f s' % (totalWallTime)
+    print ' '
+
+
+####################################################################################################
+#
+# Function to write the profile as JSON
+#
+####################################################################################################
+
+def saveProfileJson (profileFileName, arraySizeList, totalWallTime):
+
+    phasesDict = dict()
+    for phaseName, (calls, phaseTime, evaluations) in cvmProfileDict.items():
+        phasesDict[phaseName] = {'calls': calls, 
+                                 'evaluations': evaluations, 
+                                 'totalSeconds': phaseTime, 
+                                 'secondsPerCall': phaseTime/calls, 
+                                 'evaluationsPerSecond': evaluations/phaseTime if phaseTime > 0.0 else 0.0}
+
+    profileReportDict = {'arrayLength': arraySizeList.arrayLength, 
+                         'arrayLayers': arraySizeList.arrayLayers, 
+                         'configVarsBackend': obtainConfigVarsBackend (arraySizeList), 
+                         'totalWallSeconds': totalWallTime, 
+                         'phases': phasesDict}
+
+    with open(profileFileName, 'w') as profileFile:
+        json.dump(profileReportDict, profileFile, indent=2, sort_keys=True)
+    print ' Saved the profile to', profileFileName
+
+
+
+####################################################################################################
+####################################################################################################
+#
+# Function to obtain the array size specifications. The default is a 16 x 16 grid; running the
+#   program with --length N and/or --layers M selects another size, e.g. for scaling studies.
+#   Any length and any number of layers (even or odd) may be used, as long as each is at least 2;
+#   with an odd number of layers, the last zigzag chain wraps around from the last row to row 0.
 #
 ####################################################################################################
 ####################################################################################################
 
-def obtainArraySizeSpecs ():
+def obtainArraySizeSpecs (argumentsList=None):
     
 #    x = input('Enter arraylength: ')
 #    arraylength = int(x)
@@ -143,14 +402,48 @@ def obtainArraySizeSpecs ():
 #    layers = int(x)
 #    print 'layers is', layers
  
+    if argumentsList is None: argumentsList = sys.argv[1:]
 
     arraylength = 16
     layers = 16
+
+    for argNum in range (0, len(argumentsList)):
+        if argumentsList[argNum] in ('--length', '--layers'):
+            if argNum+1 == len(argumentsList) or not argumentsList[argNum+1].isdigit():
+                raise ValueError('%s needs a whole number of units' % argumentsList[argNum])
+            if argumentsList[argNum] == '--length':
+                arraylength = int(argumentsList[argNum+1])
+            else: 
+                layers = int(argumentsList[argNum+1])
+
+    if arraylength < 2 or layers < 2:
+        raise ValueError('The grid needs at least 2 units per row and 2 layers, not %d x %d' % (arraylength, layers))
                             
     arraySizeList = (arraylength, layers)  
     return (arraySizeList)  
 
 
+####################################################################################################
+#
+# Function to obtain the value given after a command-line option (e.g., the file name after
+#   --checkpoint); returns None if the option is not given
+#
+####################################################################################################
+
+def obtainOptionValue (optionName, argumentsList=None):
+
+    if argumentsList is None: argumentsList = sys.argv[1:]
+
+    optionValue = None
+    for argNum in range (0, len(argumentsList)):
+        if argumentsList[argNum] == optionName:
+            if argNum+1 == len(argumentsList) or argumentsList[argNum+1].startswith('--'):
+                raise ValueError('%s needs a value' % optionName)
+            optionValue = argumentsList[argNum+1]
+
+    return (optionValue)
+
+
 ####################################################################################################
 ####################################################################################################
 #
@@ -180,11 +473,65 @@ def initializeGeneratedMatrix (arraySizeList, h, x1TargetVal):
 # Note: this function can be used to create proportional distributions: np.random.choice([0, 1], size=(10,), p=[1./3, 2./3])
 
     x2TargetVal = 1.-x1TargetVal
-    unitArray = np.random.choice([0, 1],size=(localArrayLayers,localArrayLength), p=[x2TargetVal, x1TargetVal])
+    randomState = obtainRandomState (arraySizeList)
+    unitArray = randomState.choice([0, 1],size=(localArrayLayers,localArrayLength), p=[x2TargetVal, x1TargetVal])
     
     return unitArray
 
 
+####################################################################################################
+####################################################################################################
+#
+# Function to generate an array with EXACTLY the target fraction of A units (to the nearest unit).
+#   This is a stack of one grid from initializeExactCompositionMatrixBatch; it takes O(N) steps,
+#   with no retries, and there is nothing left for adjustMatrix to do.
+#
+#    Inputs:    arraySizeList: a list of two integers; arrayLength and layers
+#               h: the interaction enthalpy parameter (not used; kept to match initializeMatrix)
+#               x1TargetVal: the desired x1 in the unitArray
+#    Return: the matrix unitArray, a matrix of 0's and 1's.
+#
+####################################################################################################
+####################################################################################################
+
+def initializeExactCompositionMatrix (arraySizeList, h, x1TargetVal):
+
+    unitArray = initializeExactCompositionMatrixBatch (arraySizeList, h, x1TargetVal, 1)[0]
+
+    return unitArray
+
+
+####################################################################################################
+#
+# Function to generate a stack of numGrids arrays, each with exactly round(x1*N) A units.
+#   Each grid gets its own random keys; the units with the round(x1*N) smallest keys are set
+#   to A. np.argpartition finds them in O(N) steps per grid, for all of the grids at once.
+#
+#    Return: unitArrayStack, with shape (numGrids, arrayLayers, arrayLength)
+#
+####################################################################################################
+
+def initializeExactCompositionMatrixBatch (arraySizeList, h, x1TargetVal, numGrids):
+
+    localArrayLength = arraySizeList[0]
+    localArrayLayers = arraySizeList[1]
+    totalUnits = localArrayLength*localArrayLayers
+
+    totalX1Units = int(round(x1TargetVal*totalUnits))
+
+    unitVectorStack = np.zeros((numGrids, totalUnits), dtype=np.int)
+    if totalX1Units >= totalUnits:
+        unitVectorStack[:, :] = 1
+    elif totalX1Units > 0:
+        randomKeysStack = obtainRandomState(arraySizeList).random_sample((numGrids, totalUnits))
+        x1UnitsStack = np.argpartition(randomKeysStack, totalX1Units, axis=1)[:, 0:totalX1Units]
+        unitVectorStack[np.arange(numGrids).reshape(numGrids, 1), x1UnitsStack] = 1
+
+    unitArrayStack = unitVectorStack.reshape(numGrids, localArrayLayers, localArrayLength)
+
+    return unitArrayStack
+
+
 ####################################################################################################
 ####################################################################################################
 #
@@ -207,6 +554,10 @@ def initializeGeneratedMatrix (arraySizeList, h, x1TargetVal):
 
  
 def initializeMatrix (arraySizeList, h, x1TargetVal, maxXDif):
+
+    pairs = arraySizeList.pairs
+    debugPrintOff = arraySizeList.runConfig.debugPrintOff
+    blnkspc = arraySizeList.runConfig.blnkspc
          
     localArrayLength = arraySizeList[0]
     localArrayLayers = arraySizeList[1]
@@ -239,7 +590,7 @@ def initializeMatrix (arraySizeList, h, x1TargetVal, maxXDif):
         print 'The L x M array of units, where M (across) =', localArrayLength, 'and L (layers) =', localArrayLayers
         print 
 
-# Determining "pairs" - the total number of pairs of zigzag chains - is done in __main__; "pairs" is a global variable
+# Determining "pairs" - the total number of pairs of zigzag chains - is done by CVMGrid; it is arraySizeList.pairs
 
 
     if not debugPrintOff:
@@ -256,6 +607,12 @@ def initializeMatrix (arraySizeList, h, x1TargetVal, maxXDif):
             for j in range(0,localArrayLength):
                 print unitArray[actualOddRowNum,j], blnkspc,
             print 
+        if not arraySizeList.evenLayers:
+            lastRowNum = 2*pairs
+            print 'Row', lastRowNum, ':', blnkspc, 
+            for j in range(0,localArrayLength):
+                print unitArray[lastRowNum,j], blnkspc,
+            print 
         print ' '
     
 
@@ -282,6 +639,9 @@ def initializeMatrix (arraySizeList, h, x1TargetVal, maxXDif):
 
 def computeConfigXVariables (arraySizeList, unitArray):
 
+    debugPrintOff = arraySizeList.runConfig.debugPrintOff
+    detailedAdjustMatrixPrintOff = arraySizeList.runConfig.detailedAdjustMatrixPrintOff
+
 
 ####################################################################################################
 # This section unpacks the input variable arraySizeList
@@ -353,6 +713,8 @@ def computeConfigXVariables (arraySizeList, unitArray):
 
 def computeConfigYEvenRowZigzagVariables (arraySizeList, unitArray, topRow):
 
+    debugPrintOff = arraySizeList.runConfig.debugPrintOff
+
 
 ####################################################################################################
 # This section unpacks the input variable arraySizeList
@@ -399,6 +761,8 @@ def computeConfigYEvenRowZigzagVariables (arraySizeList, unitArray, topRow):
   #      next_row = i+1
     top_row = topRow
     next_row = topRow + 1
+# With an odd number of layers, the last (even) chain wraps around to row 0
+    if next_row == arrayLayers: next_row = 0
   
 
 # Start counting through the array elements, L->R.
@@ -543,6 +907,8 @@ def computeConfigYEvenRowZigzagVariables (arraySizeList, unitArray, topRow):
 
 def computeConfigYOddRowZigzagVariables (arraySizeList, unitArray, topRow):
 
+    debugPrintOff = arraySizeList.runConfig.debugPrintOff
+
 
 ####################################################################################################
 # This section unpacks the input variable arraySizeList
@@ -716,6 +1082,9 @@ def computeConfigYOddRowZigzagVariables (arraySizeList, unitArray, topRow):
 
 def computeConfigYVariables (arraySizeList, unitArray):
 
+    pairs = arraySizeList.pairs
+    debugPrintOff = arraySizeList.runConfig.debugPrintOff
+
 # Initialize the y'i variables
 
     y1 = y2 = y3 = 0
@@ -789,7 +1158,17 @@ def computeConfigYVariables (arraySizeList, unitArray):
 #        print ' '
 #        print ' -----------'
 #        print ' '    
-# NOTE: Still need to write the computation for an extra odd row in grid, if it exists
+
+# With an odd number of layers, there is one more zigzag chain after the pairs: its top row is the
+#   last (even-numbered) row, and it wraps around to row 0
+    if not arraySizeList.evenLayers:
+        topRow = 2*pairs
+        if not debugPrintOff:
+            print '  Row: ', topRow
+        configVarsYList = computeConfigYEvenRowZigzagVariables (arraySizeList, unitArray, topRow) 
+        y1 = y1+configVarsYList[0]
+        y2 = y2+configVarsYList[1]
+        y3 = y3+configVarsYList[2]
 
     configVarsYList = (y1, y2, y3)                                                                                                                                                                        
     return (configVarsYList)
@@ -809,6 +1188,8 @@ def computeConfigYVariables (arraySizeList, unitArray):
 
 def computeConfigWHorizontalRowVariables (arraySizeList, unitArray):
 
+    debugPrintOff = arraySizeList.runConfig.debugPrintOff
+
 
 ####################################################################################################
 # This section unpacks the input variable arraySizeList
@@ -916,6 +1297,8 @@ def computeConfigWHorizontalRowVariables (arraySizeList, unitArray):
 
 def computeConfigWVerticalColVariables (arraySizeList, unitArray):
 
+    debugPrintOff = arraySizeList.runConfig.debugPrintOff
+
 
 ####################################################################################################
 # This section unpacks the input variable arraySizeList
@@ -1005,6 +1388,9 @@ def computeConfigWVerticalColVariables (arraySizeList, unitArray):
 
 def computeConfigWVariables (arraySizeList, unitArray):
 
+    arrayLayers = arraySizeList.arrayLayers
+    debugPrintOff = arraySizeList.runConfig.debugPrintOff
+
 # Initialize the y'i variables
 
     w1 = w2 = w3 = 0
@@ -1038,7 +1424,8 @@ def computeConfigWVariables (arraySizeList, unitArray):
         print ' '
 
   
-# NOTE: Still need to write the computation for an extra odd row in grid, if it exists
+# The horizontal and vertical w(i) pairs are counted row by row (the vertical pairs wrap around 
+#   modulo arrayLayers), so an odd number of layers needs no extra step here
 
 
     configVarsWList = computeConfigWVerticalColVariables (arraySizeList, unitArray)
@@ -1079,7 +1466,9 @@ def computeConfigWVariables (arraySizeList, unitArray):
 
 
 
-def computeSpecificTripletZVariable (U, NN, NNN):
+def computeSpecificTripletZVariable (arraySizeList, U, NN, NNN):
+
+    detailedDebugPrintOff = arraySizeList.runConfig.detailedDebugPrintOff
 
 # Debug print statements
     if not detailedDebugPrintOff:
@@ -1171,12 +1560,15 @@ def debugPrintZ (z1_incr, left_z2_incr, right_z2_incr, z3_incr, z4_incr, left_z5
 
 def computeConfigZEvenUpperToLower (arraySizeList, unitArray, top_row):
 
+    detailedDebugPrintOff = arraySizeList.runConfig.detailedDebugPrintOff
+
     arrayLength = arraySizeList [0]
     arrayLayers = arraySizeList [1]
     unit_array = unitArray
     
 # Create the array to hold the partial (the increments in the) z'i's, and populate it with zeros
-    zPartialArray = np.zeros((arrayLength), dtype=np.int)
+#   (eight of them: z1, left/right z2, z3, z4, left/right z5, z6, whatever the array length)
+    zPartialArray = np.zeros(8, dtype=np.int)
 
   
     z1_partial = left_z2_partial = right_z2_partial = z3_partial = 0
@@ -1184,6 +1576,7 @@ def computeConfigZEvenUpperToLower (arraySizeList, unitArray, top_row):
 
 
     next_row = top_row + 1
+    if next_row == arrayLayers: next_row = 0
 
 # Start counting through the array elements, L->R.
     for j in range(0, arrayLength-1):
@@ -1191,7 +1584,7 @@ def computeConfigZEvenUpperToLower (arraySizeList, unitArray, top_row):
         NN = unit_array[next_row,j]
         NNN = unit_array[top_row, j+1]
 
-        TripletValueList = computeSpecificTripletZVariable (U, NN, NNN)
+        TripletValueList = computeSpecificTripletZVariable (arraySizeList, U, NN, NNN)
 
     
 
@@ -1256,18 +1649,22 @@ def computeConfigZEvenUpperToLower (arraySizeList, unitArray, top_row):
 
 def computeConfigZEvenLowerToUpper (arraySizeList, unitArray, top_row):
 
+    detailedDebugPrintOff = arraySizeList.runConfig.detailedDebugPrintOff
+
     arrayLength = arraySizeList [0]
     arrayLayers = arraySizeList [1]
     unit_array = unitArray
     
 # Create the array to hold the partial (the increments in the) z'i's, and populate it with zeros
-    zPartialArray = np.zeros((arrayLength), dtype=np.int)
+#   (eight of them: z1, left/right z2, z3, z4, left/right z5, z6, whatever the array length)
+    zPartialArray = np.zeros(8, dtype=np.int)
 
   
     z1_partial = left_z2_partial = right_z2_partial = z3_partial = 0
     z4_partial = left_z5_partial = right_z5_partial = z6_partial = 0
 
     next_row = top_row + 1
+    if next_row == arrayLayers: next_row = 0
 
 
 # NOTE: We are computing the SECOND row of triplets in a zigzag chain,
@@ -1278,7 +1675,7 @@ def computeConfigZEvenLowerToUpper (arraySizeList, unitArray, top_row):
         NN = unit_array[top_row,j+1]
         NNN = unit_array[next_row, j+1]
 
-        TripletValueList = computeSpecificTripletZVariable (U, NN, NNN)
+        TripletValueList = computeSpecificTripletZVariable (arraySizeList, U, NN, NNN)
 
     
     # Debug print statements
@@ -1341,9 +1738,13 @@ def computeConfigZEvenLowerToUpper (arraySizeList, unitArray, top_row):
 # 
 #-------------------------------------------
 
-def printEvenToOddRows (top_row, unit_array):
+def printEvenToOddRows (arraySizeList, top_row, unit_array):
+
+    arrayLength = arraySizeList.arrayLength
+    blnkspc = arraySizeList.runConfig.blnkspc
 
     next_row = top_row + 1
+    if next_row == arraySizeList.arrayLayers: next_row = 0
     print ' *************************'
     print ' '     
     print 'top_row = ', top_row, ' next_row = ', next_row
@@ -1374,6 +1775,10 @@ def printEvenToOddRows (top_row, unit_array):
 
 def computeConfigZVariablesEvenToOdd (arraySizeList, unitArray, topRow):
 
+    debugPrintOff = arraySizeList.runConfig.debugPrintOff
+    detailedDebugPrintOff = arraySizeList.runConfig.detailedDebugPrintOff
+    ZDebugPrintOff = arraySizeList.runConfig.ZDebugPrintOff
+
 
 ####################################################################################################
 # This section unpacks the input variable arraySizeList
@@ -1448,9 +1853,10 @@ def computeConfigZVariablesEvenToOdd (arraySizeList, unitArray, topRow):
  #      next_row = i+1
     top_row = topRow
     next_row = topRow + 1  
+    if next_row == arrayLayers: next_row = 0
 
     if not ZDebugPrintOff: 
-        printEvenToOddRows (top_row, unit_array)       
+        printEvenToOddRows (arraySizeList, top_row, unit_array)       
       
     z1_partial = left_z2_partial = right_z2_partial = z3_partial = 0
     z4_partial = left_z5_partial = right_z5_partial = z6_partial = 0
@@ -1514,7 +1920,7 @@ def computeConfigZVariablesEvenToOdd (arraySizeList, unitArray, topRow):
     NN = unit_array[next_row,arrayLength-1]
     NNN = unit_array[top_row, 0]
 
-    TripletValueList = computeSpecificTripletZVariable (U, NN, NNN)
+    TripletValueList = computeSpecificTripletZVariable (arraySizeList, U, NN, NNN)
 
     
     # Debug print statements
@@ -1656,7 +2062,7 @@ def computeConfigZVariablesEvenToOdd (arraySizeList, unitArray, topRow):
     NN = unit_array[top_row,0]
     NNN = unit_array[next_row, 0]
 
-    TripletValueList = computeSpecificTripletZVariable (U, NN, NNN)
+    TripletValueList = computeSpecificTripletZVariable (arraySizeList, U, NN, NNN)
 
     
     # Debug print statements
@@ -1754,12 +2160,15 @@ def computeConfigZVariablesEvenToOdd (arraySizeList, unitArray, topRow):
 
 def computeConfigZOddUpperToLower (arraySizeList, unitArray, top_row):
 
+    detailedDebugPrintOff = arraySizeList.runConfig.detailedDebugPrintOff
+
     arrayLength = arraySizeList [0]
     arrayLayers = arraySizeList [1]
     unit_array = unitArray
     
 # Create the array to hold the partial (the increments in the) z'i's, and populate it with zeros
-    zPartialArray = np.zeros((arrayLength), dtype=np.int)
+#   (eight of them: z1, left/right z2, z3, z4, left/right z5, z6, whatever the array length)
+    zPartialArray = np.zeros(8, dtype=np.int)
 
   
     z1_partial = left_z2_partial = right_z2_partial = z3_partial = 0
@@ -1777,7 +2186,7 @@ def computeConfigZOddUpperToLower (arraySizeList, unitArray, top_row):
         NN = unit_array[next_row,j+1]
         NNN = unit_array[top_row, j+1]
 
-        TripletValueList = computeSpecificTripletZVariable (U, NN, NNN)
+        TripletValueList = computeSpecificTripletZVariable (arraySizeList, U, NN, NNN)
 
     
     # Debug print statements
@@ -1845,12 +2254,16 @@ def computeConfigZOddUpperToLower (arraySizeList, unitArray, top_row):
 
 def computeConfigZOddLowerToUpper (arraySizeList, unitArray, top_row):
 
+    detailedDebugPrintOff = arraySizeList.runConfig.detailedDebugPrintOff
+    ZDebugPrintOff = arraySizeList.runConfig.ZDebugPrintOff
+
     arrayLength = arraySizeList [0]
     arrayLayers = arraySizeList [1]
     unit_array = unitArray
     
 # Create the array to hold the partial (the increments in the) z'i's, and populate it with zeros
-    zPartialArray = np.zeros((arrayLength), dtype=np.int)
+#   (eight of them: z1, left/right z2, z3, z4, left/right z5, z6, whatever the array length)
+    zPartialArray = np.zeros(8, dtype=np.int)
 
   
     z1_partial = left_z2_partial = right_z2_partial = z3_partial = 0
@@ -1880,7 +2293,7 @@ def computeConfigZOddLowerToUpper (arraySizeList, unitArray, top_row):
         if not detailedDebugPrintOff:
             if top_row == 15:
                 print ' For top_row = ', top_row, ' and j = ', j, ', then U = ', U, ' and next_row = ', next_row, ' and j+1 is ', j+1, ' and NN = ', NN 
-        TripletValueList = computeSpecificTripletZVariable (U, NN, NNN)
+        TripletValueList = computeSpecificTripletZVariable (arraySizeList, U, NN, NNN)
 
     
     # Debug print statements
@@ -1936,7 +2349,11 @@ def computeConfigZOddLowerToUpper (arraySizeList, unitArray, top_row):
 # 
 #-------------------------------------------
 
-def printOddToEvenRows (top_row, unit_array):
+def printOddToEvenRows (arraySizeList, top_row, unit_array):
+
+    arrayLength = arraySizeList.arrayLength
+    arrayLayers = arraySizeList.arrayLayers
+    blnkspc = arraySizeList.runConfig.blnkspc
 
     next_row = top_row + 1
     bottom_row = arrayLayers - 1
@@ -1971,6 +2388,10 @@ def printOddToEvenRows (top_row, unit_array):
 
 def computeConfigZVariablesOddToEven (arraySizeList, unitArray, topRow):
 
+    debugPrintOff = arraySizeList.runConfig.debugPrintOff
+    detailedDebugPrintOff = arraySizeList.runConfig.detailedDebugPrintOff
+    ZDebugPrintOff = arraySizeList.runConfig.ZDebugPrintOff
+
 
 ####################################################################################################
 # This section unpacks the input variable arraySizeList
@@ -1990,7 +2411,7 @@ def computeConfigZVariablesOddToEven (arraySizeList, unitArray, topRow):
         print "Just entered computeConfigZVariables: Odd-to-Even"
 
     if not ZDebugPrintOff:
-        printOddToEvenRows (top_row, unit_array)
+        printOddToEvenRows (arraySizeList, top_row, unit_array)
 
 ###################################################################################################
 #
@@ -2118,7 +2539,7 @@ def computeConfigZVariablesOddToEven (arraySizeList, unitArray, topRow):
     NN = unit_array[next_row,0]
     NNN = unit_array[top_row, 0]
 
-    TripletValueList = computeSpecificTripletZVariable (U, NN, NNN)
+    TripletValueList = computeSpecificTripletZVariable (arraySizeList, U, NN, NNN)
 
     
     # Debug print statements
@@ -2251,7 +2672,7 @@ def computeConfigZVariablesOddToEven (arraySizeList, unitArray, topRow):
     NN = unit_array[top_row,arrayLength-1]
     NNN = unit_array[next_row, 0]
 
-    TripletValueList = computeSpecificTripletZVariable (U, NN, NNN)
+    TripletValueList = computeSpecificTripletZVariable (arraySizeList, U, NN, NNN)
 
     
     # Debug print statements
@@ -2335,6 +2756,10 @@ def computeConfigZVariablesOddToEven (arraySizeList, unitArray, topRow):
 
 def computeConfigZVariables (arraySizeList, unitArray):
 
+    pairs = arraySizeList.pairs
+    debugPrintOff = arraySizeList.runConfig.debugPrintOff
+    ZDebugPrintOff = arraySizeList.runConfig.ZDebugPrintOff
+
 # Initialize the z'i variables
 
     z1 = z2 = z3 = z4 = z5 = z6 = 0
@@ -2411,7 +2836,20 @@ def computeConfigZVariables (arraySizeList, unitArray):
             print ' '
             print 'Closing a pass through for loop with i = ', i     
             print ' '    
-# NOTE: Still need to write the computation for an extra odd row in grid, if it exists
+
+# With an odd number of layers, there is one more zigzag chain after the pairs: its top row is the
+#   last (even-numbered) row, and it wraps around to row 0
+    if not arraySizeList.evenLayers:
+        topRow = 2*pairs
+        if not ZDebugPrintOff:
+            print '  Row: ', topRow
+        configVarsZListEvenToOdd = computeConfigZVariablesEvenToOdd (arraySizeList, unitArray, topRow)
+        z1 = z1+configVarsZListEvenToOdd[0]
+        z2 = z2+configVarsZListEvenToOdd[1]
+        z3 = z3+configVarsZListEvenToOdd[2]
+        z4 = z4+configVarsZListEvenToOdd[3]
+        z5 = z5+configVarsZListEvenToOdd[4]
+        z6 = z6+configVarsZListEvenToOdd[5]
 
     configVarsZList = (z1, z2, z3, z4, z5, z6)                                                                                                                                                                        
     return (configVarsZList)
@@ -2434,6 +2872,9 @@ def computeConfigZVariables (arraySizeList, unitArray):
 
 
 def computeConfigVariables (arraySizeList, unitArray):
+
+    debugPrintOff = arraySizeList.runConfig.debugPrintOff
+    useVectorizedConfigVars = arraySizeList.runConfig.useVectorizedConfigVars
     
 # Define all the configuration variables (x, y, w, and z) as elements of their respective lists,
 #   and assign them their equilibrium values when all enthalpy parameters are set to 0.
@@ -2445,6 +2886,10 @@ def computeConfigVariables (arraySizeList, unitArray):
     if not debugPrintOff:
         print "In computeConfigVariables"
 
+# The whole-array NumPy engine gives identical counts and is much faster; it is selected in **main**
+    if useVectorizedConfigVars:
+        return computeConfigVariablesVectorized (arraySizeList, unitArray)
+
 #   Initialize the empty list for the full set of configuration variables
     configVarsList = list() # empty list
     
@@ -2487,1057 +2932,3216 @@ def computeConfigVariables (arraySizeList, unitArray):
 
 
 
+####################################################################################################
+####################################################################################################
+#
+# Class to hold the neighbor-index tables for a grid of arrayLayers x arrayLength units.
+#   The units are numbered in row order (unit = row*arrayLength + column), and the tables list,
+#   by unit number, the units in every pair and triplet of the grid:
+#     yPairsArray    - (2N, 2): the nearest-neighbor (y) pairs
+#     wPairsArray    - (2N, 2): the next-nearest-neighbor (w) pairs; the horizontal pairs
+#                      (j, j+1) come first, then the vertical pairs (i, i+2)
+#     zTripletsArray - (2N, 3): the (U, NN, NNN) triplets
+#   and, for every unit, which of those pairs and triplets it belongs to:
+#     unitYPairsArray (N, 4), unitWPairsArray (N, 4), unitZTripletsArray (N, 6)
+#
+# The y pairs and z triplets run along the zigzag chains. Each chain (top row i together with
+#   next row i+1, the last row wrapping to row 0) is a ring of 2*arrayLength units, in the same
+#   order the loop-based functions walk it:
+#     - for an EVEN top row: top[0], next[0], top[1], next[1], ... next[L-1], (back to top[0])
+#     - for an ODD top row:  next[0], top[0], next[1], top[1], ... top[L-1], (back to next[0])
+#   Every y pair is two consecutive units on a ring, and every z triplet is three consecutive
+#   units; ringIndexArray holds the rings.
+#
+# A pair or triplet is encoded as 2*U + NN, or 4*U + 2*NN + NNN; yIndexTable, wIndexTable, and
+#   zIndexTable give the position in configVarsList of the variable for each code.
+#
 ####################################################################################################
 ####################################################################################################
 
+class CVMLattice (object):
 
-def computeConfigVariablesDelta (h):
-    
-# This is an analytic function; not used for the random generation and adjustment steps in the current
-#   code; it is used in other code instances
+    def __init__ (self, arrayLength, arrayLayers):
 
-# Define all the configuration variables (x, y, w, and z) as elements of their respective lists,
-#   and assign them their equilibrium values when all enthalpy parameters are set to 0.
-#   Then, obtain the actual values for the configuration variables by calling procedures
-#   specific to each configuration variable type (x, y, w, and z). 
-#   Assign the returned configuration variables to list elements in the main
-#   configVarsList, which is returned to teh calling procedure. 
+        self.arrayLength = arrayLength
+        self.arrayLayers = arrayLayers
+        totalUnits = arrayLength*arrayLayers
 
-# NOTE: These equations are based on an enthalpy of just 2y2;
-#   they need to be replaced for with newly-derived equations where
-#   the enthalpy is 2y2 - y1 - y3. 
+        unitIndexArray = np.arange(totalUnits, dtype=np.int32).reshape(arrayLayers, arrayLength)
+        nextRowIndexArray = np.roll(unitIndexArray, -1, axis=0)
 
-    x1 = 0.5
-    x2 = 0.5
-    hSquared = h*h
-    z3 = (hSquared-3.0)*(hSquared+1.0)/(8.0*(hSquared*hSquared-6*hSquared+1.0))
-    s = (1.0-3.0*hSquared)/(hSquared-3.0)
-    z1 = s*z3
-    z2 = (0.5-z1-z3)/2.0
-    z4 = z3
-    z5 = z2
-    z6 = z1
-    y1 = z1 + z2
-    y3 = z5 + z6
-    y2 = (1.0 - 2.0*z1 + 2.0*z3)/4.0
-    w1 = z1 + z3
-    w3 = z6 + z4
-    w2 = (1.0 - w1 - w3)/2.0
-    
-# Create the master Configuration Variables List; configVarsList, assign configuration variable
-#   values, and return the list to the calling procedure 
-               
-    configVarsList = (x1, x2, y1, y2, y3, w1, w2, w3, z1, z2, z3, z4, z5, z6)  
-                
-    return (configVarsList)    
+        evenRows = (np.arange(arrayLayers) % 2 == 0)
+        oddRows  = np.logical_not(evenRows)
+        ringIndexArray = np.zeros((arrayLayers, 2*arrayLength), dtype=np.int32)
+        ringIndexArray[evenRows, 0::2] = unitIndexArray[evenRows]
+        ringIndexArray[evenRows, 1::2] = nextRowIndexArray[evenRows]
+        ringIndexArray[oddRows, 0::2]  = nextRowIndexArray[oddRows]
+        ringIndexArray[oddRows, 1::2]  = unitIndexArray[oddRows]
+        self.ringIndexArray = ringIndexArray
 
+        ringNNIndexArray  = np.roll(ringIndexArray, -1, axis=1)
+        ringNNNIndexArray = np.roll(ringIndexArray, -2, axis=1)
 
-    
+        self.yPairsArray = np.column_stack((ringIndexArray.ravel(), ringNNIndexArray.ravel()))
+        self.zTripletsArray = np.column_stack((ringIndexArray.ravel(), ringNNIndexArray.ravel(), 
+                                               ringNNNIndexArray.ravel()))
+
+        wHorizontalPairsArray = np.column_stack((unitIndexArray.ravel(), np.roll(unitIndexArray, -1, axis=1).ravel()))
+        wVerticalPairsArray   = np.column_stack((unitIndexArray.ravel(), np.roll(unitIndexArray, -2, axis=0).ravel()))
+        self.wPairsArray = np.concatenate((wHorizontalPairsArray, wVerticalPairsArray))
+
+        self.unitYPairsArray    = obtainUnitClusterMembership (self.yPairsArray, totalUnits)
+        self.unitWPairsArray    = obtainUnitClusterMembership (self.wPairsArray, totalUnits)
+        self.unitZTripletsArray = obtainUnitClusterMembership (self.zTripletsArray, totalUnits)
+
+        self.yIndexTable = np.array([4, 3, 3, 2])                       # B-B, B-A, A-B, A-A
+        self.wIndexTable = np.array([7, 6, 6, 5])                       # B--B, B--A, A--B, A--A
+        self.zIndexTable = np.array([13, 12, 11, 9, 12, 10, 9, 8])      # B-B-B, B-B-A, B-A-B, B-A-A, A-B-B, A-B-A, A-A-B, A-A-A
 
 
 ####################################################################################################
+#
+# Function to list, for every unit, the pairs (or triplets) that contain it. Every unit sits in two
+#   zigzag chains (as the top row of its own chain, and as the next row of the chain above), so it
+#   is in 4 y pairs and 6 z triplets; it is also in 4 w pairs.
+#
 ####################################################################################################
 
+def obtainUnitClusterMembership (clusterArray, totalUnits):
 
-def computeConfigVariablesAnalytic (h, configVarsList):
-    
-# This is exploratory code - written prior to generating actual unitArrays and assessing their
-#  configuration variables, etc;
-# Its purpose was to give a mathematically-plausible set of configuration variables 
-#  for which the thermodynamic variables could then be computed;
-# There is no knowledge at all if these values are even near equilibrium ... 
-# Actually modifying the unitArray to achieve an equilibrium configuration came much later ... 
+    clusterSize = clusterArray.shape[1]
 
+# Sorting the flattened table by unit number groups together all of the places each unit appears
+    clusterEntryOrder = np.argsort(clusterArray.ravel(), kind='mergesort')
+    unitClusterArray = (clusterEntryOrder // clusterSize).astype(np.int32).reshape(totalUnits, -1)
 
-# Define all the configuration variables (x, y, w, and z) as elements of their respective lists,
-#   and assign them their equilibrium values when all enthalpy parameters are set to 0.
-#   Then, obtain the actual values for the configuration variables by calling procedures
-#   specific to each configuration variable type (x, y, w, and z). 
-#   Assign the returned configuration variables to list elements in the main
-#   configVarsList, which is returned to teh calling procedure. 
+    return (unitClusterArray)
 
-    hSquared = h*h
-    z3Deltaorig = (hSquared-3.0)*(hSquared+1.0)/(8.0*(hSquared*hSquared-6*hSquared+1.0))
-    s = (1.0-3.0*hSquared)/(hSquared-3.0)
-    z3Delta = z3Deltaorig - delta
-    z4Delta = z3Deltaorig + delta
-    z1Delta = s*z3Deltaorig - delta*0.5
-    z6Delta = s*z3Deltaorig + delta*0.5
-    z2Delta = (0.5-z1Delta-z3Delta)/2.0 - delta*0.8
-    z5Delta = (0.5-z6Delta-z4Delta)/2.0 + delta*0.8
-    y1Delta = z1Delta + z2Delta
-    y3Delta = z5Delta + z6Delta
-    y2Delta = (1.0 - z1Delta + z3Delta - z6Delta + z4Delta)/4.0
-    w1Delta = z1Delta + z3Delta
-    w3Delta = z6Delta + z4Delta
-    w2Delta = (1.0 - w1Delta - w3Delta)/2.0
-    x1Delta = y1Delta + y2Delta
-    x2Delta = y3Delta + y2Delta       
 
-# Create the master Configuration Variables List; configVarsList, assign configuration variable
-#   values, and return the list to the calling procedure 
-               
-    configVarsListDelta = (x1Delta, x2Delta, y1Delta, y2Delta, y3Delta, 
-    w1Delta, w2Delta, w3Delta, 
-    z1Delta, z2Delta, z3Delta, z4Delta, z5Delta, z6Delta)   
-             
-    return (configVarsListDelta)    
+####################################################################################################
+#
+# Function to return the CVMLattice for a grid size. The lattice is built the first time a size is
+#   asked for, and kept in cvmLatticeCache (keyed by (arrayLayers, arrayLength)) for later calls.
+#
+####################################################################################################
 
+cvmLatticeCache = dict()
 
+def obtainCVMLattice (arraySizeList):
 
+    arrayLength = arraySizeList [0]
+    arrayLayers = arraySizeList [1]
+
+    latticeKey = (arrayLayers, arrayLength)
+    if latticeKey not in cvmLatticeCache:
+        cvmLatticeCache[latticeKey] = CVMLattice (arrayLength, arrayLayers)
+
+    return (cvmLatticeCache[latticeKey])
+
+
+
+####################################################################################################
 ####################################################################################################
 #
-# Function to increase the x1 value in the array
+# Function to compute the complete set of configuration variables (x, y, w, and z) using whole-array
+#   NumPy operations instead of the cell-by-cell loops above.
+# This is a drop-in replacement for computeConfigVariables; it returns the same list layout:
+#   configVarsList = (X1, X2, Y1, Y2, Y3, W1, W2, W3, Z1, Z2, Z3, Z4, Z5, Z6, unitArray)
+# The counting itself is done by computeConfigVariablesBatch, on a stack holding just this one grid.
 #
 ####################################################################################################
+####################################################################################################
 
-def adjustMatrixX1Up (arraySizeList, unitArray, configVarsList, h):
-    
-    totalUnits = float(arrayLength*arrayLayers)
-    totalUnitsTimesTwo = totalUnits*2.0
-                       
-    x1 = float(configVarsList[0])/totalUnits
-    x2 = float(configVarsList[1])/totalUnits 
+def computeConfigVariablesVectorized (arraySizeList, unitArray):
 
-    if not detailedAdjustMatrixPrintOff:
-        print ' '
-        print ' In adjustMatrixXUp'    
-# Randomly select a unit; if it is 1, change to 0
-    unitRow = randrange(0, arrayLength)       
-    unitCol = randrange(0, arrayLayers)        
+    configVarsArray = computeConfigVariablesBatch (arraySizeList, unitArray[np.newaxis])
 
-    if unitArray[unitRow, unitCol] == 0: 
-        unitArray[unitRow, unitCol] = 1
-        if not detailedAdjustMatrixPrintOff:
-            print ' successfully changed unit in [', unitRow, ',', unitCol, '] to 1'
-    else: 
-        if not detailedAdjustMatrixPrintOff:
-            print ' selected unit is already 1'  
-            
-    return unitArray
+# Return plain Python ints, as the loop-based functions do
+    configVarsCounts = [int(count) for count in configVarsArray[0]]
+
+    configVarsList = tuple(configVarsCounts) + (unitArray,)
+
+    return (configVarsList)
 
 
+
+####################################################################################################
 ####################################################################################################
 #
-# Function to decrease the x1 value in the array
+# Function to compute the configuration variables for a whole stack of grids in one pass.
+#   Input:   unitArrayStack, with shape (trials, arrayLayers, arrayLength)
+#   Returns: configVarsArray, an integer array with shape (trials, 14); each row holds the raw
+#            counts (X1, X2, Y1, Y2, Y3, W1, W2, W3, Z1, Z2, Z3, Z4, Z5, Z6) for one grid
+#
+# The units of every y pair, w pair, and z triplet are gathered using the index tables of the
+#   CVMLattice for this grid size. Each pair or triplet is encoded as a small integer (2*U + NN, or
+#   4*U + 2*NN + NNN), and the code is converted (with the lattice's index tables) into the
+#   position of its variable in configVarsList. Each grid's positions are offset by
+#   14*(trial number), so that one np.bincount counts every grid at once.
 #
 ####################################################################################################
+####################################################################################################
 
-def adjustMatrixX1Down (arraySizeList, unitArray, configVarsList, h):
+def computeConfigVariablesBatch (arraySizeList, unitArrayStack):
+
+    arrayLength = arraySizeList [0]
+    arrayLayers = arraySizeList [1]
+
+# The compiled kernel, when selected, does all of the counting
+    if obtainConfigVarsBackend (arraySizeList) == 'numba':
+        return computeConfigVariablesCompiledBatch (arraySizeList, unitArrayStack, compiledConfigVarsKernel)
+
+    cvmLattice = obtainCVMLattice (arraySizeList)
+
+    numGrids = unitArrayStack.shape[0]
     
-    totalUnits = float(arrayLength*arrayLayers)
-    totalUnitsTimesTwo = totalUnits*2.0
-                       
-    x1 = float(configVarsList[0])/totalUnits
-    x2 = float(configVarsList[1])/totalUnits 
+# Use the same "> 0.1" test as the loop-based functions to decide if a unit is A (1) or B (0)
+    activeStack = (unitArrayStack > 0.1).astype(np.uint8).reshape(numGrids, arrayLength*arrayLayers)
 
-    if not detailedAdjustMatrixPrintOff:    
-        print ' '
-        print ' In adjustMatrixXDown'   
-        
-# Randomly select a unit; if it is 1, change to 0
-    unitRow = randrange(0, arrayLength)       
-    unitCol = randrange(0, arrayLayers)        
+# Nearest-neighbor pair codes: 3 = A-A, 2 = A-B, 1 = B-A, 0 = B-B
+    yCodes = 2*np.take(activeStack, cvmLattice.yPairsArray[:, 0], axis=1) + np.take(activeStack, cvmLattice.yPairsArray[:, 1], axis=1)
 
-    if unitArray[unitRow, unitCol] == 1: 
-        unitArray[unitRow, unitCol] = 0
-        if not detailedAdjustMatrixPrintOff:
-            print ' successfully changed unit in [', unitRow, ',', unitCol, '] to 0'
-    else: 
-        if not detailedAdjustMatrixPrintOff:
-            print ' selected unit is already 0'        
-                        
-                                                                        
-    return unitArray
+# Next-nearest-neighbor pair codes, for the horizontal and the vertical pairs
+    wCodes = 2*np.take(activeStack, cvmLattice.wPairsArray[:, 0], axis=1) + np.take(activeStack, cvmLattice.wPairsArray[:, 1], axis=1)
 
+# Triplet codes: 7 = A-A-A, 6 = A-A-B, 5 = A-B-A, 4 = A-B-B, 3 = B-A-A, 2 = B-A-B, 1 = B-B-A, 0 = B-B-B
+    zCodes = (4*np.take(activeStack, cvmLattice.zTripletsArray[:, 0], axis=1) + 
+              2*np.take(activeStack, cvmLattice.zTripletsArray[:, 1], axis=1) + 
+              np.take(activeStack, cvmLattice.zTripletsArray[:, 2], axis=1))
 
+# The position in configVarsList for every pair and triplet, offset for each grid
+    configVarsPositions = np.concatenate((np.take(cvmLattice.yIndexTable, yCodes), np.take(cvmLattice.wIndexTable, wCodes), 
+                                          np.take(cvmLattice.zIndexTable, zCodes)), axis=1)
+    gridOffsets = 14*np.arange(numGrids).reshape(numGrids, 1)
+    configVarsArray = np.bincount((configVarsPositions + gridOffsets).ravel(), 
+                                  minlength=14*numGrids).reshape(numGrids, 14).astype(np.int64)
+
+    configVarsArray[:, 0] = activeStack.sum(axis=1, dtype=np.int64)           # X1
+    configVarsArray[:, 1] = arrayLength*arrayLayers - configVarsArray[:, 0]    # X2
+
+    return (configVarsArray)
+
+
+
+####################################################################################################
 ####################################################################################################
 #
-# Function to adjust the array and bring randomly-generated x1 and the target x1 closer together
+# Compiled (Numba) counting kernel
+#
+# countConfigVariablesKernel makes a single fused pass over the grid and counts all 14 configuration
+#   variables, with no temporary arrays. For every row i it counts the x value and the two w pairs
+#   (horizontal and vertical) of each unit, and then walks the zigzag chain with top row i (the same
+#   ring of 2*arrayLength units as in CVMLattice), keeping the last three units so that each y pair
+#   and z triplet is read once. Ring position p of chain i is in row i when (p + i) is even, and in
+#   the next row otherwise; its column is p//2.
+#
+# When Numba is installed, the kernel is JIT-compiled into compiledConfigVarsKernel; otherwise
+#   compiledConfigVarsKernel is None, and the NumPy engine is used (see obtainConfigVarsBackend).
 #
 ####################################################################################################
-    
-def adjustMatrix (arraySizeList, unitArray, h, jrange, maxXDif, x1TargetVal, beforeAndAfterAdjustedMatrixPrintOff):
-     
-    configVarsList = computeConfigVariables (arraySizeList, unitArray)
-        
-    totalUnits = float(arrayLength*arrayLayers)
-    totalUnitsTimesTwo = totalUnits*2.0 
+####################################################################################################
 
-    # Test to see if matrix adjustment is needed
-    x1 = float(configVarsList[0])/totalUnits
-    x1DeltaPos = x1 - x1TargetVal
-    x1DeltaNeg = x1TargetVal - x1 
-    
+def countConfigVariablesKernel (unitArray, yIndexTable, wIndexTable, zIndexTable, configVarsCounts):
 
-    if not debugPrintOff:
-        print ' '
-        print '    The initial value for x1 is %.4f' % (x1)
-                                              
-    if x1DeltaPos < maxXDif: # x1 is not too large
-        x1DeltaPosAccept = True
-    else:
-        x1DeltaPosAccept = False        
-        
-    if x1DeltaNeg < maxXDif: # x1 is not too small
-        x1DeltaNegAccept = True
-    else:
-        x1DeltaNegAccept = False                 
+    arrayLayers = unitArray.shape[0]
+    arrayLength = unitArray.shape[1]
+    ringLength = 2*arrayLength
 
-    x1Accept = False 
-    if x1DeltaPosAccept:
-        if x1DeltaNegAccept:
-            x1Accept = True                
-       
+    for k in range(14):
+        configVarsCounts[k] = 0
 
-    if not debugPrintOff:
-        print ' '                        
-        if x1Accept:
-                print '  '
-                print '  Matrix adjustment is not needed'
-                print '    The initial value for x1 is %.4f' % (x1) 
-                print '    This is less than the maximum difference of ', maxXDif 
-                print ' '
-        if x1DeltaPosAccept:
-                print '    The difference between x1 and the x1 target value is %.4f'% (x1DeltaPos) 
+    for i in range(arrayLayers):
+        nextRow = (i+1) % arrayLayers
+        nextNextRow = (i+2) % arrayLayers
+
+        for j in range(arrayLength):
+            nextCol = (j+1) % arrayLength
+            U = 1 if unitArray[i, j] > 0.1 else 0
+            horizontalNN = 1 if unitArray[i, nextCol] > 0.1 else 0
+            verticalNN = 1 if unitArray[nextNextRow, j] > 0.1 else 0
+            configVarsCounts[0] += U
+            configVarsCounts[wIndexTable[2*U + horizontalNN]] += 1
+            configVarsCounts[wIndexTable[2*U + verticalNN]] += 1
+
+# The first two units of the ring; for an even top row these are top[0] and next[0]
+        if i % 2 == 0:
+            U = 1 if unitArray[i, 0] > 0.1 else 0
+            NN = 1 if unitArray[nextRow, 0] > 0.1 else 0
         else:
-            if x1DeltaNegAccept:
-                print '    The difference between x1 and the x1 target value is %.4f'% (x1DeltaNeg)              
-                                                            
+            U = 1 if unitArray[nextRow, 0] > 0.1 else 0
+            NN = 1 if unitArray[i, 0] > 0.1 else 0
+
+        for p in range(ringLength):
+            q = (p+2) % ringLength
+            if (q+i) % 2 == 0:
+                NNN = 1 if unitArray[i, q//2] > 0.1 else 0
+            else:
+                NNN = 1 if unitArray[nextRow, q//2] > 0.1 else 0
+            configVarsCounts[yIndexTable[2*U + NN]] += 1
+            configVarsCounts[zIndexTable[4*U + 2*NN + NNN]] += 1
+            U = NN
+            NN = NNN
+
+    configVarsCounts[1] = arrayLength*arrayLayers - configVarsCounts[0]
+
+
+if numba is not None:
+    compiledConfigVarsKernel = numba.njit(countConfigVariablesKernel)
+else:
+    compiledConfigVarsKernel = None
 
-    if not x1DeltaPosAccept: # x1 IS too large; begin adjusting matrix                                                                                                                      
-        for j in range (0, jrange, 1):
-            x1 = float(configVarsList[0])/totalUnits
-            x1DeltaPos = x1 - x1TargetVal            
-            if x1DeltaPos < maxXDif:  # x1 is not too large; exit FOR loop
-                if not detailedAdjustMatrixPrintOff: 
-                    print '  '
-                    print '  Matrix adjustment completed in ', j+1, 'steps'
-                    print ' '
-                break              
-            if not detailedAdjustMatrixPrintOff:
-                print '  Improving the unit array for j = ', j, ' x1 is too large'
-            unitArray = adjustMatrixX1Down (arraySizeList, unitArray, configVarsList, h)
-            configVarsList = computeConfigVariables (arraySizeList, unitArray)
-                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                    
-    if not x1DeltaNegAccept: # x1 IS too small; begin adjusting matrix                                                                                                                      
-        for j in range (0, jrange, 1):
-            x1 = float(configVarsList[0])/totalUnits
-            x1DeltaNeg = x1TargetVal - x1 
-            if x1DeltaNeg < maxXDif:  # x1 is not too large; exit FOR loop
-                if not detailedAdjustMatrixPrintOff: 
-                    print '  '
-                    print '  Matrix adjustment completed in ', j+1, 'steps'
-                    print ' '
-                break              
-            if not detailedAdjustMatrixPrintOff:
-                print '  Improving the unit array for j = ', j, ' x1 is too large'
-            unitArray = adjustMatrixX1Up (arraySizeList, unitArray, configVarsList, h)
-            configVarsList = computeConfigVariables (arraySizeList, unitArray)                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                    
-                                
-    return unitArray
-    # END adjustMatrix  
-                 
 
 ####################################################################################################
 #
-# Function to find an x1 node, which will be a candidate for flipping to lower the total FE value
+# Function to pick the engine for computeConfigVariablesBatch, from runConfig.configVarsBackend:
+#   'numba' - the compiled kernel, when Numba is installed (falls back to 'numpy' when it is not)
+#   'numpy' - the whole-array NumPy engine
+#   'auto'  - 'numba' when Numba is installed, otherwise 'numpy'
 #
 ####################################################################################################
 
-def findCandidateX1node (arraySizeList, unitArray, maxRange, findFEMinimumValsDetailsBoolOff):
-    
-    arrayLength = arraySizeList[0]
-    arrayLayers = arraySizeList[1]
-    
-    candidateX1RowColList = (0,0,0)    
-                       
-    successBool = 0
-    for k in range (0, maxRange, 1):
-        unitRow = randrange(0, arrayLength)       
-        unitCol = randrange(0, arrayLayers)
+def obtainConfigVarsBackend (arraySizeList):
 
-        if unitArray[unitRow,unitCol] == 1:
-            candidateX1RowColList = [unitRow, unitCol,k]
-            numCandidates = k
-            successBool = 1
-            if not findFEMinimumValsDetailsBoolOff:
-                print ' '
-                print '  For k = ', k, 'Candidate x1 found at Row: ', unitRow, 'Col: ', unitCol
-                numCandidates = k
-                successBool = 1
-            break
-        # if not findFEMinimumValsDetailsBoolOff:
-    
-    if successBool == 0:           
-        if not findFEMinimumValsDetailsBoolOff:
-            print ' ' 
-            print ' In findCandidateX2node' 
-            print ' Did not find a suitable x2 candidate after ', maxRange, ' attempts'
-            print ' '  
-                                    
-    return candidateX1RowColList
-    # END findCandidateX1 node
+    configVarsBackend = arraySizeList.runConfig.configVarsBackend
+
+    if configVarsBackend not in ('auto', 'numba', 'numpy'):
+        raise ValueError('configVarsBackend must be auto, numba, or numpy, not %r' % (configVarsBackend,))
+
+    if configVarsBackend == 'numpy' or compiledConfigVarsKernel is None:
+        return 'numpy'
+
+    return 'numba'
 
 
 ####################################################################################################
 #
-# Function to find an x2 node, which will be a candidate for flipping to lower the total FE value
+# Function to count the configuration variables for a stack of grids with the compiled kernel,
+#   one grid at a time. Returns the same (trials, 14) array as computeConfigVariablesBatch.
 #
 ####################################################################################################
 
-def findCandidateX2node (arraySizeList, unitArray, maxRange, findFEMinimumValsDetailsBoolOff):
-    
-    arrayLength = arraySizeList[0]
-    arrayLayers = arraySizeList[1]
-    
-    candidateX2RowColList = (0,0,0)    
+def computeConfigVariablesCompiledBatch (arraySizeList, unitArrayStack, configVarsKernel):
 
-    successBool = 0                                              
-    for k in range (0, maxRange, 1):
-        unitRow = randrange(0, arrayLength)       
-        unitCol = randrange(0, arrayLayers)
+    cvmLattice = obtainCVMLattice (arraySizeList)
 
-        if unitArray[unitRow,unitCol] == 0:
-            candidateX2RowColList = [unitRow, unitCol,k]
-            successBool = 1
-            numCandidates = k            
-            if not findFEMinimumValsDetailsBoolOff:
-                print ' '
-                print '  For k = ', k, 'Candidate x2 found at Row: ', unitRow, 'Col: ', unitCol
-            break           
-        # if not findFEMinimumValsDetailsBoolOff:            
-        
-    if successBool == 0: 
-        if not findFEMinimumValsDetailsBoolOff:
-            print ' ' 
-            print ' In findCandidateX2node' 
-            print ' Did not find a suitable x2 candidate after ', maxRange, ' attempts'
-            print ' '  
-                                                                                        
-    return candidateX2RowColList
-    # END findCandidateX2 node
+    numGrids = unitArrayStack.shape[0]
+    configVarsArray = np.zeros((numGrids, 14), dtype=np.int64)
+
+    for gridNum in range(numGrids):
+        configVarsKernel (unitArrayStack[gridNum], cvmLattice.yIndexTable, cvmLattice.wIndexTable, 
+                          cvmLattice.zIndexTable, configVarsArray[gridNum])
+
+    return (configVarsArray)
 
 
 
 ####################################################################################################
+####################################################################################################
+#
+# Bit-packed grids
 #
-# Function to fill a new unit matrix so it is identical to the starting matrix
+# Every unit is either A (1) or B (0), so a grid can be held as one bit per unit. In a packed array,
+#   each row of the grid is a bit vector stored in arrayLength/64 (rounded up) uint64 words; the
+#   unit in column j is bit (j % 64) of word (j // 64). Any unused bits at the end of the last word
+#   (the "padding") are always kept at zero.
+# A packed array has shape (arrayLayers, words), or (trials, arrayLayers, words) for a stack, and
+#   takes 1/64 the memory of the equivalent int64 unitArray.
+#
+# popcountTable holds the number of set bits for each byte value; it is used to count the set bits
+#   in the packed words (viewed as bytes) without unpacking them.
 #
 ####################################################################################################
-    
-def createIdenticalUnitArray (arraySizeList, unitArray):
-    
-    localArrayLength = arraySizeList[0]
-    localArrayLayers = arraySizeList[1]
-    newUnitArray = np.random.choice([0, 1],size=(localArrayLayers,localArrayLength))
-
-#  How to copy a list: b = [x for x in a] 
-#  Another way: b = list(a)   
-         
-# We have an  L x M array of units, where M (across) =', localArrayLength, 'and L (layers) =', localArrayLayers
-             
-    for l in range (0, localArrayLayers, 1):
-        for m in range (0, localArrayLayers, 1): 
-            newUnitArray[m,l] =  unitArray[m,l]              
-                        
-    return newUnitArray
-
-
+####################################################################################################
 
+popcountTable = np.array([bin(byteVal).count('1') for byteVal in range(256)], dtype=np.uint8)
 
 
 ####################################################################################################
 #
-# Function to adjust the array (while keeping x1, x2 const) to change the other config variables
-#   and bring the FE value to a minimum
+# Function to return the number of uint64 words needed to hold one row of the grid
 #
 ####################################################################################################
-    
-def adjustMatrixFEMinimum (arraySizeList, unitArray, h, maxRange):
 
-# Note:     sysValsList = (negS, enthalpy0, enthalpy1, freeEnergy): returned from computeThermValues          
-# Note:     configVarsList = (x1, x2, y1, y2, y3, w1, w2, w3, z1, z2, z3, z4, z5, z6, unitArray); returned from computeConfigVars     
+def obtainPackedWordsPerRow (arraySizeList):
 
-    maxRange = 30
+    arrayLength = arraySizeList [0]
+
+    wordsPerRow = (arrayLength + 63)//64
+
+    return (wordsPerRow)
+
+
+####################################################################################################
+#
+# Function to pack a unitArray (or a stack of them) into uint64 words, one bit per unit
+#
+####################################################################################################
+
+def packUnitArray (arraySizeList, unitArray):
+
+    arrayLength = arraySizeList [0]
+    wordsPerRow = obtainPackedWordsPerRow (arraySizeList)
+
+# Pad each row out to a whole number of words with B (0) units
+    paddedShape = unitArray.shape[:-1] + (64*wordsPerRow,)
+    paddedArray = np.zeros(paddedShape, dtype=np.uint8)
+    paddedArray[..., 0:arrayLength] = (unitArray > 0.1)
+
+# np.packbits puts the first unit of each group of 8 into the highest bit of the byte; reverse each
+#   group so that column j lands in bit (j % 8) of its byte, and so in bit (j % 64) of its word
+    bitGroups = paddedArray.reshape(paddedShape[:-1] + (8*wordsPerRow, 8))[..., ::-1]
+    packedBytes = np.packbits(bitGroups, axis=-1).reshape(paddedShape[:-1] + (8*wordsPerRow,))
+
+    packedArray = np.ascontiguousarray(packedBytes).view(np.dtype('<u8')).astype(np.uint64)
+
+    return (packedArray)
+
+
+####################################################################################################
+#
+# Function to unpack a packed array (or a stack of them) back into a unitArray of 0's and 1's
+#
+####################################################################################################
+
+def unpackUnitArray (arraySizeList, packedArray):
+
+    arrayLength = arraySizeList [0]
+    wordsPerRow = packedArray.shape[-1]
+
+    packedBytes = np.ascontiguousarray(packedArray.astype(np.dtype('<u8'))).view(np.uint8)
+    bitGroups = np.unpackbits(packedBytes[..., np.newaxis], axis=-1)[..., ::-1]
+    paddedArray = bitGroups.reshape(packedArray.shape[:-1] + (64*wordsPerRow,))
+
+    unitArray = paddedArray[..., 0:arrayLength].astype(np.int)
+
+    return (unitArray)
+
+
+####################################################################################################
+#
+# Function to randomly generate a packed array with (approximately) the target fraction of A units.
+#   The grid is generated and packed one row at a time, so a full-size int array is never built.
+#   The random draws are the same as in initializeGeneratedMatrix, so for the same random state
+#   unpackUnitArray gives back the same grid that initializeGeneratedMatrix would have returned.
+#
+####################################################################################################
+
+def initializeGeneratedPackedMatrix (arraySizeList, h, x1TargetVal):
+
+    localArrayLength = arraySizeList[0]
+    localArrayLayers = arraySizeList[1]
+    wordsPerRow = obtainPackedWordsPerRow (arraySizeList)
+
+    x2TargetVal = 1.-x1TargetVal
+
+    randomState = obtainRandomState (arraySizeList)
+    packedArray = np.zeros((localArrayLayers, wordsPerRow), dtype=np.uint64)
+    for i in range (0, localArrayLayers):
+        rowArray = randomState.choice([0, 1],size=(1,localArrayLength), p=[x2TargetVal, x1TargetVal])
+        packedArray[i] = packUnitArray (arraySizeList, rowArray)[0]
+
+    return (packedArray)
+
+
+####################################################################################################
+#
+# Function to rotate every row of a packed array by one column, so that column j of the result
+#   holds the unit from column j+1 (and the last column holds the unit from column 0)
+#
+####################################################################################################
+
+def rotatePackedRows (arraySizeList, packedArray):
+
+    arrayLength = arraySizeList [0]
+
+    rotatedArray = packedArray >> np.uint64(1)
+# The lowest bit of each word moves into the highest bit of the word before it
+    rotatedArray[..., :-1] |= packedArray[..., 1:] << np.uint64(63)
+# Column 0 wraps around to column arrayLength-1 (the padding bits were zero, so that bit is clear)
+    lastWord = (arrayLength - 1)//64
+    lastBit  = np.uint64((arrayLength - 1) % 64)
+    rotatedArray[..., lastWord] |= (packedArray[..., 0] & np.uint64(1)) << lastBit
+
+    return (rotatedArray)
+
+
+####################################################################################################
+#
+# Function to count the set bits in each grid of a packed stack; returns one count per grid
+#
+####################################################################################################
+
+def countPackedBits (packedStack):
+
+    numGrids = packedStack.shape[0]
+    packedBytes = np.ascontiguousarray(packedStack).view(np.uint8)
+
+    bitCounts = popcountTable[packedBytes].reshape(numGrids, -1).sum(axis=1, dtype=np.int64)
+
+    return (bitCounts)
+
+
+####################################################################################################
+#
+# Function to count, for each grid of two packed stacks, the pairs of units that are both A and
+#   the pairs that are both B; all of the remaining pairs are A-B or B-A
+#
+####################################################################################################
+
+def countPackedPairs (firstStack, secondStack, validBitsArray):
+
+    bothACounts = countPackedBits (firstStack & secondStack)
+    bothBCounts = countPackedBits (~firstStack & ~secondStack & validBitsArray)
+
+    return (bothACounts, bothBCounts)
+
+
+####################################################################################################
+####################################################################################################
+#
+# Function to compute the configuration variables for a stack of packed grids, word-parallel.
+#   Input:   packedArrayStack, with shape (trials, arrayLayers, words), from packUnitArray
+#   Returns: configVarsArray, an integer array with shape (trials, 14), laid out as in
+#            computeConfigVariablesBatch
+#
+# The zigzag rings are the same as in computeConfigVariablesBatch. Writing ringEven for the units at
+#   the even ring positions (the top row for an EVEN chain, the next row for an ODD chain), and
+#   ringOdd for the units at the odd positions, the ring is ringEven[0], ringOdd[0], ringEven[1], ...
+#   so that:
+#     - the y pairs are (ringEven[j], ringOdd[j]) and (ringOdd[j], ringEven[j+1])
+#     - the z triplets are (ringEven[j], ringOdd[j], ringEven[j+1]) and
+#       (ringOdd[j], ringEven[j+1], ringOdd[j+1])
+#   and each of these is a bitwise operation between whole packed rows, with the "j+1" terms given
+#   by rotatePackedRows.
+#
+####################################################################################################
+####################################################################################################
+
+def computeConfigVariablesPackedBatch (arraySizeList, packedArrayStack):
+
+    arrayLength = arraySizeList [0]
+    arrayLayers = arraySizeList [1]
+    wordsPerRow = packedArrayStack.shape[-1]
+
+    numGrids = packedArrayStack.shape[0]
+    totalUnits = arrayLength*arrayLayers
+
+# The bits that hold real units; used to keep the padding clear when taking a complement
+    validBitsArray = packUnitArray (arraySizeList, np.ones((1, arrayLength), dtype=np.int))[0]
+
+    activeStack  = packedArrayStack
+    nextRowStack = np.roll(activeStack, -1, axis=1)
+
+    evenRows = (np.arange(arrayLayers) % 2 == 0).reshape(1, arrayLayers, 1)
+    ringEvenStack = np.where(evenRows, activeStack, nextRowStack)
+    ringOddStack  = np.where(evenRows, nextRowStack, activeStack)
+    ringEvenNextStack = rotatePackedRows (arraySizeList, ringEvenStack)
+    ringOddNextStack  = rotatePackedRows (arraySizeList, ringOddStack)
+
+    configVarsArray = np.zeros((numGrids, 14), dtype=np.int64)
+
+    configVarsArray[:, 0] = countPackedBits (activeStack)                     # X1
+    configVarsArray[:, 1] = totalUnits - configVarsArray[:, 0]                 # X2
+
+    (yFirstA, yFirstB)   = countPackedPairs (ringEvenStack, ringOddStack, validBitsArray)
+    (ySecondA, ySecondB) = countPackedPairs (ringOddStack, ringEvenNextStack, validBitsArray)
+    configVarsArray[:, 2] = yFirstA + ySecondA                                 # Y1
+    configVarsArray[:, 4] = yFirstB + ySecondB                                 # Y3
+    configVarsArray[:, 3] = 2*totalUnits - configVarsArray[:, 2] - configVarsArray[:, 4]    # Y2
+
+    (wHorizontalA, wHorizontalB) = countPackedPairs (activeStack, rotatePackedRows (arraySizeList, activeStack), validBitsArray)
+    (wVerticalA, wVerticalB)     = countPackedPairs (activeStack, np.roll(activeStack, -2, axis=1), validBitsArray)
+    configVarsArray[:, 5] = wHorizontalA + wVerticalA                          # W1
+    configVarsArray[:, 7] = wHorizontalB + wVerticalB                          # W3
+    configVarsArray[:, 6] = 2*totalUnits - configVarsArray[:, 5] - configVarsArray[:, 7]    # W2
+
+# For a triplet (U, NN, NNN): the ends differ exactly where U ^ NNN is set; the middle unit then
+#   decides between z2 (A-A-B, B-A-A) and z5 (A-B-B, B-B-A)
+    for (uStack, nnStack, nnnStack) in ((ringEvenStack, ringOddStack, ringEvenNextStack),
+                                         (ringOddStack, ringEvenNextStack, ringOddNextStack)):
+        endsDifferStack = uStack ^ nnnStack
+        configVarsArray[:, 8]  += countPackedBits (uStack & nnStack & nnnStack)                       # Z1
+        configVarsArray[:, 9]  += countPackedBits (nnStack & endsDifferStack)                         # Z2
+        configVarsArray[:, 10] += countPackedBits (uStack & ~nnStack & nnnStack)                      # Z3
+        configVarsArray[:, 11] += countPackedBits (~uStack & nnStack & ~nnnStack)                     # Z4
+        configVarsArray[:, 12] += countPackedBits (~nnStack & endsDifferStack)                        # Z5
+        configVarsArray[:, 13] += countPackedBits (~uStack & ~nnStack & ~nnnStack & validBitsArray)   # Z6
+
+    return (configVarsArray)
+
+
+####################################################################################################
+#
+# Function to compute the configuration variables for a single packed grid; returns the same list
+#   layout as computeConfigVariables, with the packed array in place of the unitArray:
+#   configVarsList = (X1, X2, Y1, Y2, Y3, W1, W2, W3, Z1, Z2, Z3, Z4, Z5, Z6, packedArray)
+#
+####################################################################################################
+
+def computeConfigVariablesPacked (arraySizeList, packedArray):
+
+    configVarsArray = computeConfigVariablesPackedBatch (arraySizeList, packedArray[np.newaxis])
+
+    configVarsCounts = [int(count) for count in configVarsArray[0]]
+
+    configVarsList = tuple(configVarsCounts) + (packedArray,)
+
+    return (configVarsList)
+
+
+
+####################################################################################################
+####################################################################################################
+
+
+def computeConfigVariablesDelta (h):
+    
+# This is an analytic function; not used for the random generation and adjustment steps in the current
+#   code; it is used in other code instances
+
+# Define all the configuration variables (x, y, w, and z) as elements of their respective lists,
+#   and assign them their equilibrium values when all enthalpy parameters are set to 0.
+#   Then, obtain the actual values for the configuration variables by calling procedures
+#   specific to each configuration variable type (x, y, w, and z). 
+#   Assign the returned configuration variables to list elements in the main
+#   configVarsList, which is returned to teh calling procedure. 
+
+# NOTE: These equations are based on an enthalpy of just 2y2;
+#   they need to be replaced for with newly-derived equations where
+#   the enthalpy is 2y2 - y1 - y3. 
+
+    x1 = 0.5
+    x2 = 0.5
+    hSquared = h*h
+    z3 = (hSquared-3.0)*(hSquared+1.0)/(8.0*(hSquared*hSquared-6*hSquared+1.0))
+    s = (1.0-3.0*hSquared)/(hSquared-3.0)
+    z1 = s*z3
+    z2 = (0.5-z1-z3)/2.0
+    z4 = z3
+    z5 = z2
+    z6 = z1
+    y1 = z1 + z2
+    y3 = z5 + z6
+    y2 = (1.0 - 2.0*z1 + 2.0*z3)/4.0
+    w1 = z1 + z3
+    w3 = z6 + z4
+    w2 = (1.0 - w1 - w3)/2.0
+    
+# Create the master Configuration Variables List; configVarsList, assign configuration variable
+#   values, and return the list to the calling procedure 
+               
+    configVarsList = (x1, x2, y1, y2, y3, w1, w2, w3, z1, z2, z3, z4, z5, z6)  
+                
+    return (configVarsList)    
+
+
+    
+
+
+####################################################################################################
+####################################################################################################
+
+
+def computeConfigVariablesAnalytic (h, configVarsList):
+    
+# This is exploratory code - written prior to generating actual unitArrays and assessing their
+#  configuration variables, etc;
+# Its purpose was to give a mathematically-plausible set of configuration variables 
+#  for which the thermodynamic variables could then be computed;
+# There is no knowledge at all if these values are even near equilibrium ... 
+# Actually modifying the unitArray to achieve an equilibrium configuration came much later ... 
+
+
+# Define all the configuration variables (x, y, w, and z) as elements of their respective lists,
+#   and assign them their equilibrium values when all enthalpy parameters are set to 0.
+#   Then, obtain the actual values for the configuration variables by calling procedures
+#   specific to each configuration variable type (x, y, w, and z). 
+#   Assign the returned configuration variables to list elements in the main
+#   configVarsList, which is returned to teh calling procedure. 
+
+    hSquared = h*h
+    z3Deltaorig = (hSquared-3.0)*(hSquared+1.0)/(8.0*(hSquared*hSquared-6*hSquared+1.0))
+    s = (1.0-3.0*hSquared)/(hSquared-3.0)
+    z3Delta = z3Deltaorig - delta
+    z4Delta = z3Deltaorig + delta
+    z1Delta = s*z3Deltaorig - delta*0.5
+    z6Delta = s*z3Deltaorig + delta*0.5
+    z2Delta = (0.5-z1Delta-z3Delta)/2.0 - delta*0.8
+    z5Delta = (0.5-z6Delta-z4Delta)/2.0 + delta*0.8
+    y1Delta = z1Delta + z2Delta
+    y3Delta = z5Delta + z6Delta
+    y2Delta = (1.0 - z1Delta + z3Delta - z6Delta + z4Delta)/4.0
+    w1Delta = z1Delta + z3Delta
+    w3Delta = z6Delta + z4Delta
+    w2Delta = (1.0 - w1Delta - w3Delta)/2.0
+    x1Delta = y1Delta + y2Delta
+    x2Delta = y3Delta + y2Delta       
+
+# Create the master Configuration Variables List; configVarsList, assign configuration variable
+#   values, and return the list to the calling procedure 
+               
+    configVarsListDelta = (x1Delta, x2Delta, y1Delta, y2Delta, y3Delta, 
+    w1Delta, w2Delta, w3Delta, 
+    z1Delta, z2Delta, z3Delta, z4Delta, z5Delta, z6Delta)   
+             
+    return (configVarsListDelta)    
+
+
+
+####################################################################################################
+#
+# Function to increase the x1 value in the array
+#
+####################################################################################################
+
+def adjustMatrixX1Up (arraySizeList, unitArray, configVarsList, h):
+
+    arrayLength = arraySizeList.arrayLength
+    arrayLayers = arraySizeList.arrayLayers
+    detailedAdjustMatrixPrintOff = arraySizeList.runConfig.detailedAdjustMatrixPrintOff
+    
+    totalUnits = float(arrayLength*arrayLayers)
+    totalUnitsTimesTwo = totalUnits*2.0
+                       
+    x1 = float(configVarsList[0])/totalUnits
+    x2 = float(configVarsList[1])/totalUnits 
+
+    if not detailedAdjustMatrixPrintOff:
+        print ' '
+        print ' In adjustMatrixXUp'    
+# Randomly select a unit; if it is 1, change to 0
+    randomState = obtainRandomState (arraySizeList)
+    unitRow = randomState.randint(0, arrayLayers)       
+    unitCol = randomState.randint(0, arrayLength)        
+
+    if unitArray[unitRow, unitCol] == 0: 
+        unitArray[unitRow, unitCol] = 1
+        if not detailedAdjustMatrixPrintOff:
+            print ' successfully changed unit in [', unitRow, ',', unitCol, '] to 1'
+    else: 
+        if not detailedAdjustMatrixPrintOff:
+            print ' selected unit is already 1'  
+            
+    return unitArray
+
+
+####################################################################################################
+#
+# Function to decrease the x1 value in the array
+#
+####################################################################################################
+
+def adjustMatrixX1Down (arraySizeList, unitArray, configVarsList, h):
+
+    arrayLength = arraySizeList.arrayLength
+    arrayLayers = arraySizeList.arrayLayers
+    detailedAdjustMatrixPrintOff = arraySizeList.runConfig.detailedAdjustMatrixPrintOff
+    
+    totalUnits = float(arrayLength*arrayLayers)
+    totalUnitsTimesTwo = totalUnits*2.0
+                       
+    x1 = float(configVarsList[0])/totalUnits
+    x2 = float(configVarsList[1])/totalUnits 
+
+    if not detailedAdjustMatrixPrintOff:    
+        print ' '
+        print ' In adjustMatrixXDown'   
+        
+# Randomly select a unit; if it is 1, change to 0
+    randomState = obtainRandomState (arraySizeList)
+    unitRow = randomState.randint(0, arrayLayers)       
+    unitCol = randomState.randint(0, arrayLength)        
+
+    if unitArray[unitRow, unitCol] == 1: 
+        unitArray[unitRow, unitCol] = 0
+        if not detailedAdjustMatrixPrintOff:
+            print ' successfully changed unit in [', unitRow, ',', unitCol, '] to 0'
+    else: 
+        if not detailedAdjustMatrixPrintOff:
+            print ' selected unit is already 0'        
+                        
+                                                                        
+    return unitArray
+
+
+####################################################################################################
+#
+# Function to adjust the array and bring randomly-generated x1 and the target x1 closer together
+#
+####################################################################################################
+    
+def adjustMatrix (arraySizeList, unitArray, h, jrange, maxXDif, x1TargetVal, beforeAndAfterAdjustedMatrixPrintOff):
+
+    arrayLength = arraySizeList.arrayLength
+    arrayLayers = arraySizeList.arrayLayers
+    debugPrintOff = arraySizeList.runConfig.debugPrintOff
+    detailedAdjustMatrixPrintOff = arraySizeList.runConfig.detailedAdjustMatrixPrintOff
+     
+    configVarsList = computeConfigVariables (arraySizeList, unitArray)
+        
+    totalUnits = float(arrayLength*arrayLayers)
+    totalUnitsTimesTwo = totalUnits*2.0 
+
+    # Test to see if matrix adjustment is needed
+    x1 = float(configVarsList[0])/totalUnits
+    x1DeltaPos = x1 - x1TargetVal
+    x1DeltaNeg = x1TargetVal - x1 
+    
+
+    if not debugPrintOff:
+        print ' '
+        print '    The initial value for x1 is %.4f' % (x1)
+                                              
+    if x1DeltaPos < maxXDif: # x1 is not too large
+        x1DeltaPosAccept = True
+    else:
+        x1DeltaPosAccept = False        
+        
+    if x1DeltaNeg < maxXDif: # x1 is not too small
+        x1DeltaNegAccept = True
+    else:
+        x1DeltaNegAccept = False                 
+
+    x1Accept = False 
+    if x1DeltaPosAccept:
+        if x1DeltaNegAccept:
+            x1Accept = True                
+       
+
+    if not debugPrintOff:
+        print ' '                        
+        if x1Accept:
+                print '  '
+                print '  Matrix adjustment is not needed'
+                print '    The initial value for x1 is %.4f' % (x1) 
+                print '    This is less than the maximum difference of ', maxXDif 
+                print ' '
+        if x1DeltaPosAccept:
+                print '    The difference between x1 and the x1 target value is %.4f'% (x1DeltaPos) 
+        else:
+            if x1DeltaNegAccept:
+                print '    The difference between x1 and the x1 target value is %.4f'% (x1DeltaNeg)              
+                                                            
+
+    if not x1DeltaPosAccept: # x1 IS too large; begin adjusting matrix                                                                                                                      
+        for j in range (0, jrange, 1):
+            x1 = float(configVarsList[0])/totalUnits
+            x1DeltaPos = x1 - x1TargetVal            
+            if x1DeltaPos < maxXDif:  # x1 is not too large; exit FOR loop
+                if not detailedAdjustMatrixPrintOff: 
+                    print '  '
+                    print '  Matrix adjustment completed in ', j+1, 'steps'
+                    print ' '
+                break              
+            if not detailedAdjustMatrixPrintOff:
+                print '  Improving the unit array for j = ', j, ' x1 is too large'
+            unitArray = adjustMatrixX1Down (arraySizeList, unitArray, configVarsList, h)
+            configVarsList = computeConfigVariables (arraySizeList, unitArray)
+                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                    
+    if not x1DeltaNegAccept: # x1 IS too small; begin adjusting matrix                                                                                                                      
+        for j in range (0, jrange, 1):
+            x1 = float(configVarsList[0])/totalUnits
+            x1DeltaNeg = x1TargetVal - x1 
+            if x1DeltaNeg < maxXDif:  # x1 is not too large; exit FOR loop
+                if not detailedAdjustMatrixPrintOff: 
+                    print '  '
+                    print '  Matrix adjustment completed in ', j+1, 'steps'
+                    print ' '
+                break              
+            if not detailedAdjustMatrixPrintOff:
+                print '  Improving the unit array for j = ', j, ' x1 is too large'
+            unitArray = adjustMatrixX1Up (arraySizeList, unitArray, configVarsList, h)
+            configVarsList = computeConfigVariables (arraySizeList, unitArray)                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                    
+                                
+    return unitArray
+    # END adjustMatrix  
+                 
+
+####################################################################################################
+#
+# Function to find an x1 node, which will be a candidate for flipping to lower the total FE value
+#
+####################################################################################################
+
+def findCandidateX1node (arraySizeList, unitArray, maxRange, findFEMinimumValsDetailsBoolOff):
+    
+    arrayLength = arraySizeList[0]
+    arrayLayers = arraySizeList[1]
+    
+    candidateX1RowColList = (0,0,0)    
+                       
+    randomState = obtainRandomState (arraySizeList)
+    successBool = 0
+    for k in range (0, maxRange, 1):
+        unitRow = randomState.randint(0, arrayLayers)       
+        unitCol = randomState.randint(0, arrayLength)
+
+        if unitArray[unitRow,unitCol] == 1:
+            candidateX1RowColList = [unitRow, unitCol,k]
+            numCandidates = k
+            successBool = 1
+            if not findFEMinimumValsDetailsBoolOff:
+                print ' '
+                print '  For k = ', k, 'Candidate x1 found at Row: ', unitRow, 'Col: ', unitCol
+                numCandidates = k
+                successBool = 1
+            break
+        # if not findFEMinimumValsDetailsBoolOff:
+    
+    if successBool == 0:           
+        if not findFEMinimumValsDetailsBoolOff:
+            print ' ' 
+            print ' In findCandidateX2node' 
+            print ' Did not find a suitable x2 candidate after ', maxRange, ' attempts'
+            print ' '  
+                                    
+    return candidateX1RowColList
+    # END findCandidateX1 node
+
+
+####################################################################################################
+#
+# Function to find an x2 node, which will be a candidate for flipping to lower the total FE value
+#
+####################################################################################################
+
+def findCandidateX2node (arraySizeList, unitArray, maxRange, findFEMinimumValsDetailsBoolOff):
+    
+    arrayLength = arraySizeList[0]
+    arrayLayers = arraySizeList[1]
+    
+    candidateX2RowColList = (0,0,0)    
+
+    randomState = obtainRandomState (arraySizeList)
+    successBool = 0                                              
+    for k in range (0, maxRange, 1):
+        unitRow = randomState.randint(0, arrayLayers)       
+        unitCol = randomState.randint(0, arrayLength)
+
+        if unitArray[unitRow,unitCol] == 0:
+            candidateX2RowColList = [unitRow, unitCol,k]
+            successBool = 1
+            numCandidates = k            
+            if not findFEMinimumValsDetailsBoolOff:
+                print ' '
+                print '  For k = ', k, 'Candidate x2 found at Row: ', unitRow, 'Col: ', unitCol
+            break           
+        # if not findFEMinimumValsDetailsBoolOff:            
+        
+    if successBool == 0: 
+        if not findFEMinimumValsDetailsBoolOff:
+            print ' ' 
+            print ' In findCandidateX2node' 
+            print ' Did not find a suitable x2 candidate after ', maxRange, ' attempts'
+            print ' '  
+                                                                                        
+    return candidateX2RowColList
+    # END findCandidateX2 node
+
+
+
+####################################################################################################
+#
+# Function to fill a new unit matrix so it is identical to the starting matrix.
+#   The whole grid is copied in one NumPy operation. When a preallocated newUnitArray (of the same
+#   shape) is passed in, the units are copied into it and it is returned, so a caller that makes
+#   a copy on every trial can reuse one buffer instead of allocating a new grid each time.
+#
+####################################################################################################
+    
+def createIdenticalUnitArray (arraySizeList, unitArray, newUnitArray=None):
+    
+    if newUnitArray is None:
+        return (np.array(unitArray, copy=True))
+
+    newUnitArray[:, :] = unitArray
+                        
+    return newUnitArray
+
+
+
+
+
+####################################################################################################
+#
+# Function to adjust the array (while keeping x1, x2 const) to change the other config variables
+#   and bring the FE value to a minimum, with totalTrials greedy swap trials (the Kawasaki sampler
+#   runs its own set number of sweeps instead)
+#
+####################################################################################################
+    
+def adjustMatrixFEMinimum (arraySizeList, unitArray, h, maxRange, totalTrials=200):
+
+    arrayLength = arraySizeList.arrayLength
+    arrayLayers = arraySizeList.arrayLayers
+    useLocalFEUpdate = arraySizeList.runConfig.useLocalFEUpdate
+    useKawasakiSampler = arraySizeList.runConfig.useKawasakiSampler
+
+# Note:     sysValsList = (negS, enthalpy0, enthalpy1, freeEnergy): returned from computeThermValues          
+# Note:     configVarsList = (x1, x2, y1, y2, y3, w1, w2, w3, z1, z2, z3, z4, z5, z6, unitArray); returned from computeConfigVars     
+
+    maxRange = 30
+    
+# In the Kawasaki-sampler mode (selected in **main**), swaps are accepted with the Metropolis rule
+#   at a set temperature, for a set number of sweeps, instead of the greedy trials below
+    if useKawasakiSampler:
+        return adjustMatrixFEMinimumKawasaki (arraySizeList, unitArray, h)
+
+# In the local-update mode (selected in **main**), only the pairs and triplets touching the two
+#   swapped units are recounted for each trial
+    if useLocalFEUpdate:
+        return adjustMatrixFEMinimumLocal (arraySizeList, unitArray, h, maxRange, totalTrials)
+
+    findFEMinimumValsBoolOff = True
+    findFEMinimumValsDetailsBoolOff = True 
+    
+    step = 1 
+    
+    x1ValsArray   = np.zeros(totalTrials, dtype=np.float)
+    y1ValsArray   = np.zeros(totalTrials, dtype=np.float)
+    y2ValsArray   = np.zeros(totalTrials, dtype=np.float)
+    y3ValsArray   = np.zeros(totalTrials, dtype=np.float)
+    w1ValsArray   = np.zeros(totalTrials, dtype=np.float)
+    w2ValsArray   = np.zeros(totalTrials, dtype=np.float)
+    w3ValsArray   = np.zeros(totalTrials, dtype=np.float)
+    z1ValsArray   = np.zeros(totalTrials, dtype=np.float)
+    z3ValsArray   = np.zeros(totalTrials, dtype=np.float)       
+    negSValsArray = np.zeros(totalTrials, dtype=np.float)
+    enthalpy0Array= np.zeros(totalTrials, dtype=np.float)
+    enthalpy1Array= np.zeros(totalTrials, dtype=np.float)
+    freeEnergyArray=np.zeros(totalTrials, dtype=np.float)  
+
+# Each trial swap is made in unitArray itself, and undone if it does not lower the free energy;
+#   so no second grid is kept, and no grid is copied to test a two-unit change
+    
+    # Obtain fractional values for the configuration variables (previously retrieved total counts)        
+    totalUnits = float(arrayLength*arrayLayers)
+    totalUnitsTimesTwo = totalUnits*2.0   
+
+    # Obtain the starting values for the unitArray configuration variables and associated thermodynamic variables        
+    configVarsListOrig = computeConfigVariables (arraySizeList, unitArray)
+    x1Orig = float(configVarsListOrig[0])/totalUnits
+    y1Orig = float(configVarsListOrig[2])/totalUnitsTimesTwo 
+    y2Orig = float(configVarsListOrig[3])/(totalUnitsTimesTwo*2.0) 
+    y3Orig = float(configVarsListOrig[4])/totalUnitsTimesTwo        
+    z1Orig = float(configVarsListOrig[8])/totalUnitsTimesTwo      
+    z3Orig = float(configVarsListOrig[10])/totalUnitsTimesTwo
+    sysValsListOrig = computeThermodynamicVars(arraySizeList, h, configVarsListOrig)
+    negEntropyOrig  = sysValsListOrig[0]
+    enthalpy1Orig   = sysValsListOrig[2]  
+    FEValueOrig     = sysValsListOrig[3]                  
+                                
+    successfulFlips = 0 # Count the total number of successful flips during the totalTrials
+
+    if not findFEMinimumValsBoolOff:
+        print ' ' 
+        print ' In adjustMatrixFEMinimum with h = ', h
+        print ' Starting to adjust config vars to minimize free energy'                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                        
+        print '   Trial parameters: x1(starting) =  %.3f' % (x1Orig), ' h =  %.2f' % (h)
+        print ' '
+    
+            
+    for i in range (0, totalTrials, step): 
+        x1CandidateRowColList = findCandidateX1node (arraySizeList, unitArray, maxRange, findFEMinimumValsDetailsBoolOff)
+        x1Row   = x1CandidateRowColList[0]
+        x1Col   = x1CandidateRowColList[1]
+        x1Flips = x1CandidateRowColList[2]
+
+        x2CandidateRowColList = findCandidateX2node (arraySizeList, unitArray, maxRange, findFEMinimumValsDetailsBoolOff)
+        x2Row   = x2CandidateRowColList[0]
+        x2Col   = x2CandidateRowColList[1]
+        x2Flips = x2CandidateRowColList[2]  
+             
+        if not findFEMinimumValsDetailsBoolOff:
+            print ' ' 
+            print '  For i = ', i, ' the candidate x1 value is at Row: ', x1Row, ' Column: ', x1Col, ' after ', x1Flips, 'flips.'
+            print '  For i = ', i, ' the candidate x2 value is at Row: ', x2Row, ' Column: ', x2Col, ' after ', x2Flips, 'flips.'
+
+        # Obtain the configuration variable values before the swap
+        configVarsListOld = computeConfigVariables (arraySizeList, unitArray)
+
+        # Swap the unit values in place: keeping x1 the same, but changing the other config variable values.
+        #   The values being overwritten are saved, so that the swap can be undone exactly
+        x1UnitVal = unitArray[x1Row,x1Col]
+        x2UnitVal = unitArray[x2Row,x2Col]
+        unitArray[x1Row,x1Col] = 0
+        unitArray[x2Row,x2Col] = 1
+                                                                                                      
+        # Obtain the configuration variable values after the swap
+        configVarsListNew = computeConfigVariables (arraySizeList, unitArray)
+    
+        # Obtain the thermodynamic variables corresponding to each of the old and new unitArrrays
+        sysValsListOld = computeThermodynamicVars(arraySizeList, h, configVarsListOld)
+        negEntropyOld  = sysValsListOld[0]
+        enthalpy1Old   = sysValsListOld[2]  
+        FEValueOld     = sysValsListOld[3]    
+   
+        sysValsListNew= computeThermodynamicVars(arraySizeList, h, configVarsListNew) 
+        negEntropyNew  = sysValsListNew[0]
+        enthalpy1New   = sysValsListNew[2] 
+        FEValueNew     = sysValsListNew[3]      
+                
+        x1Old = float(configVarsListOld[0])/totalUnits
+        x1New = float(configVarsListNew[0])/totalUnits
+        y2Old = float(configVarsListOld[3])/(totalUnitsTimesTwo*2.)
+        y2New = float(configVarsListNew[3])/(totalUnitsTimesTwo*2.)
+        z1Old = float(configVarsListOld[8])/totalUnitsTimesTwo
+        z1New = float(configVarsListNew[8])/totalUnitsTimesTwo         
+        z3Old = float(configVarsListOld[10])/totalUnitsTimesTwo
+        z3New = float(configVarsListNew[10])/totalUnitsTimesTwo
+
+        x1ValsArray[i]   = x1New
+        y2ValsArray[i]   = y2New 
+        z1ValsArray[i]   = z1New
+        z3ValsArray[i]   = z3New      
+        negSValsArray[i]   = negEntropyNew
+        enthalpy1Array[i]   = enthalpy1New
+        freeEnergyArray[i]   = FEValueNew 
+                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                
+        # Print the results of the single flip: Note thermodynamic variables
+        if not findFEMinimumValsDetailsBoolOff:                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                       
+            print ' '
+            print ' ' 
+            print ' The results of a single flip in two unitArray positions, at trial number', i, ' of ', totalTrials, ' total trials' 
+            print ' '        
+            print '          x1      y2       z1       z3       negS    enthalpy1   FE '
+            print ' Old:   %.4f' % (x1Old), '  %.4f' % (y2Old), '  %.4f' % (z1Old) , '  %.4f' % (z3Old) , '  %.4f' % (negEntropyOld),   '  %.4f' % (enthalpy1Old),  '  %.4f' % (FEValueOld)       
+            print ' New:   %.4f' % (x1New), '  %.4f' % (y2New), '  %.4f' % (z1New) , '  %.4f' % (z3New), '  %.4f' % (negEntropyNew),   '  %.4f' % (enthalpy1New),  '  %.4f' % (FEValueNew)    
+            print ' ' 
+
+        # If the flip was successful, keep the swap already made in unitArray
+        #  Otherwise, undo the swap, putting unitArray back to its earlier state
+        successBool = 0
+        if FEValueNew < FEValueOld: successBool = 1
+        if successBool:
+#             print ' After flip:'
+#             print '      New unitArray at Row = ', x1Row, ' Col = ', x1Col, ' is ', unitArray[x1Row,x1Col]
+#             print '      New unitArray at Row = ', x2Row, ' Col = ', x2Col, ' is ', unitArray[x2Row,x2Col]
+            successfulFlips = successfulFlips + 1
+            x1End = x1New
+            y2End = y2New
+            z1End = z1New
+            z3End = z3New
+            negEntropyEnd = negEntropyNew
+            enthalpy1End = enthalpy1New
+            FEValueEnd = FEValueNew                           
+            if not findFEMinimumValsDetailsBoolOff:                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                       
+                print ' '
+                print ' Successful flip: free energy reduced, keeping the change'         
+        else: 
+            unitArray[x2Row,x2Col] = x2UnitVal
+            unitArray[x1Row,x1Col] = x1UnitVal
+            x1End = x1Old
+            y2End = y2Old
+            z1End = z1Old
+            z3End = z3Old
+            negEntropyEnd = negEntropyOld
+            enthalpy1End = enthalpy1Old
+            FEValueEnd = FEValueOld 
+            if not findFEMinimumValsDetailsBoolOff:                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                       
+                print ' '
+                print ' Unsuccessful flip: free energy increased, NOT keeping the change'        
+
+#    print ' '
+#    print ' In adjustMatrixFEMinimum, completed all computations, for h = ', h
+#    print ' '
+#    print ' The total number of successful flips out of ', totalTrials, 'is: ', successfulFlips 
+#    print ' ' 
+#    print ' The total change in the configuration and thermodynamic variables:'
+#    print '          x1      y2       z1       z3       negS    enthalpy1   FE '
+#    print ' Orig:   %.4f' % (x1Orig), '  %.4f' % (y2Orig), '  %.4f' % (z1Orig) , '  %.4f' % (z3Orig) , '  %.4f' % (negEntropyOrig),   '  %.4f' % (enthalpy1Orig),  '  %.4f' % (FEValueOrig)       
+#    print ' End:    %.4f' % (x1End), '  %.4f' % (y2End), '  %.4f' % (z1End) , '  %.4f' % (z3End), '  %.4f' % (negEntropyEnd),   '  %.4f' % (enthalpy1End),  '  %.4f' % (FEValueEnd)    
+#    print ' '
+#    print ' '                                                                                                          
+
+    if not findFEMinimumValsBoolOff:
+        printUnitArrayModificationResults (arraySizeList, x1ValsArray, y2ValsArray, 
+            z1ValsArray, z3ValsArray, negSValsArray, enthalpy1Array, freeEnergyArray, h, totalTrials, findFEMinimumValsBoolOff)             
+                                     
+       
+    return unitArray
+    # END adjustMatrixFEMinimum      
+
+
+
+####################################################################################################
+#
+# Function to count the configuration variables contributed by some of the pairs and triplets only.
+#   Inputs: the CVMLattice, the flattened unitArray, and the lists of y pairs, w pairs, and
+#           z triplets (as row numbers in the lattice tables) to be counted
+#   Returns a 14-element array laid out as configVarsList (x counts are left at zero).
+#
+####################################################################################################
+
+def computeLatticeClusterConfigVariables (cvmLattice, unitVector, yPairsList, wPairsList, zTripletsList):
+
+    yUnitsArray = unitVector[cvmLattice.yPairsArray[yPairsList]] > 0.1
+    wUnitsArray = unitVector[cvmLattice.wPairsArray[wPairsList]] > 0.1
+    zUnitsArray = unitVector[cvmLattice.zTripletsArray[zTripletsList]] > 0.1
+
+    yCodes = 2*yUnitsArray[:, 0] + yUnitsArray[:, 1]
+    wCodes = 2*wUnitsArray[:, 0] + wUnitsArray[:, 1]
+    zCodes = 4*zUnitsArray[:, 0] + 2*zUnitsArray[:, 1] + zUnitsArray[:, 2]
+
+    configVarsPositions = np.concatenate((cvmLattice.yIndexTable[yCodes], cvmLattice.wIndexTable[wCodes], 
+                                          cvmLattice.zIndexTable[zCodes]))
+    clusterCounts = np.bincount(configVarsPositions, minlength=14)
+
+    return clusterCounts
+
+
+####################################################################################################
+####################################################################################################
+#
+# Function to compute the change in ALL the configuration variables that results from swapping an
+#   A unit (at x1Row, x1Col) with a B unit (at x2Row, x2Col), without recounting the whole grid.
+#   Only the (at most 28) pairs and triplets that contain one of the two units can change; these
+#   are looked up in the CVMLattice membership tables and counted before and after the swap, so the
+#   cost does not depend on the grid size.
+#   The unitArray is returned to its original state before this function returns.
+#
+####################################################################################################
+####################################################################################################
+
+def computeSwapDeltaConfigVariables (arraySizeList, unitArray, x1Row, x1Col, x2Row, x2Col):
+
+    arrayLength = arraySizeList [0]
+
+    cvmLattice = obtainCVMLattice (arraySizeList)
+
+# Collect the pairs and triplets touching either unit; one containing both units is counted once
+    swapUnits = [x1Row*arrayLength + x1Col, x2Row*arrayLength + x2Col]
+    yPairsList    = np.unique(cvmLattice.unitYPairsArray[swapUnits])
+    wPairsList    = np.unique(cvmLattice.unitWPairsArray[swapUnits])
+    zTripletsList = np.unique(cvmLattice.unitZTripletsArray[swapUnits])
+
+    oldX1Value = unitArray[x1Row, x1Col]
+    oldX2Value = unitArray[x2Row, x2Col]
+
+    countsBefore = computeLatticeClusterConfigVariables (cvmLattice, unitArray.ravel(), yPairsList, wPairsList, zTripletsList)
+    unitArray[x1Row, x1Col] = oldX2Value
+    unitArray[x2Row, x2Col] = oldX1Value
+    countsAfter = computeLatticeClusterConfigVariables (cvmLattice, unitArray.ravel(), yPairsList, wPairsList, zTripletsList)
+    unitArray[x1Row, x1Col] = oldX1Value
+    unitArray[x2Row, x2Col] = oldX2Value
+
+    configVarsDelta = countsAfter - countsBefore
+
+    return configVarsDelta
+
+
+####################################################################################################
+####################################################################################################
+#
+# Function to adjust the array (while keeping x1, x2 const) to bring the FE value to a minimum,
+#   using running totals of the configuration variables.
+# This follows the same steps (and the same random draws) as adjustMatrixFEMinimum, but the
+#   configuration variables are counted only once, at the start. For each trial, the change due
+#   to the candidate swap is found with computeSwapDeltaConfigVariables, and the new free energy
+#   is obtained from the updated totals; each trial is therefore O(1) instead of O(N).
+#
+####################################################################################################
+####################################################################################################
+
+def adjustMatrixFEMinimumLocal (arraySizeList, unitArray, h, maxRange, totalTrials=200):
+
+    arrayLength = arraySizeList.arrayLength
+    arrayLayers = arraySizeList.arrayLayers
+
+    findFEMinimumValsBoolOff = True
+    findFEMinimumValsDetailsBoolOff = True 
+    
+    step = 1 
+    
+    x1ValsArray   = np.zeros(totalTrials, dtype=np.float)
+    y2ValsArray   = np.zeros(totalTrials, dtype=np.float)
+    z1ValsArray   = np.zeros(totalTrials, dtype=np.float)
+    z3ValsArray   = np.zeros(totalTrials, dtype=np.float)       
+    negSValsArray = np.zeros(totalTrials, dtype=np.float)
+    enthalpy1Array= np.zeros(totalTrials, dtype=np.float)
+    freeEnergyArray=np.zeros(totalTrials, dtype=np.float)  
+
+    totalUnits = float(arrayLength*arrayLayers)
+    totalUnitsTimesTwo = totalUnits*2.0   
+
+# Count the configuration variables once; these running totals are updated after each accepted swap
+    configVarsListOld = computeConfigVariables (arraySizeList, unitArray)
+    configVarsCountsOld = np.array(configVarsListOld[0:14], dtype=np.int)
+    sysValsListOld = computeThermodynamicVars(arraySizeList, h, configVarsCountsOld)
+
+    successfulFlips = 0
+
+    if not findFEMinimumValsBoolOff:
+        print ' ' 
+        print ' In adjustMatrixFEMinimumLocal with h = ', h
+        print '   Trial parameters: x1(starting) =  %.3f' % (configVarsCountsOld[0]/totalUnits), ' h =  %.2f' % (h)
+        print ' '
+
+    for i in range (0, totalTrials, step): 
+        x1CandidateRowColList = findCandidateX1node (arraySizeList, unitArray, maxRange, findFEMinimumValsDetailsBoolOff)
+        x1Row   = x1CandidateRowColList[0]
+        x1Col   = x1CandidateRowColList[1]
+
+        x2CandidateRowColList = findCandidateX2node (arraySizeList, unitArray, maxRange, findFEMinimumValsDetailsBoolOff)
+        x2Row   = x2CandidateRowColList[0]
+        x2Col   = x2CandidateRowColList[1]
+
+# If a candidate was not found, the swap would not keep x1 the same; the full-recount version
+#   still applies it, so the same is done here to keep the two versions in step
+        if unitArray[x1Row, x1Col] != 1 or unitArray[x2Row, x2Col] != 0:
+            trialArray = np.copy(unitArray)
+            trialArray[x1Row, x1Col] = 0
+            trialArray[x2Row, x2Col] = 1
+            configVarsCountsNew = np.array(computeConfigVariables (arraySizeList, trialArray)[0:14], dtype=np.int)
+        else:
+            configVarsDelta = computeSwapDeltaConfigVariables (arraySizeList, unitArray, x1Row, x1Col, x2Row, x2Col)
+            configVarsCountsNew = configVarsCountsOld + configVarsDelta
+
+        sysValsListNew = computeThermodynamicVars(arraySizeList, h, configVarsCountsNew)
+        FEValueOld = sysValsListOld[3]
+        FEValueNew = sysValsListNew[3]
+
+        x1ValsArray[i]     = float(configVarsCountsNew[0])/totalUnits
+        y2ValsArray[i]     = float(configVarsCountsNew[3])/(totalUnitsTimesTwo*2.)
+        z1ValsArray[i]     = float(configVarsCountsNew[8])/totalUnitsTimesTwo
+        z3ValsArray[i]     = float(configVarsCountsNew[10])/totalUnitsTimesTwo
+        negSValsArray[i]   = sysValsListNew[0]
+        enthalpy1Array[i]  = sysValsListNew[2]
+        freeEnergyArray[i] = FEValueNew
+
+        if FEValueNew < FEValueOld:
+            unitArray[x1Row,x1Col] = 0
+            unitArray[x2Row,x2Col] = 1
+            configVarsCountsOld = configVarsCountsNew
+            sysValsListOld = sysValsListNew
+            successfulFlips = successfulFlips + 1
+            if not findFEMinimumValsDetailsBoolOff:
+                print ' Successful flip: free energy reduced, keeping the change'
+        else:
+            if not findFEMinimumValsDetailsBoolOff:
+                print ' Unsuccessful flip: free energy increased, NOT keeping the change'
+
+    if not findFEMinimumValsBoolOff:
+        printUnitArrayModificationResults (arraySizeList, x1ValsArray, y2ValsArray, 
+            z1ValsArray, z3ValsArray, negSValsArray, enthalpy1Array, freeEnergyArray, h, totalTrials, findFEMinimumValsBoolOff)             
+
+    return unitArray
+    # END adjustMatrixFEMinimumLocal
+
+
+
+####################################################################################################
+####################################################################################################
+#
+# Generator for the Kawasaki-swap Metropolis sampler. Each step picks a random A unit and a random
+#   B unit and proposes to swap them, so x1 never changes. The change in the free energy of the
+#   whole grid, dF = totalUnits*(FENew - FEOld), is found from running totals of the configuration
+#   variables (as in adjustMatrixFEMinimumLocal), and the swap is accepted with the Metropolis rule:
+#     - always, if dF <= 0
+#     - with probability exp(-dF/temperature), if dF > 0
+#   With temperature = 0 only swaps that do not raise the free energy are kept. A sweep is
+#   totalUnits proposed swaps.
+#
+# The unitArray is modified in place. After the first burnInSweeps sweeps, every thinning'th sweep
+#   yields a tuple of observables, as soon as that sweep is done:
+#     (sweepNum, acceptanceRatio, configVarsCounts, sysValsList)
+#   where configVarsCounts is the array of the 14 raw counts, and
+#   sysValsList = (negS, enthalpy0, enthalpy1, freeEnergy), as returned by computeThermodynamicVars
+#
+####################################################################################################
+####################################################################################################
+
+def generateKawasakiSweeps (arraySizeList, unitArray, h, temperature, totalSweeps, burnInSweeps, thinning):
+
+    localArrayLength = arraySizeList[0]
+    localArrayLayers = arraySizeList[1]
+    totalUnits = localArrayLength*localArrayLayers
+
+    configVarsList = computeConfigVariables (arraySizeList, unitArray)
+    configVarsCounts = np.array(configVarsList[0:14], dtype=np.int)
+    sysValsList = computeThermodynamicVars(arraySizeList, h, configVarsCounts)
+
+# The (flattened) positions of the A units and the B units; kept up to date as swaps are accepted,
+#   so that a random A unit and a random B unit can be picked directly
+    x1UnitsArray = np.flatnonzero(unitArray > 0.1)
+    x2UnitsArray = np.flatnonzero(unitArray <= 0.1)
+    totalX1Units = len(x1UnitsArray)
+    totalX2Units = len(x2UnitsArray)
+
+# With only A units or only B units, there is no swap to make
+    if totalX1Units == 0 or totalX2Units == 0:
+        return
+
+    randomState = obtainRandomState (arraySizeList)
+    for sweepNum in range (1, totalSweeps+1):
+        x1PicksArray = randomState.randint(0, totalX1Units, size=totalUnits)
+        x2PicksArray = randomState.randint(0, totalX2Units, size=totalUnits)
+        acceptValsArray = randomState.random_sample(totalUnits)
+        acceptedSwaps = 0
+
+        for step in range (0, totalUnits):
+            x1Pick = x1PicksArray[step]
+            x2Pick = x2PicksArray[step]
+            (x1Row, x1Col) = divmod(int(x1UnitsArray[x1Pick]), localArrayLength)
+            (x2Row, x2Col) = divmod(int(x2UnitsArray[x2Pick]), localArrayLength)
+
+            configVarsDelta = computeSwapDeltaConfigVariables (arraySizeList, unitArray, x1Row, x1Col, x2Row, x2Col)
+            configVarsCountsNew = configVarsCounts + configVarsDelta
+            sysValsListNew = computeThermodynamicVars(arraySizeList, h, configVarsCountsNew)
+            FEChange = totalUnits*(sysValsListNew[3] - sysValsList[3])
+
+            acceptSwap = False
+            if FEChange <= 0.0:
+                acceptSwap = True
+            elif temperature > 0.0:
+                if acceptValsArray[step] < exp(-FEChange/temperature): acceptSwap = True
+
+            if acceptSwap:
+                unitArray[x1Row,x1Col] = 0
+                unitArray[x2Row,x2Col] = 1
+                x1UnitsArray[x1Pick] = x2Row*localArrayLength + x2Col
+                x2UnitsArray[x2Pick] = x1Row*localArrayLength + x1Col
+                configVarsCounts = configVarsCountsNew
+                sysValsList = sysValsListNew
+                acceptedSwaps = acceptedSwaps + 1
+
+        if sweepNum > burnInSweeps and (sweepNum - burnInSweeps) % thinning == 0:
+            acceptanceRatio = float(acceptedSwaps)/totalUnits
+            yield (sweepNum, acceptanceRatio, configVarsCounts.copy(), sysValsList)
+
+    # END generateKawasakiSweeps
+
+
+
+####################################################################################################
+####################################################################################################
+#
+# Function to adjust the array (while keeping x1, x2 const) towards the free energy minimum with the
+#   Kawasaki-swap Metropolis sampler, instead of the fixed number of greedy trials used in
+#   adjustMatrixFEMinimum. The temperature and the number of sweeps, burn-in sweeps, and thinning
+#   are set in **main**. The observables of each reported sweep are printed as they arrive
+#   (when findFEMinimumValsBoolOff is False), and kept for printUnitArrayModificationResults.
+#
+####################################################################################################
+####################################################################################################
+
+def adjustMatrixFEMinimumKawasaki (arraySizeList, unitArray, h):
+
+    arrayLength = arraySizeList.arrayLength
+    arrayLayers = arraySizeList.arrayLayers
+    kawasakiTemperature = arraySizeList.runConfig.kawasakiTemperature
+    kawasakiTotalSweeps = arraySizeList.runConfig.kawasakiTotalSweeps
+    kawasakiBurnInSweeps = arraySizeList.runConfig.kawasakiBurnInSweeps
+    kawasakiThinning = arraySizeList.runConfig.kawasakiThinning
+
+    findFEMinimumValsBoolOff = True
+
+    totalUnits = float(arrayLength*arrayLayers)
+    totalUnitsTimesTwo = totalUnits*2.0   
+
+    x1ValsList     = list()
+    y2ValsList     = list()
+    z1ValsList     = list()
+    z3ValsList     = list()
+    negSValsList   = list()
+    enthalpy1List  = list()
+    freeEnergyList = list()
+
+    if not findFEMinimumValsBoolOff:
+        print ' ' 
+        print ' In adjustMatrixFEMinimumKawasaki with h = ', h, ' temperature = ', kawasakiTemperature
+        print ' Sweep  accepted     x1      y2      z1      z3     negS    enth1  freeEnergy'
+
+    for sweepObservables in generateKawasakiSweeps (arraySizeList, unitArray, h, kawasakiTemperature, 
+            kawasakiTotalSweeps, kawasakiBurnInSweeps, kawasakiThinning):
+        (sweepNum, acceptanceRatio, configVarsCounts, sysValsList) = sweepObservables
+
+        x1ValsList.append(float(configVarsCounts[0])/totalUnits)
+        y2ValsList.append(float(configVarsCounts[3])/(totalUnitsTimesTwo*2.))
+        z1ValsList.append(float(configVarsCounts[8])/totalUnitsTimesTwo)
+        z3ValsList.append(float(configVarsCounts[10])/totalUnitsTimesTwo)
+        negSValsList.append(sysValsList[0])
+        enthalpy1List.append(sysValsList[2])
+        freeEnergyList.append(sysValsList[3])
+
+        if not findFEMinimumValsBoolOff:
+            print ' %4d' % (sweepNum), '   %.3f' % (acceptanceRatio), '   %.4f' % (x1ValsList[-1]), '  %.4f' % (y2ValsList[-1]), '  %.4f' % (z1ValsList[-1]), '  %.4f' % (z3ValsList[-1]), '  %.4f' % (negSValsList[-1]), '  %.4f' % (enthalpy1List[-1]), '  %.4f' % (freeEnergyList[-1])
+
+    if not findFEMinimumValsBoolOff and len(freeEnergyList) > 0:
+        printUnitArrayModificationResults (arraySizeList, np.array(x1ValsList), np.array(y2ValsList), 
+            np.array(z1ValsList), np.array(z3ValsList), np.array(negSValsList), np.array(enthalpy1List), 
+            np.array(freeEnergyList), h, len(freeEnergyList), findFEMinimumValsBoolOff)             
+
+    return unitArray
+    # END adjustMatrixFEMinimumKawasaki
+                
+                                                
+####################################################################################################
+####################################################################################################
+#
+# Function to compute, for a stack of grids, the change in ALL the configuration variables from
+#   swapping one pair of units in each grid: in grid gridNumsArray[k], the units x1UnitsArray[k] and
+#   x2UnitsArray[k] (flattened unit numbers) are swapped. As in computeSwapDeltaConfigVariables,
+#   only the pairs and triplets containing one of the two units are counted, before and after the
+#   swap; a pair or triplet listed more than once (e.g. one holding both units) is counted once.
+#   The grids are not changed. Returns an integer array with shape (len(gridNumsArray), 14).
+#
+####################################################################################################
+####################################################################################################
+
+def computeSwapDeltaConfigVariablesBatch (arraySizeList, unitVectorStack, gridNumsArray, x1UnitsArray, x2UnitsArray):
+
+    cvmLattice = obtainCVMLattice (arraySizeList)
+
+    numSwaps = len(gridNumsArray)
+    gridNumsColumn = gridNumsArray.reshape(numSwaps, 1, 1)
+    x1UnitsColumn = x1UnitsArray.reshape(numSwaps, 1, 1)
+    x2UnitsColumn = x2UnitsArray.reshape(numSwaps, 1, 1)
+    x1ValsColumn = unitVectorStack[gridNumsArray, x1UnitsArray].reshape(numSwaps, 1, 1) > 0.1
+    x2ValsColumn = unitVectorStack[gridNumsArray, x2UnitsArray].reshape(numSwaps, 1, 1) > 0.1
+
+    clusterTablesList = ((cvmLattice.yPairsArray, cvmLattice.unitYPairsArray, cvmLattice.yIndexTable), 
+                         (cvmLattice.wPairsArray, cvmLattice.unitWPairsArray, cvmLattice.wIndexTable), 
+                         (cvmLattice.zTripletsArray, cvmLattice.unitZTripletsArray, cvmLattice.zIndexTable))
+
+    configVarsPositionsList = list()
+    clusterWeightsList = list()
+    for (clusterArray, unitClustersArray, indexTable) in clusterTablesList:
+        clustersStack = np.concatenate((unitClustersArray[x1UnitsArray], unitClustersArray[x2UnitsArray]), axis=1)
+        totalListed = clustersStack.shape[1]
+
+# Keep only the first listing of each pair or triplet
+        earlierListingsMask = np.tril(np.ones((totalListed, totalListed), dtype=bool), -1)
+        repeatedStack = ((clustersStack[:, :, np.newaxis] == clustersStack[:, np.newaxis, :]) & earlierListingsMask).any(axis=2)
+        clusterWeightsStack = np.logical_not(repeatedStack).astype(np.int)
+
+        clusterUnitsStack = clusterArray[clustersStack]
+        unitsBeforeStack = unitVectorStack[gridNumsColumn, clusterUnitsStack] > 0.1
+        unitsAfterStack = np.where(clusterUnitsStack == x1UnitsColumn, x2ValsColumn, 
+                                   np.where(clusterUnitsStack == x2UnitsColumn, x1ValsColumn, unitsBeforeStack))
+
+        codeWeightsArray = 2**np.arange(clusterArray.shape[1]-1, -1, -1)
+        codesBeforeStack = (unitsBeforeStack*codeWeightsArray).sum(axis=2)
+        codesAfterStack = (unitsAfterStack*codeWeightsArray).sum(axis=2)
+
+        swapOffsetsColumn = 14*np.arange(numSwaps).reshape(numSwaps, 1)
+        configVarsPositionsList.extend([indexTable[codesBeforeStack] + swapOffsetsColumn, indexTable[codesAfterStack] + swapOffsetsColumn])
+        clusterWeightsList.extend([-clusterWeightsStack, clusterWeightsStack])
+
+    configVarsPositionsArray = np.concatenate([positionsStack.ravel() for positionsStack in configVarsPositionsList])
+    clusterWeightsArray = np.concatenate([weightsStack.ravel() for weightsStack in clusterWeightsList])
+    configVarsDeltaArray = np.bincount(configVarsPositionsArray, weights=clusterWeightsArray, minlength=14*numSwaps)
+
+    return (np.rint(configVarsDeltaArray).astype(np.int).reshape(numSwaps, 14))
+
+
+####################################################################################################
+####################################################################################################
+#
+# Function to bring a whole stack of grids (each keeping its own x1) towards the free energy
+#   minimum together, with one shared set of greedy swap trials, as in adjustMatrixFEMinimumLocal:
+#   in each of the totalTrials trials, every grid proposes to swap one of its A units with one of
+#   its B units, the changes in the configuration variables of all of the grids are found at once
+#   (computeSwapDeltaConfigVariablesBatch), and each grid keeps its swap if its free energy drops.
+# The A and B units are picked directly from lists of their positions (kept up to date as swaps are
+#   accepted, as in generateKawasakiSweeps), so every trial is a real A/B swap. Grids that have
+#   only A units or only B units are left as they are.
+#   Input:   unitArrayStack, with shape (numGrids, arrayLayers, arrayLength); it is not changed
+#   Returns: the FE-minimized stack (a new array), with the same shape
+#
+####################################################################################################
+####################################################################################################
+
+def adjustMatrixFEMinimumBatch (arraySizeList, unitArrayStack, h, totalTrials=200):
+
+    numGrids = unitArrayStack.shape[0]
+    totalUnits = arraySizeList.arrayLength*arraySizeList.arrayLayers
+    randomState = obtainRandomState (arraySizeList)
+
+# The swaps are made in a copy, so that the caller's stack is left as it was
+    unitVectorStack = np.array(unitArrayStack, copy=True).reshape(numGrids, totalUnits)
+
+# Running totals of the configuration variables and the free energy, for every grid
+    configVarsCountsStack = np.array(computeConfigVariablesBatch (arraySizeList, unitArrayStack), dtype=np.int)
+    freeEnergyArray = computeThermodynamicVarsBatch (arraySizeList, h, configVarsCountsStack)[:, 3]
+
+# The (flattened) positions of each grid's A units come first in its row of x1UnitsStack, and those
+#   of its B units first in its row of x2UnitsStack
+    x1FlagsStack = unitVectorStack > 0.1
+    totalX1UnitsArray = x1FlagsStack.sum(axis=1)
+    totalX2UnitsArray = totalUnits - totalX1UnitsArray
+    x1UnitsStack = np.argsort(np.logical_not(x1FlagsStack), axis=1, kind='mergesort')
+    x2UnitsStack = np.argsort(x1FlagsStack, axis=1, kind='mergesort')
+
+    gridNumsArray = np.flatnonzero((totalX1UnitsArray > 0) & (totalX2UnitsArray > 0))
+    if len(gridNumsArray) == 0:
+        return (unitVectorStack.reshape(unitArrayStack.shape))
+
+    for trialNum in range (0, totalTrials):
+        x1PicksArray = (randomState.random_sample(len(gridNumsArray))*totalX1UnitsArray[gridNumsArray]).astype(np.int)
+        x2PicksArray = (randomState.random_sample(len(gridNumsArray))*totalX2UnitsArray[gridNumsArray]).astype(np.int)
+        x1UnitsArray = x1UnitsStack[gridNumsArray, x1PicksArray]
+        x2UnitsArray = x2UnitsStack[gridNumsArray, x2PicksArray]
+
+        configVarsDeltaArray = computeSwapDeltaConfigVariablesBatch (arraySizeList, unitVectorStack, gridNumsArray, 
+                                                                     x1UnitsArray, x2UnitsArray)
+        configVarsCountsNew = configVarsCountsStack[gridNumsArray] + configVarsDeltaArray
+        freeEnergyNew = computeThermodynamicVarsBatch (arraySizeList, h, configVarsCountsNew)[:, 3]
+
+        acceptedMask = freeEnergyNew < freeEnergyArray[gridNumsArray]
+        acceptedGridsArray = gridNumsArray[acceptedMask]
+        unitVectorStack[acceptedGridsArray, x1UnitsArray[acceptedMask]] = 0
+        unitVectorStack[acceptedGridsArray, x2UnitsArray[acceptedMask]] = 1
+        x1UnitsStack[acceptedGridsArray, x1PicksArray[acceptedMask]] = x2UnitsArray[acceptedMask]
+        x2UnitsStack[acceptedGridsArray, x2PicksArray[acceptedMask]] = x1UnitsArray[acceptedMask]
+        configVarsCountsStack[acceptedGridsArray] = configVarsCountsNew[acceptedMask]
+        freeEnergyArray[acceptedGridsArray] = freeEnergyNew[acceptedMask]
+
+    return (unitVectorStack.reshape(unitArrayStack.shape))
+    # END adjustMatrixFEMinimumBatch
+                
+                                                
+####################################################################################################
+#
+# Function to compute a term (Lf(v)) needed to compute the entropy
+#
+####################################################################################################
+
+def LfFunc(x):
+# x*log(x) goes to zero as x goes to zero; a configuration variable can reach zero while the
+#   Kawasaki sampler explores far from equiprobable
+    if x == 0.0: return (0.0)
+    Lfval = x*log(x)-x
+    return (Lfval)
+
+
+####################################################################################################
+####################################################################################################
+#
+# Function to compute the entropy
+# This was used exclusively for computing the predicted (analytic) values for the entropy,
+#  in the case where the configuration variables were analytically defined in terms of probability
+#  distribution for h = 1. 
+#
+####################################################################################################
+####################################################################################################
+
+
+def computeAnalyticConfigAndThermVars (arraySizeList, x1TargetVal):
+
+    arrayLength = arraySizeList.arrayLength
+    arrayLayers = arraySizeList.arrayLayers
+
+#    print ' '
+#    print '  In AnalyticConfigAndThermVars '
+#    print ' '
+
+    totalUnits = float(arrayLength*arrayLayers)
+#    printConfigVars (configVarsList)      
+                        
+    x1 = x1TargetVal
+    x2 = 1.0 - x1TargetVal
+    sumX = x1+x2  
+
+#    print ' ' 
+#    print '                x1 = %.4f'  % x1
+#    print '                x2 = %.4f'  % x2
+#    print '   Sum of the x(i) = %.4f'  % sumX
+#    print ' ' 
+    
+    y1 = x1*x1
+    y2 = x1*x2
+    y3 = x2*x2
+    w1 = x1*x1
+    w2 = x1*x2
+    w3 = x2*x2        
+    z1 = x1*x1*x1
+    z2 = x1*x1*x2
+    z3 = x1*x2*x1 
+    z4 = x2*x1*x2
+    z5 = x2*x2*x1
+    z6 = x2*x2*x2
+
+    sumY = y1+y2+y3    
+#    print
+#    print "Totals for the y(i) variables:"
+#    print '          (A-A) y1 = %.4f'  % y1 
+#    print '    (A-B & B-A) y2 = %.4f'  % y2   
+#    print '          (B-B) y3 = %.4f'  % y3 
+#    print '   Sum of the y(i) = %.4f'  % sumY
+#    print 
+    
+    sumW = w1+w2+w3 
+#    print
+#    print "Totals for the w(i) variables:"
+#    print '        (A---A) w1 = %.4f'  % w1 
+#    print '(A---B & B---A) w2 = %.4f'  % w2   
+#    print '        (B---B) w3 = %.4f'  % w3 
+#    print '   Sum of the w(i) = %.4f'  % sumW
+#    print         
+
+    sumZ = z1+z2+z3 +z4+z5+z6
+
+#    print
+#    print "Totals for the z(i) variables:"
+#    print '        (A-A-A) z1 = %.4f'  % z1 
+#    print '(A-A-B & B-A-A) z2 = %.4f'  % z2   
+#    print '        (A-B-A) z3 = %.4f'  % z3 
+#    print '        (B-A-B) z4 = %.4f'  % z4 
+#    print '(A-B-B & B-B-A) z5 = %.4f'  % z5 
+#    print '        (B-B-B) z6 = %.4f'  % z6         
+#    print '   Sum of the z(i) = %.4f'  % sumZ
+#    print                    
+                                                
+    Lfx = LfFunc(x1)+LfFunc(x2)
+#    print ' lnFunc (x) = %.4f'  % (Lfx)
+
+    Lfy = LfFunc(y1) + 2*LfFunc(y2) + LfFunc(y3)
+#    print ' lnFunc (y) = %.4f'  % (Lfy)  
+      
+    Lfw = LfFunc(w1) + 2*LfFunc(w2) + LfFunc(w3)
+#    print ' lnFunc (w) = %.4f'  % (Lfw)
+
+    Lfz = LfFunc(z1) + 2*LfFunc(z2) + LfFunc(z3) + LfFunc(z4) + 2*LfFunc(z5) + LfFunc(z6)
+#    print ' lnFunc (z) = %.4f'  % (Lfz)
+        
+    s = -(2*Lfy+Lfw-Lfx-2*Lfz)
+  
+      
+    return (y2, z1, z3, s)
+
+    
+####################################################################################################
+####################################################################################################
+#
+# Function to compute the entropy, enthalpy, and free energy for a smooth calculation through 
+#    a stepped range of h values
+#
+####################################################################################################
+####################################################################################################
+
+
+def computeThermodynamicVars(arraySizeList, h, configVarsList):
+
+    arrayLength = arraySizeList.arrayLength
+    arrayLayers = arraySizeList.arrayLayers
+    debugPrintOff = arraySizeList.runConfig.debugPrintOff
+
+    totalUnits = float(arrayLength*arrayLayers)
+    totalUnitsTimesTwo = totalUnits*2.0
+                       
+    x1 = float(configVarsList[0])/totalUnits
+    x2 = float(configVarsList[1])/totalUnits 
+    
+    y1 = float(configVarsList[2])/totalUnitsTimesTwo
+    y2 = float(configVarsList[3])/(totalUnitsTimesTwo*2.0)
+    y3 = float(configVarsList[4])/totalUnitsTimesTwo 
+    
+    sumY = y1 + 2.0*y2 + y3 # y1, y3 at equiprobable = 0.25
+                        # y2 at equiprobable = 0.5
+                        # That y2 = A-B + B-A.
+                        # sumY should always = 1.0 
+
+    w1 = float(configVarsList[5])/totalUnitsTimesTwo
+    w2 = float(configVarsList[6])/(totalUnitsTimesTwo*2.0)
+    w3 = float(configVarsList[7])/totalUnitsTimesTwo        
+
+    sumW = w1 + 2.0*w2 + w3
+
+
+    z1 = float(configVarsList[8])/totalUnitsTimesTwo
+    z2 = float(configVarsList[9])/(totalUnitsTimesTwo*2.0)
+    z3 = float(configVarsList[10])/totalUnitsTimesTwo 
+    z4 = float(configVarsList[11])/totalUnitsTimesTwo
+    z5 = float(configVarsList[12])/(totalUnitsTimesTwo*2.0)
+    z6 = float(configVarsList[13])/totalUnitsTimesTwo 
+              
+
+    sumZ = z1 + 2.0*z2 + z3 + z4 + 2.0*z5 + z6
+
+    # This is V&V code, to confirm that the sums of the different configuration variables is correct
+    if not debugPrintOff:
+        print ' '         
+        print ' '
+        print ' x1 = %.4f'  % (x1), '      x2 = %.4f'  % (x2)
+        print ' y1 = %.4f'  % (y1), ' y2Total = %.4f'  % (2.*y2), ' y3 = %.4f'  % (y3) #, ' sumY = %.4f'  % (sumY)                                                 
+        print ' w1 = %.4f'  % (w1), ' w2Total = %.4f'  % (2.0*w2), ' w3 = %.4f'  % (w3) #, ' sumW = %.4f'  % (sumW) 
+
+        print ' '
+        print ' z1 = %.4f'  % (z1), ' z2Total = %.4f'  % (2.0*z2), ' z3 = %.4f'  % (z3)
+        print ' z6 = %.4f'  % (z6), ' z5Total = %.4f'  % (2.0*z5), ' z4 = %.4f'  % (z4)  #, 'sumZ = %.4f'  % (sumW)     
+        
+                                                                                                                                                    
+    Lfx = LfFunc(x1)+LfFunc(x2)
+#    print ' lnFunc (x) = %.4f'  % (Lfx)
+
+    Lfy = LfFunc(y1) + 2.0*LfFunc(y2) + LfFunc(y3)
+#    print ' lnFunc (y) = %.4f'  % (Lfy)  
+      
+    Lfw = LfFunc(w1) + 2.0*LfFunc(w2) + LfFunc(w3)
+#    print ' lnFunc (w) = %.4f'  % (Lfw)
+
+    Lfz = LfFunc(z1) + 2.0*LfFunc(z2) + LfFunc(z3) + LfFunc(z4) + 2.0*LfFunc(z5) + LfFunc(z6)
+#    print ' lnFunc (z) = %.4f'  % (Lfz)
+        
+    negS = -(2.*Lfy+Lfw-Lfx-2.*Lfz)
+
+   
+#  If we were to attempt to derive h from the (equilibrium) configuration variables: 
+#    h = ((z1*y2Actual)/(z3*y1))**(0.5)
+#  However, we are conducting these experiments given a starting h-value
+
+#  Notice, in the above equations, that z2 and z5 are both doubles; this allows sumZ = 1.0
+#    However, we need to be clear that (e.g.) z2 = A-A-B + B-A-A as counted above, etc. 
+#  For free energy  (entropy) calculations, we need to use the y2Actual, z2Actual, and z5Actual;
+#    these have the degeneracy removed, and it shows up as the multiplying factor of 2 in front 
+#   of the LfFunc. 
+
+#  The extra multiplying factor of 2 in the entropy equation above (in front of the y and z terms)
+#    comes from how the grid is assembled. See the 2014 Technical Report on the 2-D CVM for details.  
     
-    findFEMinimumValsBoolOff = True
-    findFEMinimumValsDetailsBoolOff = True 
+ 
     
-    totalTrials = 200
-    step = 1 
+    epsilon1 = 4*log(h)         
+    epsilon0 = 0.0    
+
+    enthalpy0 = epsilon0*x1
+    enthalpy1 = epsilon1*(2.0*y2-y1-y3)
+    # Note that the actual equation has: Enthalpy = 2N*epsilon1*(-y1+2y2-y3)
+    # Equivalently: Enthalpy = 2N*epsilon1*(z2+z4+z3+z5)  
+    # I've simplified the Enthalpy to reflect only the y2 interactions, which in this 
+    #   case would be the SINGLE y2 (A-B or B-A), so that
+    #   2y2 = the y2 that is approximately 0.5, where y1 + y2 + y3 = 1.0    
     
-    x1ValsArray   = np.zeros(totalTrials, dtype=np.float)
-    y1ValsArray   = np.zeros(totalTrials, dtype=np.float)
-    y2ValsArray   = np.zeros(totalTrials, dtype=np.float)
-    y3ValsArray   = np.zeros(totalTrials, dtype=np.float)
-    w1ValsArray   = np.zeros(totalTrials, dtype=np.float)
-    w2ValsArray   = np.zeros(totalTrials, dtype=np.float)
-    w3ValsArray   = np.zeros(totalTrials, dtype=np.float)
-    z1ValsArray   = np.zeros(totalTrials, dtype=np.float)
-    z3ValsArray   = np.zeros(totalTrials, dtype=np.float)       
-    negSValsArray = np.zeros(totalTrials, dtype=np.float)
-    enthalpy0Array= np.zeros(totalTrials, dtype=np.float)
-    enthalpy1Array= np.zeros(totalTrials, dtype=np.float)
-    freeEnergyArray=np.zeros(totalTrials, dtype=np.float)  
+    freeEnergy = enthalpy0 + enthalpy1 + negS          
+
+        
+    sysValsList = (negS, enthalpy0, enthalpy1, freeEnergy)
+
+    if not debugPrintOff:
+        print ' ' 
+        print ' '
+        print ' The computed thermodynamic quantities:'            
+        print '    h = %.4f' % (h), '    epsilon1 = %.4f' % (epsilon1) 
+        print '    negative entropy s = %.4f' % (negS)
+        print '    enthalpy = %.4f' % (enthalpy1)      
+        print '    free energy = %.4f' % (freeEnergy)
+        print ' ' 
+        print ' '   
+                                  
+    return (sysValsList)   
+
+
+
+####################################################################################################
+####################################################################################################
+#
+# Function to convert a (trials, 14) array of raw configuration-variable counts (as returned by
+#   computeConfigVariablesBatch) into fractions, using the same normalization as
+#   computeThermodynamicVars:
+#   -  the x vars are divided by the total number of units
+#   -  the y, w, and z vars are divided by 2*total number of units, and
+#   -  the y2, w2, z2, and z5 vars are divided again by 2
+#
+####################################################################################################
+####################################################################################################
+
+def computeConfigVarsFractionsBatch (arraySizeList, configVarsArray):
+
+    arrayLength = arraySizeList.arrayLength
+    arrayLayers = arraySizeList.arrayLayers
+
+    totalUnits = float(arrayLength*arrayLayers)
+    totalUnitsTimesTwo = totalUnits*2.0
+
+    configVarsDenomArray = np.array([totalUnits, totalUnits,
+                                     totalUnitsTimesTwo, totalUnitsTimesTwo*2.0, totalUnitsTimesTwo,
+                                     totalUnitsTimesTwo, totalUnitsTimesTwo*2.0, totalUnitsTimesTwo,
+                                     totalUnitsTimesTwo, totalUnitsTimesTwo*2.0, totalUnitsTimesTwo,
+                                     totalUnitsTimesTwo, totalUnitsTimesTwo*2.0, totalUnitsTimesTwo])
+
+    configVarsFracArray = configVarsArray/configVarsDenomArray
+
+    return (configVarsFracArray)
+
+
+
+####################################################################################################
+####################################################################################################
+#
+# Function to compute the entropy, enthalpy, and free energy for a whole stack of grids at once.
+#   Input:   configVarsArray, the (trials, 14) array of raw counts from computeConfigVariablesBatch
+#   Returns: sysValsArray, a float array with shape (trials, 4); each row is
+#            (negS, enthalpy0, enthalpy1, freeEnergy), as in computeThermodynamicVars
+#
+####################################################################################################
+####################################################################################################
+
+def computeThermodynamicVarsBatch (arraySizeList, h, configVarsArray):
+
+    configVarsFracArray = computeConfigVarsFractionsBatch (arraySizeList, configVarsArray)
+
+# Lf(v) = v*log(v) - v, applied to every fraction at once; as in LfFunc, Lf(0) = 0
+    safeFracArray = np.where(configVarsFracArray > 0.0, configVarsFracArray, 1.0)
+    LfArray = np.where(configVarsFracArray > 0.0, configVarsFracArray*np.log(safeFracArray), 0.0) - configVarsFracArray
+
+    Lfx = LfArray[:, 0] + LfArray[:, 1]
+    Lfy = LfArray[:, 2] + 2.0*LfArray[:, 3] + LfArray[:, 4]
+    Lfw = LfArray[:, 5] + 2.0*LfArray[:, 6] + LfArray[:, 7]
+    Lfz = (LfArray[:, 8] + 2.0*LfArray[:, 9] + LfArray[:, 10] + LfArray[:, 11] + 
+           2.0*LfArray[:, 12] + LfArray[:, 13])
+
+    negS = -(2.*Lfy+Lfw-Lfx-2.*Lfz)
+
+    epsilon1 = 4*log(h)         
+    epsilon0 = 0.0    
+
+    x1 = configVarsFracArray[:, 0]
+    y1 = configVarsFracArray[:, 2]
+    y2 = configVarsFracArray[:, 3]
+    y3 = configVarsFracArray[:, 4]
+
+    enthalpy0 = epsilon0*x1
+    enthalpy1 = epsilon1*(2.0*y2-y1-y3)
+
+    freeEnergy = enthalpy0 + enthalpy1 + negS          
+
+    sysValsArray = np.column_stack((negS, enthalpy0, enthalpy1, freeEnergy))
+
+    return (sysValsArray)
+         
+    
+####################################################################################################
+####################################################################################################
+#
+# Caching the equilibrium grids
+#
+# When runConfig.equilibriumCacheDirectory is set, every FE-minimized grid made by 
+#   obtainEquilibriumUnitArray is saved to that directory, one .npz file per grid, and a later
+#   request for the same grid (in this run or any later one) is read back instead of being
+#   minimized again. Each file holds:
+#     'cacheKey'         - the text of the key (see obtainEquilibriumCacheKey), checked on reading
+#     'unitArray'        - the FE-minimized unitArray
+#     'configVarsCounts' - its configuration variables, as RAW COUNTS (see computeConfigVariablesBatch)
+#     'rng...'           - the state of the grid's random number generator after the minimization
+# The key includes the state of the grid's random number generator before the minimization (for
+#   a sweep cell, this fixes the seed; see obtainSweepCellGrid), and a cache hit leaves the
+#   generator in the saved state after it, so the perturbation that follows draws the same random
+#   numbers as it would have without the cache: the results are the same, with or without it.
+# The cache is kept below runConfig.equilibriumCacheMaxBytes by removing the least recently used
+#   files; a file's modification time is its last use. Files are written to a temporary name and
+#   then renamed, so the worker processes of a parallel sweep can share the cache.
+#
+####################################################################################################
+####################################################################################################
+
+# Identifies the layout of the cache files and how they are made; part of the cache key
+#   (2: initializeExactCompositionMatrix draws its grid through the Batch version)
+equilibriumCacheVersion = 2
+
+####################################################################################################
+#
+# Function to collect everything that determines an equilibrium grid: the grid size, x1, h, eps0
+#   (always 0 in these experiments; see computeThermodynamicVarsBatch), the settings of the
+#   initialization and of the minimizer, and a fingerprint of the random number generator's state
+#
+####################################################################################################
+
+def obtainEquilibriumCacheKey (arraySizeList, h, x1TargetVal, maxXDif, jrange, maxRange):
+
+    runConfig = arraySizeList.runConfig
+    eps0 = 0.0
+    minimizerItems = (maxXDif, jrange, maxRange, runConfig.useExactCompositionInit, runConfig.useLocalFEUpdate, 
+                      runConfig.useKawasakiSampler, runConfig.kawasakiTemperature, runConfig.kawasakiTotalSweeps, 
+                      runConfig.kawasakiBurnInSweeps, runConfig.kawasakiThinning)
+
+    rngState = obtainRandomState(arraySizeList).get_state()
+    rngFingerprint = hashlib.sha1(rngState[1].tostring() + repr(rngState[2:])).hexdigest()
+
+    cacheKey = (arraySizeList.arrayLength, arraySizeList.arrayLayers, x1TargetVal, h, eps0, minimizerItems, 
+                rngFingerprint, equilibriumCacheVersion)
+
+    return (cacheKey)
+
+
+####################################################################################################
+#
+# Function to return the name of the cache file for cacheKey
+#
+####################################################################################################
+
+def obtainEquilibriumCacheFileName (arraySizeList, cacheKey):
+
+    cacheFileName = hashlib.sha1(repr(cacheKey)).hexdigest() + '.npz'
+
+    return (os.path.join(arraySizeList.runConfig.equilibriumCacheDirectory, cacheFileName))
+
+
+####################################################################################################
+#
+# Function to read the cached grid for cacheKey.
+#   Returns (unitArray, configVarsCounts), and sets the grid's random number generator to its saved
+#   state, or returns None (and changes nothing) if the grid is not in the cache.
+#
+####################################################################################################
+
+def loadEquilibriumCacheEntry (arraySizeList, cacheKey):
+
+    cacheFileName = obtainEquilibriumCacheFileName (arraySizeList, cacheKey)
+    if not os.path.exists(cacheFileName):
+        return (None)
+
+# A file that is removed (by another process) or half-read is treated as not being in the cache
+    try:
+        with open(cacheFileName, 'rb') as cacheFile:
+            cacheEntry = np.load(cacheFile)
+            if str(cacheEntry['cacheKey']) != repr(cacheKey):
+                return (None)
+            unitArray = cacheEntry['unitArray']
+            configVarsCounts = cacheEntry['configVarsCounts']
+            rngState = ('MT19937', cacheEntry['rngKeys'], int(cacheEntry['rngPos']), 
+                        int(cacheEntry['rngHasGauss']), float(cacheEntry['rngCachedGaussian']))
+        os.utime(cacheFileName, None)
+    except (IOError, OSError, KeyError, ValueError):
+        return (None)
+
+    obtainRandomState(arraySizeList).set_state(rngState)
+
+    return (unitArray, configVarsCounts)
+
+
+####################################################################################################
+#
+# Function to save a grid to the cache under cacheKey, together with the current state of its
+#   random number generator, and then to bring the cache back below its size limit
+#
+####################################################################################################
+
+def saveEquilibriumCacheEntry (arraySizeList, cacheKey, unitArray, configVarsCounts):
+
+    cacheDirectory = arraySizeList.runConfig.equilibriumCacheDirectory
+    if not os.path.isdir(cacheDirectory):
+        try:
+            os.makedirs(cacheDirectory)
+        except OSError:
+            if not os.path.isdir(cacheDirectory):
+                raise
+
+    rngState = obtainRandomState(arraySizeList).get_state()
+
+    cacheFileName = obtainEquilibriumCacheFileName (arraySizeList, cacheKey)
+    temporaryFileName = cacheFileName + '.%d.tmp' % (os.getpid())
+    with open(temporaryFileName, 'wb') as cacheFile:
+        np.savez(cacheFile, cacheKey=repr(cacheKey), unitArray=unitArray, configVarsCounts=configVarsCounts, 
+                 rngKeys=rngState[1], rngPos=rngState[2], rngHasGauss=rngState[3], rngCachedGaussian=rngState[4])
+    os.rename(temporaryFileName, cacheFileName)
+
+    evictEquilibriumCacheEntries (cacheDirectory, arraySizeList.runConfig.equilibriumCacheMaxBytes)
+
+
+####################################################################################################
+#
+# Function to remove the least recently used cache files until the cache holds at most maxBytes
+#
+####################################################################################################
+
+def evictEquilibriumCacheEntries (cacheDirectory, maxBytes):
+
+    cacheFilesList = list()
+    for cacheFileName in glob.glob(os.path.join(cacheDirectory, '*.npz')):
+        try:
+            fileStat = os.stat(cacheFileName)
+        except OSError:
+            continue
+        cacheFilesList.append((fileStat.st_mtime, fileStat.st_size, cacheFileName))
+
+    totalBytes = sum([fileSize for (fileTime, fileSize, cacheFileName) in cacheFilesList])
+    for (fileTime, fileSize, cacheFileName) in sorted(cacheFilesList):
+        if totalBytes <= maxBytes:
+            break
+        try:
+            os.remove(cacheFileName)
+        except OSError:
+            pass
+        totalBytes = totalBytes - fileSize
+
+
+####################################################################################################
+####################################################################################################
+#
+# Function to create one unitArray with the target x1 and bring it to a free energy minimum for h:
+#   the starting array is made as selected by runConfig.useExactCompositionInit (see **main**), and
+#   then adjusted with adjustMatrixFEMinimum. Returns the FE-minimized unitArray.
+# When the equilibrium cache is on, the grid is read from the cache if it is there, and saved to
+#   it (with its configuration counts) if it is not.
+#
+####################################################################################################
+####################################################################################################
+
+def obtainEquilibriumUnitArray (arraySizeList, h, x1TargetVal, maxXDif, jrange, maxRange):
+
+    beforeAndAfterAdjustedMatrixPrintOff = arraySizeList.runConfig.beforeAndAfterAdjustedMatrixPrintOff
+
+    useEquilibriumCache = arraySizeList.runConfig.equilibriumCacheDirectory is not None
+    if useEquilibriumCache:
+        cacheKey = obtainEquilibriumCacheKey (arraySizeList, h, x1TargetVal, maxXDif, jrange, maxRange)
+        cacheEntry = loadEquilibriumCacheEntry (arraySizeList, cacheKey)
+        if cacheEntry is not None:
+            return (cacheEntry[0])
+
+    if arraySizeList.runConfig.useExactCompositionInit:
+        # x1 is exactly the target (to the nearest unit); no adjustment is needed
+        unitArray    = initializeExactCompositionMatrix (arraySizeList, h, x1TargetVal)
+    else:
+        unitArray    = initializeMatrix (arraySizeList, h, x1TargetVal, maxXDif)        
+
+        # adjust the unit array so that the actual x1 approximately = target x1
+        unitArray = adjustMatrix (arraySizeList, unitArray, h, jrange, maxXDif, x1TargetVal, 
+        beforeAndAfterAdjustedMatrixPrintOff)
+
+    # adjust the unit array so that the configuration variables take values yielding a
+    #  free energy minimum for the given h-value        
+    unitArray = adjustMatrixFEMinimum (arraySizeList, unitArray, h, maxRange)
+
+    if useEquilibriumCache:
+        configVarsCounts = computeConfigVariablesBatch (arraySizeList, unitArray[np.newaxis])[0]
+        saveEquilibriumCacheEntry (arraySizeList, cacheKey, unitArray, configVarsCounts)
+
+    return (unitArray)
+
+
+####################################################################################################
+#
+# Function to bring a copy of startingUnitArray (an FE-minimized grid for a nearby h, with the same
+#   x1) to a free energy minimum for h, with continuationTrials swap trials of adjustMatrixFEMinimum
+#   (instead of its usual 200). Since the starting grid is already close to the minimum, far fewer
+#   trials are needed than for a random starting grid. Returns the FE-minimized unitArray; 
+#   startingUnitArray is unchanged.
+#
+####################################################################################################
+
+def continueEquilibriumUnitArray (arraySizeList, h, startingUnitArray, maxRange, continuationTrials):
+
+    unitArray = createIdenticalUnitArray (arraySizeList, startingUnitArray)
+
+    unitArray = adjustMatrixFEMinimum (arraySizeList, unitArray, h, maxRange, continuationTrials)
+
+    return (unitArray)
+
+
+####################################################################################################
+####################################################################################################
+#
+# Function to compute a set of configuration and thermodynamic variables given specific target
+#  values for x1, along with parameter h. 
+#
+# For prior experiments investigating how the thermodynamic variables behaved in correlation with
+#  the configuration variables, I use a loop to repeat the same calculations for a "numTrials" 
+#  total set of runs; the averages were then reported for a given set of x, h values. 
+#
+# For the perturbation experiments, since the goal is to work with a unitArray that is perturbed,
+#  and then allowed to cascade again into a free energy minimum, the original FOR loops are being 
+#  kept, but numTrials is assigned (in **main**) to have a value of 1. 
+#
+# When startingUnitArray is given (a continuation sweep; see runContinuationChain), each trial's
+#  FE-minimized grid is made from it with continueEquilibriumUnitArray, instead of from a new
+#  random grid.
+#
+####################################################################################################
+####################################################################################################
+
+
+def computeConfigAndThermVars(arraySizeList, h, x1TargetVal, maxXDif, numTrials, jrange, maxRange,
+                            perturbFrctn, startingUnitArray=None, continuationTrials=None):
+
+    arrayLength = arraySizeList.arrayLength
+    arrayLayers = arraySizeList.arrayLayers
+    debugPrintOff = arraySizeList.runConfig.debugPrintOff
+
+    totalUnits = float(arrayLength*arrayLayers)
+    totalUnitsTimesTwo = totalUnits*2.0
+    
+ 
+# The FE-minimized grid from each trial is stored in this stack
+    unitArrayForFEMinimumStack = np.zeros((numTrials, arrayLayers, arrayLength), dtype=np.float)
+
+# The buffer that holds the copy of each trial's starting perturbed array; it is reused by every trial
+    startingPerturbedArray = np.zeros((arrayLayers, arrayLength), dtype=np.int)
+
+    if not debugPrintOff:
+        print ' '     
+        print ' The thermodynamic quantities plot vs. x1' 
+        print '   The negEntropy is in blue, '
+        print '   The y2 value is in maroon.'
+        print '   The per-unit enthalpy is non-zero, but cannot be determined at this time, '
+        print '   The interaction enthalpy (eps1*y2) is set to zero (eps1 = 0, h = 1)'
+   
+
+    sumTotalChangesPerturbationsArray = 0.0
+    sumTotalChangesEquilibriumArray = 0.0
+    
+    print ' x1Target = ', x1TargetVal, ' h = ', h 
+    print ' Trial  Ttl chngs eqPtrb vs orig   Ttl chngs eqPtrb vs intlPtrb  '        
+    
+    # This loops to obtain average values for x1, y2, and the negative entropy for 
+    #  a specific target x1.    
+    for i in range (0, numTrials, 1):        
+
+        # create a unit array with the target x1, and bring it to a free energy minimum for the
+        #  given h-value
+        if startingUnitArray is None:
+            unitArray = obtainEquilibriumUnitArray (arraySizeList, h, x1TargetVal, maxXDif, jrange, maxRange)
+        else:
+            unitArray = continueEquilibriumUnitArray (arraySizeList, h, startingUnitArray, maxRange, 
+                            continuationTrials)
+        unitArrayForFEMinimum = unitArray
+        
+
+# Keep a copy of the FE-minimized grid; the configuration and thermodynamic variables for all
+#   of the trials are computed together, after the FOR loop 
+        unitArrayForFEMinimumStack[i] = unitArrayForFEMinimum
+            
+        perturbedUnitArray = perturb (arraySizeList, unitArray, perturbFrctn) 
+    
+        # Store a copy of the starting perturbed array
+        startingPerturbedArray = createIdenticalUnitArray (arraySizeList, perturbedUnitArray, startingPerturbedArray)    
+    
+        # Bring the perturbed array to equilibrium
+        # Note that this will make changes to the starting perturbed array
+        #  as well as returning an array called perturbedEqlbrmUnitArray;
+        #  these will now be identical - 
+        #  this is why we made a copy of the starting perturbed array. 
+        perturbedEqlbrmUnitArray = adjustMatrixFEMinimum (arraySizeList, perturbedUnitArray, h, maxRange) 
     
-    newUnitArray = createIdenticalUnitArray (arraySizeList, unitArray)            
+        totalChangesPerturbationsArray = countTotalChangesInUnitArray (arraySizeList, startingPerturbedArray, perturbedEqlbrmUnitArray)               
+
+        totalChangesEquilibriumArray = countTotalChangesInUnitArray (arraySizeList, unitArray, perturbedEqlbrmUnitArray)  
+        
+        sumTotalChangesPerturbationsArray = sumTotalChangesPerturbationsArray + totalChangesPerturbationsArray
+        sumTotalChangesEquilibriumArray = sumTotalChangesEquilibriumArray + totalChangesEquilibriumArray  
+        
+        print i, '        ', totalChangesPerturbationsArray, '         ', totalChangesEquilibriumArray                                                                                                                                                                                                                                                                                                                                                                                                                                                                                              
+                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                
+                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                
+# END: FOR loop (to compute x1, y2, and negS for a given target x1)
 
-    # Obtain fractional values for the configuration variables (previously retrieved total counts)        
-    totalUnits = float(arrayLength*arrayLayers)
-    totalUnitsTimesTwo = totalUnits*2.0   
+# Obtain the configuration variables for all of the FE-minimized grids in one pass.
+# The configuration variables array returned from computeConfigVariablesBatch holds the 
+#   RAW COUNTS; computeConfigVarsFractionsBatch converts them to the normative values, so that
+#   (e.g.), y1 + 2y2 + y3 = 1, etc. 
+    configVarsArray = computeConfigVariablesBatch (arraySizeList, unitArrayForFEMinimumStack)
+    configVarsFracArray = computeConfigVarsFractionsBatch (arraySizeList, configVarsArray)
 
-    # Obtain the starting values for the unitArray configuration variables and associated thermodynamic variables        
-    configVarsListOrig = computeConfigVariables (arraySizeList, unitArray)
-    x1Orig = float(configVarsListOrig[0])/totalUnits
-    y1Orig = float(configVarsListOrig[2])/totalUnitsTimesTwo 
-    y2Orig = float(configVarsListOrig[3])/(totalUnitsTimesTwo*2.0) 
-    y3Orig = float(configVarsListOrig[4])/totalUnitsTimesTwo        
-    z1Orig = float(configVarsListOrig[8])/totalUnitsTimesTwo      
-    z3Orig = float(configVarsListOrig[10])/totalUnitsTimesTwo
-    sysValsListOrig = computeThermodynamicVars(h, configVarsListOrig)
-    negEntropyOrig  = sysValsListOrig[0]
-    enthalpy1Orig   = sysValsListOrig[2]  
-    FEValueOrig     = sysValsListOrig[3]                  
-                                
-    successfulFlips = 0 # Count the total number of successful flips during the totalTrials
+# obtain the thermodynamic variables; sysVarsArray[i] = (negS, enthalpy0, enthalpy1, freeEnergy)
+    sysVarsArray = computeThermodynamicVarsBatch (arraySizeList, h, configVarsArray)
 
-    if not findFEMinimumValsBoolOff:
-        print ' ' 
-        print ' In adjustMatrixFEMinimum with h = ', h
-        print ' Starting to adjust config vars to minimize free energy'                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                        
-        print '   Trial parameters: x1(starting) =  %.3f' % (x1Orig), ' h =  %.2f' % (h)
+# store the thermodynamic variables to plot later
+    xArray          = np.arange(numTrials, dtype=np.float)
+    x1Array         = configVarsFracArray[:, 0]
+    y1Array         = configVarsFracArray[:, 2]
+    y2Array         = configVarsFracArray[:, 3]
+    y3Array         = configVarsFracArray[:, 4]
+    w1Array         = configVarsFracArray[:, 5]
+    w2Array         = configVarsFracArray[:, 6]
+    w3Array         = configVarsFracArray[:, 7]
+    z1Array         = configVarsFracArray[:, 8]
+    z2Array         = configVarsFracArray[:, 9]
+    z3Array         = configVarsFracArray[:, 10]
+    z4Array         = configVarsFracArray[:, 11]
+    z5Array         = configVarsFracArray[:, 12]
+    z6Array         = configVarsFracArray[:, 13]
+    negSArray       = sysVarsArray[:, 0]
+    EnthEps0Array   = sysVarsArray[:, 1]
+    EnthEps1Array   = sysVarsArray[:, 2]
+    freeEnergyArray = sysVarsArray[:, 3]
+
+# Compute the average values for various values
+    denom = float(numTrials)
+    avgx1 = x1Array.mean()
+    avgy1 = y1Array.mean()
+    avgy2 = y2Array.mean()
+    avgy3 = y3Array.mean()
+    avgw1 = w1Array.mean()
+    avgw2 = w2Array.mean()
+    avgw3 = w3Array.mean()
+    avgz1 = z1Array.mean()
+    avgz2 = z2Array.mean()
+    avgz3 = z3Array.mean()
+    avgz4 = z4Array.mean()
+    avgz5 = z5Array.mean()
+    avgz6 = z6Array.mean()
+    avgNegS = negSArray.mean()
+    avgEnthEps0 = EnthEps0Array.mean()
+    avgEnthEps1 = EnthEps1Array.mean()
+    avgFreeEnergy = freeEnergyArray.mean()
+    avgTotalChangesPerturb = sumTotalChangesPerturbationsArray/denom
+    avgTotalChangesEquilibrium = sumTotalChangesEquilibriumArray/denom
+    
+    if not debugPrintOff:
+        print ' '   
+
+    # Print the average results
         print ' '
+        print ' For a target x1 of: %.4f' % (x1TargetVal) 
+        print '   over a set of ', numTrials, ' trials, the average values are:'
+        print '          x1: %.4f' % (avgx1)     
+        print '          y1: %.4f' % (avgy1) 
+        print '          y2: %.4f' % (avgy2) 
+        print '          z1: %.4f' % (avgz1)
+        print '          z2: %.4f' % (avgz2) 
+        print '          z3: %.4f' % (avgz3)
+        print '          z4: %.4f' % (avgz4)
+        print '          z5: %.4f' % (avgz5)  
+        print '          z6: %.4f' % (avgz6)                                  
+        print '         negS: %.4f' % (avgNegS)   
+        print '    Enthalpy0: %.4f' % (avgEnthEps0) 
+        print '    Enthalpy1: %.4f' % (avgEnthEps1) 
+        print '    Free Engy: %.4f' % (avgFreeEnergy)     
+    # Plot the results from that FOR loop (multiple tests of a random grid for a given x1 value)          
+    #    print '     and the free energy is in red, also shifted by 0.6.'   
+        if arraySizeList.runConfig.plotMode != 'off':
+            pylab = obtainPylab (arraySizeList)
+            pylab.figure(1)
+            pylab.plot (xArray,negSArray)    
+            pylab.plot (xArray, y2Array, 'm')
+    # #   pylab.plot (xArray,fEps1Array,'m')
+    # #   pylab.plot (xArray,fEnergyArray,'r')
+            finishFigure (arraySizeList, pylab, 'config-and-therm-vars-trials')
+    # END: FOR loop (to test for a range of target x1 values) 
+ 
     
             
-    for i in range (0, totalTrials, step): 
-        x1CandidateRowColList = findCandidateX1node (arraySizeList, unitArray, maxRange, findFEMinimumValsDetailsBoolOff)
-        x1Row   = x1CandidateRowColList[0]
-        x1Col   = x1CandidateRowColList[1]
-        x1Flips = x1CandidateRowColList[2]
+    newList = (avgx1, avgy1, avgy2, avgy3, avgw1, avgw2, avgw3, avgz1, avgz2, avgz3, avgz4, avgz5, avgz6, 
+               avgNegS, avgEnthEps0, avgEnthEps1, avgFreeEnergy, unitArrayForFEMinimum,
+               avgTotalChangesPerturb, avgTotalChangesEquilibrium)
+    
 
-        x2CandidateRowColList = findCandidateX2node (arraySizeList, unitArray, maxRange, findFEMinimumValsDetailsBoolOff)
-        x2Row   = x2CandidateRowColList[0]
-        x2Col   = x2CandidateRowColList[1]
-        x2Flips = x2CandidateRowColList[2]  
-             
-        if not findFEMinimumValsDetailsBoolOff:
-            print ' ' 
-            print '  For i = ', i, ' the candidate x1 value is at Row: ', x1Row, ' Column: ', x1Col, ' after ', x1Flips, 'flips.'
-            print '  For i = ', i, ' the candidate x2 value is at Row: ', x2Row, ' Column: ', x2Col, ' after ', x2Flips, 'flips.'
+                                                                    
+    return (newList) 
+    # END - return a set of values for a single trial with x1TargetVal   
 
-        # Swap the unit values in newUnitArray: keeping x1 the same, but changing the other config variable values
-        newUnitArray[x1Row,x1Col] = 0
-        newUnitArray[x2Row,x2Col] = 1
-                                                                                                      
-        # Obtain the configuration variable values from EACH of the old and new unitArrays
-        configVarsListOld = computeConfigVariables (arraySizeList, unitArray)
-        configVarsListNew = computeConfigVariables (arraySizeList, newUnitArray)
-    
-        # Obtain the thermodynamic variables corresponding to each of the old and new unitArrrays
-        sysValsListOld = computeThermodynamicVars(h, configVarsListOld)
-        negEntropyOld  = sysValsListOld[0]
-        enthalpy1Old   = sysValsListOld[2]  
-        FEValueOld     = sysValsListOld[3]    
-   
-        sysValsListNew= computeThermodynamicVars(h, configVarsListNew) 
-        negEntropyNew  = sysValsListNew[0]
-        enthalpy1New   = sysValsListNew[2] 
-        FEValueNew     = sysValsListNew[3]      
-                
-        x1Old = float(configVarsListOld[0])/totalUnits
-        x1New = float(configVarsListNew[0])/totalUnits
-        y2Old = float(configVarsListOld[3])/(totalUnitsTimesTwo*2.)
-        y2New = float(configVarsListNew[3])/(totalUnitsTimesTwo*2.)
-        z1Old = float(configVarsListOld[8])/totalUnitsTimesTwo
-        z1New = float(configVarsListNew[8])/totalUnitsTimesTwo         
-        z3Old = float(configVarsListOld[10])/totalUnitsTimesTwo
-        z3New = float(configVarsListNew[10])/totalUnitsTimesTwo
 
-        x1ValsArray[i]   = x1New
-        y2ValsArray[i]   = y2New 
-        z1ValsArray[i]   = z1New
-        z3ValsArray[i]   = z3New      
-        negSValsArray[i]   = negEntropyNew
-        enthalpy1Array[i]   = enthalpy1New
-        freeEnergyArray[i]   = FEValueNew 
-                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                
-        # Print the results of the single flip: Note thermodynamic variables
-        if not findFEMinimumValsDetailsBoolOff:                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                       
-            print ' '
-            print ' ' 
-            print ' The results of a single flip in two unitArray positions, at trial number', i, ' of ', totalTrials, ' total trials' 
-            print ' '        
-            print '          x1      y2       z1       z3       negS    enthalpy1   FE '
-            print ' Old:   %.4f' % (x1Old), '  %.4f' % (y2Old), '  %.4f' % (z1Old) , '  %.4f' % (z3Old) , '  %.4f' % (negEntropyOld),   '  %.4f' % (enthalpy1Old),  '  %.4f' % (FEValueOld)       
-            print ' New:   %.4f' % (x1New), '  %.4f' % (y2New), '  %.4f' % (z1New) , '  %.4f' % (z3New), '  %.4f' % (negEntropyNew),   '  %.4f' % (enthalpy1New),  '  %.4f' % (FEValueNew)    
-            print ' ' 
 
-        # If the flip was successful, keep the values (assign to unitArray)
-        #  Otherwise, revert newUnitArray back to its earlier state
-        successBool = 0
-        if FEValueNew < FEValueOld: successBool = 1
-        if successBool:
-#            print ' ' 
-#             print ' Original unitArray at Row = ', x1Row, ' Col = ', x1Col, ' is ', unitArray[x1Row,x1Col]
-#             print ' Original unitArray at Row = ', x2Row, ' Col = ', x2Col, ' is ', unitArray[x2Row,x2Col]
-            unitArray[x1Row,x1Col] = 0
-            unitArray[x2Row,x2Col] = 1
-#             print ' After flip:'
-#             print '      New unitArray at Row = ', x1Row, ' Col = ', x1Col, ' is ', unitArray[x1Row,x1Col]
-#             print '      New unitArray at Row = ', x2Row, ' Col = ', x2Col, ' is ', unitArray[x2Row,x2Col]
-            successfulFlips = successfulFlips + 1
-            x1End = x1New
-            y2End = y2New
-            z1End = z1New
-            z3End = z3New
-            negEntropyEnd = negEntropyNew
-            enthalpy1End = enthalpy1New
-            FEValueEnd = FEValueNew                           
-            if not findFEMinimumValsDetailsBoolOff:                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                       
-                print ' '
-                print ' Successful flip: free energy reduced, keeping the change'         
-        else: 
-            newUnitArray[x1Row,x1Col] = 1
-            newUnitArray[x2Row,x2Col] = 0 
-            x1End = x1Old
-            y2End = y2Old
-            z1End = z1Old
-            z3End = z3Old
-            negEntropyEnd = negEntropyOld
-            enthalpy1End = enthalpy1Old
-            FEValueEnd = FEValueOld 
-            if not findFEMinimumValsDetailsBoolOff:                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                       
-                print ' '
-                print ' Unsuccessful flip: free energy increased, NOT keeping the change'        
+####################################################################################################
+####################################################################################################
+#
+# Parallel sweep over x1 and h
+#
+# Every (x1, h, trial) cell of the sweep in **main** is independent of the others, so the cells can
+#   be run on a pool of worker processes. Each cell is one call to computeConfigAndThermVars with
+#   numTrials = 1; the trials for each (x1, h) are then averaged in the main process, giving the
+#   same newList layout that computeConfigAndThermVars returns for numTrials trials.
+#
+# Each cell draws all of its random numbers from its own np.random.RandomState, carried by the
+#   cell's CVMGrid (obtainSweepCellGrid). The generator is seeded with the whole array
+#   (sweepBaseSeed, x1 index, h index, trial number), so every cell has a separate stream: a cell
+#   draws the same random numbers no matter which worker runs it, or in which order, and no
+#   generator state is shared between cells or workers. A sweep is therefore reproducible for any
+#   number of workers, and the serial loop in **main** gives the same results as the pool.
+# The grid geometry and the run settings travel to the workers inside arraySizeList (a CVMGrid).
+#
+####################################################################################################
+####################################################################################################
+
+# Identifies how the cells' random numbers are drawn; part of the checkpoint key, so that a
+#   checkpoint written with an earlier scheme is not mixed into a sweep
+sweepRandomStreamsVersion = 3
+
+####################################################################################################
+#
+# Function to return the CVMGrid for a single sweep cell: the same geometry and run settings as
+#   arraySizeList, with the cell's own random number generator
+#
+####################################################################################################
+
+def obtainSweepCellGrid (arraySizeList, sweepBaseSeed, x1Index, hIndex, trialNum):
+
+    cellRandomState = np.random.RandomState(np.array([sweepBaseSeed, x1Index, hIndex, trialNum], dtype=np.uint32))
+
+    return (CVMGrid (arraySizeList.arrayLength, arraySizeList.arrayLayers, arraySizeList.runConfig, cellRandomState))
+
+
+####################################################################################################
+#
+# Function to run a single (x1, h, trial) cell; this is what each worker process is given.
+#   cellSpecList = (arraySizeList, x1Index, hIndex, trialNum, x1TargetVal, h, maxXDif, jrange, 
+#                   maxRange, perturbFrctn, sweepBaseSeed)
+#
+####################################################################################################
+
+def runSweepCell (cellSpecList):
+
+    (arraySizeList, x1Index, hIndex, trialNum, x1TargetVal, h, maxXDif, jrange, 
+        maxRange, perturbFrctn, sweepBaseSeed) = cellSpecList
+
+    arraySizeList = obtainSweepCellGrid (arraySizeList, sweepBaseSeed, x1Index, hIndex, trialNum)
+
+# The cell's own profile is returned as the last element of cellList (it is empty when profiling
+#   is off), so that runParallelSweep can add it into the main process's profile
+    if arraySizeList.runConfig.useProfiling:
+        enableProfiling ()
+    cvmProfileDict.clear()
+
+    cellList = computeConfigAndThermVars(arraySizeList, h, x1TargetVal, maxXDif, 1, jrange, 
+                        maxRange, perturbFrctn)
+
+    return (cellList + (dict(cvmProfileDict),))
+
+
+####################################################################################################
+#
+# Function to average the single-trial results for one (x1, h) point into the newList layout of
+#   computeConfigAndThermVars; the unitArray kept is the one from the last trial
+#
+####################################################################################################
+
+def combineSweepCellResults (cellResultsList):
+
+    denom = float(len(cellResultsList))
+
+    avgValsList = [sum([cellList[k] for cellList in cellResultsList])/denom for k in range (0, 17)]
+    avgTotalChangesPerturb = sum([cellList[18] for cellList in cellResultsList])/denom
+    avgTotalChangesEquilibrium = sum([cellList[19] for cellList in cellResultsList])/denom
+
+    newList = tuple(avgValsList) + (cellResultsList[-1][17], avgTotalChangesPerturb, avgTotalChangesEquilibrium)
+
+    return (newList)
+
+
+####################################################################################################
+#
+# Function to run one continuation chain: a single (x1, trial) through the h values in the order
+#   given by hIndicesList. The first h value starts from a random grid (obtainEquilibriumUnitArray,
+#   with the usual 200 swap trials); every later one starts from the FE-minimized grid of the h
+#   value before it (continueEquilibriumUnitArray, with continuationTrials swap trials). Each step
+#   uses the random number stream of its own (x1, h, trial) cell (see obtainSweepCellGrid), so the
+#   first step is the same as that cell of runParallelSweep, and the ascending and descending
+#   chains perturb their grids with the same random numbers.
+#   chainSpecList = (arraySizeList, x1Index, trialNum, x1TargetVal, hValsList, hIndicesList, maxXDif,
+#                    jrange, maxRange, continuationTrials, perturbFrctn, sweepBaseSeed)
+#   Returns (chainResultsList, profileDict), where chainResultsList[k] is the cell's newList for
+#   the h value hValsList[hIndicesList[k]]
+#
+####################################################################################################
+
+def runContinuationChain (chainSpecList):
+
+    (arraySizeList, x1Index, trialNum, x1TargetVal, hValsList, hIndicesList, maxXDif, 
+        jrange, maxRange, continuationTrials, perturbFrctn, sweepBaseSeed) = chainSpecList
+
+    if arraySizeList.runConfig.useProfiling:
+        enableProfiling ()
+    cvmProfileDict.clear()
+
+    chainResultsList = list()
+    startingUnitArray = None
+    for hIndex in hIndicesList:
+        cellGrid = obtainSweepCellGrid (arraySizeList, sweepBaseSeed, x1Index, hIndex, trialNum)
+        cellList = computeConfigAndThermVars(cellGrid, hValsList[hIndex], x1TargetVal, maxXDif, 1, jrange, 
+                        maxRange, perturbFrctn, startingUnitArray, continuationTrials)
+        chainResultsList.append(cellList)
+        startingUnitArray = cellList[17]
+
+    return (chainResultsList, dict(cvmProfileDict))
+
+
+####################################################################################################
+####################################################################################################
+#
+# Function to run the whole x1 by h sweep as continuation chains, on a pool of worker processes:
+#   each (x1, trial) is one chain through all of the h values (see runContinuationChain), in
+#   increasing h order if sweepDirection is 'up', and in decreasing h order if it is 'down'.
+#   Running both directions and comparing them shows any hysteresis. Note that the two directions
+#   do not spend the same minimizer trials at each h: the first h value of a chain (the lowest h
+#   going up, the highest going down) gets the usual 200 trials from a random grid, and every
+#   other h value gets continuationTrials trials from a warm start.
+#   The inputs and outputs are those of runParallelSweep, plus continuationTrials (sweepResultsList
+#   is in increasing h order in both directions). The checkpoint is kept by chain, not by cell, as
+#   each chain depends on all of its earlier steps: a record maps chain numbers (the position in
+#   the (x1, trial) order) to their chainResultsList, and the sweepKey also holds the direction
+#   and continuationTrials, so the two directions need checkpoint files of their own.
+#
+####################################################################################################
+####################################################################################################
+
+def runContinuationSweep (arraySizeList, x1TargetValsList, hValsList, numTrials, maxXDif, jrange, maxRange, 
+                          continuationTrials, perturbFrctn, sweepBaseSeed, sweepWorkers, sweepDirection='up', 
+                          checkpointFileName=None, checkpointInterval=10, resumeFromCheckpoint=False, 
+                          resultsWriter=None):
+
+    if sweepDirection not in ('up', 'down'):
+        raise ValueError('sweepDirection must be \'up\' or \'down\', not %r' % (sweepDirection,))
+
+    hIndicesList = range (0, len(hValsList))
+    if sweepDirection == 'down':
+        hIndicesList.reverse()
+
+    chainSpecsList = list()
+    for x1Index in range (0, len(x1TargetValsList)):
+        for trialNum in range (0, numTrials):
+            chainSpecsList.append((arraySizeList, x1Index, trialNum, x1TargetValsList[x1Index], hValsList, 
+                                   hIndicesList, maxXDif, jrange, maxRange, continuationTrials, perturbFrctn, 
+                                   sweepBaseSeed))
+
+    sweepKey = obtainSweepCheckpointKey (arraySizeList, x1TargetValsList, hValsList, numTrials, maxXDif, 
+                                         jrange, maxRange, perturbFrctn, sweepBaseSeed) + \
+               ('continuation', sweepDirection, continuationTrials)
+    chainResultsDict = dict()
+    if checkpointFileName is not None:
+        chainResultsDict = openSweepCheckpoint (checkpointFileName, sweepKey, resumeFromCheckpoint)
+        if resumeFromCheckpoint:
+            print ' Resuming the', sweepDirection, 'continuation sweep from', checkpointFileName, ':', len(chainResultsDict), 'of', len(chainSpecsList), 'chains are done'
+
+    pendingChainNumsList = [chainNum for chainNum in range (0, len(chainSpecsList)) if chainNum not in chainResultsDict]
+
+# The chains completed since the last checkpoint record
+    newChainResultsDict = dict()
+    workerPool = multiprocessing.Pool(processes=sweepWorkers)
+    try:
+        pendingResultsIterator = workerPool.imap(runContinuationChain, [chainSpecsList[chainNum] for chainNum in pendingChainNumsList])
+        for pendingNum, (chainList, profileDict) in enumerate(pendingResultsIterator):
+            chainResultsDict[pendingChainNumsList[pendingNum]] = chainList
+            newChainResultsDict[pendingChainNumsList[pendingNum]] = chainList
+            mergeProfile (profileDict)
+            if checkpointFileName is not None and (pendingNum + 1) % checkpointInterval == 0:
+                appendSweepCheckpoint (checkpointFileName, newChainResultsDict)
+                newChainResultsDict = dict()
+    finally:
+        workerPool.close()
+        workerPool.join()
+
+    if checkpointFileName is not None and len(newChainResultsDict) > 0:
+        appendSweepCheckpoint (checkpointFileName, newChainResultsDict)
+
+# Put the cells in the (x1, h, trial) order of runParallelSweep
+    cellResultsList = list()
+    for x1Index in range (0, len(x1TargetValsList)):
+        for hIndex in range (0, len(hValsList)):
+            for trialNum in range (0, numTrials):
+                chainList = chainResultsDict[x1Index*numTrials + trialNum]
+                cellResultsList.append(chainList[hIndicesList.index(hIndex)])
+
+    if resultsWriter is not None:
+        writeSweepCellResults (resultsWriter, x1TargetValsList, hValsList, numTrials, cellResultsList, 
+                               1 if sweepDirection == 'up' else -1)
+
+    sweepResultsList = list()
+    cellNum = 0
+    for x1Index in range (0, len(x1TargetValsList)):
+        hResultsList = list()
+        for hIndex in range (0, len(hValsList)):
+            hResultsList.append(combineSweepCellResults (cellResultsList[cellNum:cellNum+numTrials]))
+            cellNum = cellNum + numTrials
+        sweepResultsList.append(hResultsList)
+
+    return (sweepResultsList)
+
+
+####################################################################################################
+####################################################################################################
+#
+# Checkpointing the sweep
+#
+# A long sweep saves its completed cells to a checkpoint file every checkpointInterval cells (and
+#   once more at the end), so that a run that is stopped part way can be resumed without redoing
+#   the finished cells. The checkpoint file is a series of pickled records:
+#     the first   - the sweep settings (the sweepKey; see obtainSweepCheckpointKey); a checkpoint is
+#                   only resumed by a sweep with the same settings
+#     each other  - a dict from cell number (the position in the (x1, h, trial) order) to the
+#                   cell's newList (which includes its FE-minimized unitArray), for the cells
+#                   completed since the record before it
+# Only the newly completed cells are appended each time, so the checkpoint I/O of a sweep grows
+#   in proportion to its number of cells. Because each cell has its own random number generator
+#   (obtainSweepCellGrid), nothing else needs to be saved: a resumed sweep gives the same results
+#   as one that was never interrupted.
+# A record that was only partly written (the run stopped while appending it) is dropped, and cut
+#   off the end of the file, when the checkpoint is read back.
+# The continuation sweep uses the same file layout, with a continuation chain in place of a cell
+#   (see runContinuationSweep).
+#
+####################################################################################################
+####################################################################################################
+
+####################################################################################################
+#
+# Function to collect the settings that determine a sweep's results. Of the run settings, only the
+#   engines that change the results are included; the debug prints, the plot mode, and the
+#   counting engine (every engine gives identical counts) can differ between the runs.
+#
+####################################################################################################
+
+def obtainSweepCheckpointKey (arraySizeList, x1TargetValsList, hValsList, numTrials, maxXDif, jrange, 
+                              maxRange, perturbFrctn, sweepBaseSeed):
+
+    runConfig = arraySizeList.runConfig
+    runConfigItems = (runConfig.useExactCompositionInit, runConfig.useLocalFEUpdate, runConfig.useKawasakiSampler, 
+                      runConfig.kawasakiTemperature, runConfig.kawasakiTotalSweeps, runConfig.kawasakiBurnInSweeps, 
+                      runConfig.kawasakiThinning, runConfig.conservePerturbX1)
+
+    sweepKey = (arraySizeList.arrayLength, arraySizeList.arrayLayers, tuple(x1TargetValsList), 
+                tuple(hValsList), numTrials, maxXDif, jrange, maxRange, perturbFrctn, sweepBaseSeed, 
+                sweepRandomStreamsVersion, runConfigItems)
+
+    return (sweepKey)
+
+
+####################################################################################################
+#
+# Function to start a new checkpoint file, holding only the sweep settings. The file is written to
+#   a temporary name and then renamed, so it is never left without its settings record.
+#
+####################################################################################################
+
+def startSweepCheckpoint (checkpointFileName, sweepKey):
+
+    temporaryFileName = checkpointFileName + '.tmp'
+    with open(temporaryFileName, 'wb') as checkpointFile:
+        cPickle.dump(sweepKey, checkpointFile, cPickle.HIGHEST_PROTOCOL)
+    os.rename(temporaryFileName, checkpointFileName)
+
+
+####################################################################################################
+#
+# Function to append the newly completed cells (a dict from cell number to newList) to the
+#   checkpoint file
+#
+####################################################################################################
+
+def appendSweepCheckpoint (checkpointFileName, newCellResultsDict):
+
+    with open(checkpointFileName, 'ab') as checkpointFile:
+        cPickle.dump(newCellResultsDict, checkpointFile, cPickle.HIGHEST_PROTOCOL)
+
+
+####################################################################################################
+#
+# Function to read the checkpoint file.
+#   Returns the dict of completed cells; this is empty if there is no checkpoint file yet.
+#   A checkpoint written by a sweep with different settings is not used (ValueError).
+#
+####################################################################################################
+
+def loadSweepCheckpoint (checkpointFileName, sweepKey):
+
+    if not os.path.exists(checkpointFileName):
+        return (dict())
+
+    cellResultsDict = dict()
+    with open(checkpointFileName, 'rb') as checkpointFile:
+        if cPickle.load(checkpointFile) != sweepKey:
+            raise ValueError('checkpoint %s was written by a sweep with different settings' % (checkpointFileName))
+        completeBytes = checkpointFile.tell()
+        while True:
+            try:
+                newCellResultsDict = cPickle.load(checkpointFile)
+            except (EOFError, ValueError, IndexError, cPickle.UnpicklingError):
+                break
+            cellResultsDict.update(newCellResultsDict)
+            completeBytes = checkpointFile.tell()
+
+# Cut off a partly written last record, so that the cells appended after it can be read back
+    if completeBytes < os.path.getsize(checkpointFileName):
+        with open(checkpointFileName, 'r+b') as checkpointFile:
+            checkpointFile.truncate(completeBytes)
+
+    return (cellResultsDict)
 
-#    print ' '
-#    print ' In adjustMatrixFEMinimum, completed all computations, for h = ', h
-#    print ' '
-#    print ' The total number of successful flips out of ', totalTrials, 'is: ', successfulFlips 
-#    print ' ' 
-#    print ' The total change in the configuration and thermodynamic variables:'
-#    print '          x1      y2       z1       z3       negS    enthalpy1   FE '
-#    print ' Orig:   %.4f' % (x1Orig), '  %.4f' % (y2Orig), '  %.4f' % (z1Orig) , '  %.4f' % (z3Orig) , '  %.4f' % (negEntropyOrig),   '  %.4f' % (enthalpy1Orig),  '  %.4f' % (FEValueOrig)       
-#    print ' End:    %.4f' % (x1End), '  %.4f' % (y2End), '  %.4f' % (z1End) , '  %.4f' % (z3End), '  %.4f' % (negEntropyEnd),   '  %.4f' % (enthalpy1End),  '  %.4f' % (FEValueEnd)    
-#    print ' '
-#    print ' '                                                                                                          
 
-    if not findFEMinimumValsBoolOff:
-        printUnitArrayModificationResults (x1ValsArray, y2ValsArray, 
-            z1ValsArray, z3ValsArray, negSValsArray, enthalpy1Array, freeEnergyArray, h, totalTrials, findFEMinimumValsBoolOff)             
-                                     
-       
-    return unitArray
-    # END adjustMatrixFEMinimum      
-                
-                                                
 ####################################################################################################
 #
-# Function to compute a term (Lf(v)) needed to compute the entropy
+# Function to open the checkpoint file of a sweep: with resumeFromCheckpoint, the completed cells
+#   are read back from it (see loadSweepCheckpoint); otherwise a new file is started, and an
+#   existing one is not overwritten (IOError).
+#   Returns the dict of completed cells
 #
 ####################################################################################################
 
-def LfFunc(x):
-    Lfval = x*log(x)-x
-    return (Lfval)
+def openSweepCheckpoint (checkpointFileName, sweepKey, resumeFromCheckpoint):
+
+    if resumeFromCheckpoint and os.path.exists(checkpointFileName):
+        return (loadSweepCheckpoint (checkpointFileName, sweepKey))
+
+    if os.path.exists(checkpointFileName):
+        raise IOError('checkpoint %s already exists; resume it, or remove it first' % (checkpointFileName))
+    startSweepCheckpoint (checkpointFileName, sweepKey)
+
+    return (dict())
+
 
 
 ####################################################################################################
 ####################################################################################################
 #
-# Function to compute the entropy
-# This was used exclusively for computing the predicted (analytic) values for the entropy,
-#  in the case where the configuration variables were analytically defined in terms of probability
-#  distribution for h = 1. 
+# Function to run the whole x1 by h sweep on a pool of worker processes.
+#   Inputs:  x1TargetValsList, hValsList: the x1 and h values of the sweep
+#            sweepWorkers: the number of worker processes (None uses every CPU)
+#            checkpointFileName: the checkpoint file (None turns checkpointing off)
+#            checkpointInterval: the number of completed cells between checkpoints
+#            resumeFromCheckpoint: True skips the cells already saved in the checkpoint file; when it
+#              is False, an existing checkpoint file is not overwritten (IOError)
+#            resultsWriter: a CVMResultsWriter that is given one row per cell (None writes no rows)
+#   Returns: sweepResultsList, where sweepResultsList[j][hVal] is the newList for the j'th x1 value
+#            and the hVal'th h value
+#
+# The cells are handed out with Pool.imap, which returns the results in the order the cells were
+#   submitted; so the results are collected in (x1, h, trial) order regardless of which worker
+#   finishes first.
 #
 ####################################################################################################
 ####################################################################################################
 
+def runParallelSweep (arraySizeList, x1TargetValsList, hValsList, numTrials, maxXDif, jrange, maxRange, 
+                      perturbFrctn, sweepBaseSeed, sweepWorkers, checkpointFileName=None, 
+                      checkpointInterval=10, resumeFromCheckpoint=False, resultsWriter=None):
 
-def computeAnalyticConfigAndThermVars (x1TargetVal):
+    cellSpecsList = list()
+    for x1Index in range (0, len(x1TargetValsList)):
+        for hIndex in range (0, len(hValsList)):
+            for trialNum in range (0, numTrials):
+                cellSpecsList.append((arraySizeList, x1Index, hIndex, trialNum, x1TargetValsList[x1Index], 
+                                      hValsList[hIndex], maxXDif, jrange, maxRange, perturbFrctn, sweepBaseSeed))
 
-#    print ' '
-#    print '  In AnalyticConfigAndThermVars '
-#    print ' '
+    sweepKey = obtainSweepCheckpointKey (arraySizeList, x1TargetValsList, hValsList, numTrials, maxXDif, 
+                                         jrange, maxRange, perturbFrctn, sweepBaseSeed)
+    cellResultsDict = dict()
+    if checkpointFileName is not None:
+        cellResultsDict = openSweepCheckpoint (checkpointFileName, sweepKey, resumeFromCheckpoint)
+        if resumeFromCheckpoint:
+            print ' Resuming the sweep from', checkpointFileName, ':', len(cellResultsDict), 'of', len(cellSpecsList), 'cells are done'
 
-    totalUnits = float(arrayLength*arrayLayers)
-#    printConfigVars (configVarsList)      
-                        
-    x1 = x1TargetVal
-    x2 = 1.0 - x1TargetVal
-    sumX = x1+x2  
+    pendingCellNumsList = [cellNum for cellNum in range (0, len(cellSpecsList)) if cellNum not in cellResultsDict]
 
-#    print ' ' 
-#    print '                x1 = %.4f'  % x1
-#    print '                x2 = %.4f'  % x2
-#    print '   Sum of the x(i) = %.4f'  % sumX
-#    print ' ' 
-    
-    y1 = x1*x1
-    y2 = x1*x2
-    y3 = x2*x2
-    w1 = x1*x1
-    w2 = x1*x2
-    w3 = x2*x2        
-    z1 = x1*x1*x1
-    z2 = x1*x1*x2
-    z3 = x1*x2*x1 
-    z4 = x2*x1*x2
-    z5 = x2*x2*x1
-    z6 = x2*x2*x2
+# The cells completed since the last checkpoint record
+    newCellResultsDict = dict()
+    workerPool = multiprocessing.Pool(processes=sweepWorkers)
+    try:
+        pendingResultsIterator = workerPool.imap(runSweepCell, [cellSpecsList[cellNum] for cellNum in pendingCellNumsList])
+        for pendingNum, cellList in enumerate(pendingResultsIterator):
+            cellResultsDict[pendingCellNumsList[pendingNum]] = cellList
+            newCellResultsDict[pendingCellNumsList[pendingNum]] = cellList
+            mergeProfile (cellList[20])
+            if checkpointFileName is not None and (pendingNum + 1) % checkpointInterval == 0:
+                appendSweepCheckpoint (checkpointFileName, newCellResultsDict)
+                newCellResultsDict = dict()
+    finally:
+        workerPool.close()
+        workerPool.join()
 
-    sumY = y1+y2+y3    
-#    print
-#    print "Totals for the y(i) variables:"
-#    print '          (A-A) y1 = %.4f'  % y1 
-#    print '    (A-B & B-A) y2 = %.4f'  % y2   
-#    print '          (B-B) y3 = %.4f'  % y3 
-#    print '   Sum of the y(i) = %.4f'  % sumY
-#    print 
-    
-    sumW = w1+w2+w3 
-#    print
-#    print "Totals for the w(i) variables:"
-#    print '        (A---A) w1 = %.4f'  % w1 
-#    print '(A---B & B---A) w2 = %.4f'  % w2   
-#    print '        (B---B) w3 = %.4f'  % w3 
-#    print '   Sum of the w(i) = %.4f'  % sumW
-#    print         
+    if checkpointFileName is not None and len(newCellResultsDict) > 0:
+        appendSweepCheckpoint (checkpointFileName, newCellResultsDict)
 
-    sumZ = z1+z2+z3 +z4+z5+z6
+    cellResultsList = [cellResultsDict[cellNum] for cellNum in range (0, len(cellSpecsList))]
 
-#    print
-#    print "Totals for the z(i) variables:"
-#    print '        (A-A-A) z1 = %.4f'  % z1 
-#    print '(A-A-B & B-A-A) z2 = %.4f'  % z2   
-#    print '        (A-B-A) z3 = %.4f'  % z3 
-#    print '        (B-A-B) z4 = %.4f'  % z4 
-#    print '(A-B-B & B-B-A) z5 = %.4f'  % z5 
-#    print '        (B-B-B) z6 = %.4f'  % z6         
-#    print '   Sum of the z(i) = %.4f'  % sumZ
-#    print                    
-                                                
-    Lfx = LfFunc(x1)+LfFunc(x2)
-#    print ' lnFunc (x) = %.4f'  % (Lfx)
+    if resultsWriter is not None:
+        writeSweepCellResults (resultsWriter, x1TargetValsList, hValsList, numTrials, cellResultsList)
+
+    sweepResultsList = list()
+    cellNum = 0
+    for x1Index in range (0, len(x1TargetValsList)):
+        hResultsList = list()
+        for hIndex in range (0, len(hValsList)):
+            hResultsList.append(combineSweepCellResults (cellResultsList[cellNum:cellNum+numTrials]))
+            cellNum = cellNum + numTrials
+        sweepResultsList.append(hResultsList)
+
+    return (sweepResultsList)
 
-    Lfy = LfFunc(y1) + 2*LfFunc(y2) + LfFunc(y3)
-#    print ' lnFunc (y) = %.4f'  % (Lfy)  
-      
-    Lfw = LfFunc(w1) + 2*LfFunc(w2) + LfFunc(w3)
-#    print ' lnFunc (w) = %.4f'  % (Lfw)
 
-    Lfz = LfFunc(z1) + 2*LfFunc(z2) + LfFunc(z3) + LfFunc(z4) + 2*LfFunc(z5) + LfFunc(z6)
-#    print ' lnFunc (z) = %.4f'  % (Lfz)
-        
-    s = -(2*Lfy+Lfw-Lfx-2*Lfz)
-  
-      
-    return (y2, z1, z3, s)
 
-    
 ####################################################################################################
 ####################################################################################################
 #
-# Function to compute the entropy, enthalpy, and free energy for a smooth calculation through 
-#    a stepped range of h values
+# Results store
+#
+# The results of a sweep are written as a table with one row per (x1, h, eps0, trial, sweep
+#   direction), holding the columns in resultsColumnNamesList: the sweep point, all 14
+#   configuration-variable fractions, the thermodynamic quantities, and the two perturbation change
+#   counts. The sweepDirection column tells the sweeps apart: 0 for the cell-by-cell sweep
+#   (runParallelSweep), +1 for a continuation sweep in increasing h order, and -1 for one in
+#   decreasing h order (runContinuationSweep); so both passes of a hysteresis sweep fit in one store.
+# The rows are written in chunks of chunkRows rows, in a columnar binary format:
+#   'parquet' - one Parquet file, fileBaseName.parquet, with one row group per chunk (needs pyarrow)
+#   'npz'     - one NumPy .npz file per chunk, fileBaseName-chunk-00000.npz, ...; each holds one
+#               array per column
+#   'auto'    - 'parquet' when pyarrow is installed, otherwise 'npz'
+# loadResultsStore reads either format back into a dict of column arrays.
+# A store that already exists under fileBaseName is only replaced if the writer is made with
+#   overwrite=True; otherwise CVMResultsWriter raises IOError, so earlier results are never lost
+#   by accident.
 #
 ####################################################################################################
 ####################################################################################################
 
+resultsColumnNamesList = ('x1Target', 'h', 'eps0', 'trial', 'sweepDirection', 
+                          'x1', 'x2', 'y1', 'y2', 'y3', 'w1', 'w2', 'w3', 
+                          'z1', 'z2', 'z3', 'z4', 'z5', 'z6', 
+                          'negS', 'enthalpy0', 'enthalpy1', 'freeEnergy', 
+                          'totalChangesPerturb', 'totalChangesEquilibrium')
+
+class CVMResultsWriter (object):
+
+    def __init__ (self, fileBaseName, chunkRows=10000, storeFormat='auto', overwrite=False):
+
+        if storeFormat not in ('auto', 'parquet', 'npz'):
+            raise ValueError('storeFormat must be auto, parquet, or npz, not %r' % (storeFormat,))
+        if storeFormat == 'parquet' and pyarrow is None:
+            raise ValueError('the parquet results store needs pyarrow')
+        if storeFormat == 'auto':
+            storeFormat = 'parquet' if pyarrow is not None else 'npz'
+
+        self.fileBaseName = fileBaseName
+        self.chunkRows = chunkRows
+        self.storeFormat = storeFormat
+        self.pendingRowsList = list()
+        self.chunksWritten = 0
+        self.parquetWriter = None
+
+# Start a fresh store; chunks left over from an earlier run would otherwise be read back with it
+        oldFileNamesList = obtainResultsStoreFileNames (fileBaseName)
+        if len(oldFileNamesList) > 0 and not overwrite:
+            raise IOError('the results store %s already exists; it is only replaced with overwrite=True' % (fileBaseName))
+        for oldFileName in oldFileNamesList:
+            os.remove(oldFileName)
+
+    def appendRow (self, rowValsList):
+
+        if len(rowValsList) != len(resultsColumnNamesList):
+            raise ValueError('a results row has %d values, but there are %d columns' % (len(rowValsList), len(resultsColumnNamesList)))
+
+        self.pendingRowsList.append(tuple(rowValsList))
+        if len(self.pendingRowsList) >= self.chunkRows:
+            self.flush ()
+
+    def flush (self):
+
+        if len(self.pendingRowsList) == 0:
+            return
+
+        rowsArray = np.array(self.pendingRowsList, dtype=np.float64)
+        columnsDict = dict()
+        for columnNum, columnName in enumerate(resultsColumnNamesList):
+            columnsDict[columnName] = rowsArray[:, columnNum]
+        columnsDict['trial'] = columnsDict['trial'].astype(np.int64)
+        columnsDict['sweepDirection'] = columnsDict['sweepDirection'].astype(np.int64)
+
+        if self.storeFormat == 'parquet':
+            chunkTable = pyarrow.Table.from_arrays([pyarrow.array(columnsDict[columnName]) for columnName in resultsColumnNamesList], 
+                                                   names=list(resultsColumnNamesList))
+            if self.parquetWriter is None:
+                self.parquetWriter = pyarrow.parquet.ParquetWriter(self.fileBaseName + '.parquet', chunkTable.schema)
+            self.parquetWriter.write_table(chunkTable)
+        else:
+            np.savez(self.fileBaseName + '-chunk-%05d.npz' % (self.chunksWritten), **columnsDict)
+
+        self.chunksWritten = self.chunksWritten + 1
+        self.pendingRowsList = list()
+
+    def close (self):
+
+        self.flush ()
+        if self.parquetWriter is not None:
+            self.parquetWriter.close()
+            self.parquetWriter = None
+
+
+####################################################################################################
+#
+# Function to list the files of a results store (in chunk order for the npz format)
+#
+####################################################################################################
+
+def obtainResultsStoreFileNames (fileBaseName):
 
-def computeThermodynamicVars(h, configVarsList):
+    storeFileNamesList = sorted(glob.glob(fileBaseName + '-chunk-[0-9][0-9][0-9][0-9][0-9].npz'))
+    if os.path.exists(fileBaseName + '.parquet'):
+        storeFileNamesList.append(fileBaseName + '.parquet')
 
-    totalUnits = float(arrayLength*arrayLayers)
-    totalUnitsTimesTwo = totalUnits*2.0
-                       
-    x1 = float(configVarsList[0])/totalUnits
-    x2 = float(configVarsList[1])/totalUnits 
-    
-    y1 = float(configVarsList[2])/totalUnitsTimesTwo
-    y2 = float(configVarsList[3])/(totalUnitsTimesTwo*2.0)
-    y3 = float(configVarsList[4])/totalUnitsTimesTwo 
-    
-    sumY = y1 + 2.0*y2 + y3 # y1, y3 at equiprobable = 0.25
-                        # y2 at equiprobable = 0.5
-                        # That y2 = A-B + B-A.
-                        # sumY should always = 1.0 
+    return (storeFileNamesList)
 
-    w1 = float(configVarsList[5])/totalUnitsTimesTwo
-    w2 = float(configVarsList[6])/(totalUnitsTimesTwo*2.0)
-    w3 = float(configVarsList[7])/totalUnitsTimesTwo        
 
-    sumW = w1 + 2.0*w2 + w3
+####################################################################################################
+#
+# Function to read a results store back; returns a dict holding one array per column
+#
+####################################################################################################
 
+def loadResultsStore (fileBaseName):
 
-    z1 = float(configVarsList[8])/totalUnitsTimesTwo
-    z2 = float(configVarsList[9])/(totalUnitsTimesTwo*2.0)
-    z3 = float(configVarsList[10])/totalUnitsTimesTwo 
-    z4 = float(configVarsList[11])/totalUnitsTimesTwo
-    z5 = float(configVarsList[12])/(totalUnitsTimesTwo*2.0)
-    z6 = float(configVarsList[13])/totalUnitsTimesTwo 
-              
+    if os.path.exists(fileBaseName + '.parquet'):
+        resultsTable = pyarrow.parquet.read_table(fileBaseName + '.parquet')
+        resultsDict = dict()
+        for columnName in resultsColumnNamesList:
+            resultsDict[columnName] = np.concatenate([columnChunk.to_numpy() for columnChunk in resultsTable.column(columnName).chunks])
+        return (resultsDict)
 
-    sumZ = z1 + 2.0*z2 + z3 + z4 + 2.0*z5 + z6
+    chunkFileNamesList = obtainResultsStoreFileNames (fileBaseName)
+    chunkColumnsList = [np.load(chunkFileName) for chunkFileName in chunkFileNamesList]
 
-    # This is V&V code, to confirm that the sums of the different configuration variables is correct
-    if not debugPrintOff:
-        print ' '         
-        print ' '
-        print ' x1 = %.4f'  % (x1), '      x2 = %.4f'  % (x2)
-        print ' y1 = %.4f'  % (y1), ' y2Total = %.4f'  % (2.*y2), ' y3 = %.4f'  % (y3) #, ' sumY = %.4f'  % (sumY)                                                 
-        print ' w1 = %.4f'  % (w1), ' w2Total = %.4f'  % (2.0*w2), ' w3 = %.4f'  % (w3) #, ' sumW = %.4f'  % (sumW) 
+    resultsDict = dict()
+    for columnName in resultsColumnNamesList:
+        resultsDict[columnName] = np.concatenate([chunkColumns[columnName] for chunkColumns in chunkColumnsList])
 
-        print ' '
-        print ' z1 = %.4f'  % (z1), ' z2Total = %.4f'  % (2.0*z2), ' z3 = %.4f'  % (z3)
-        print ' z6 = %.4f'  % (z6), ' z5Total = %.4f'  % (2.0*z5), ' z4 = %.4f'  % (z4)  #, 'sumZ = %.4f'  % (sumW)     
-        
-                                                                                                                                                    
-    Lfx = LfFunc(x1)+LfFunc(x2)
-#    print ' lnFunc (x) = %.4f'  % (Lfx)
+    return (resultsDict)
 
-    Lfy = LfFunc(y1) + 2.0*LfFunc(y2) + LfFunc(y3)
-#    print ' lnFunc (y) = %.4f'  % (Lfy)  
-      
-    Lfw = LfFunc(w1) + 2.0*LfFunc(w2) + LfFunc(w3)
-#    print ' lnFunc (w) = %.4f'  % (Lfw)
 
-    Lfz = LfFunc(z1) + 2.0*LfFunc(z2) + LfFunc(z3) + LfFunc(z4) + 2.0*LfFunc(z5) + LfFunc(z6)
-#    print ' lnFunc (z) = %.4f'  % (Lfz)
-        
-    negS = -(2.*Lfy+Lfw-Lfx-2.*Lfz)
+####################################################################################################
+#
+# Function to append the results of every sweep cell (one trial at one (x1, h) point) to a 
+#   CVMResultsWriter; cellResultsList is in (x1, h, trial) order, as built in runParallelSweep.
+#   The perturbation experiments use eps0 = 0 (see computeThermodynamicVarsBatch). sweepDirection
+#   is written to every row (see resultsColumnNamesList).
+#
+####################################################################################################
 
-   
-#  If we were to attempt to derive h from the (equilibrium) configuration variables: 
-#    h = ((z1*y2Actual)/(z3*y1))**(0.5)
-#  However, we are conducting these experiments given a starting h-value
+def writeSweepCellResults (resultsWriter, x1TargetValsList, hValsList, numTrials, cellResultsList, 
+                           sweepDirection=0):
 
-#  Notice, in the above equations, that z2 and z5 are both doubles; this allows sumZ = 1.0
-#    However, we need to be clear that (e.g.) z2 = A-A-B + B-A-A as counted above, etc. 
-#  For free energy  (entropy) calculations, we need to use the y2Actual, z2Actual, and z5Actual;
-#    these have the degeneracy removed, and it shows up as the multiplying factor of 2 in front 
-#   of the LfFunc. 
+    eps0 = 0.0
 
-#  The extra multiplying factor of 2 in the entropy equation above (in front of the y and z terms)
-#    comes from how the grid is assembled. See the 2014 Technical Report on the 2-D CVM for details.  
-    
- 
-    
-    epsilon1 = 4*log(h)         
-    epsilon0 = 0.0    
+    cellNum = 0
+    for x1Index in range (0, len(x1TargetValsList)):
+        for hIndex in range (0, len(hValsList)):
+            for trialNum in range (0, numTrials):
+                cellList = cellResultsList[cellNum]
+                x1 = cellList[0]
+                rowValsList = ((x1TargetValsList[x1Index], hValsList[hIndex], eps0, trialNum, sweepDirection, 
+                                x1, 1.0 - x1) + 
+                               tuple(cellList[1:17]) + (cellList[18], cellList[19]))
+                resultsWriter.appendRow (rowValsList)
+                cellNum = cellNum + 1
 
-    enthalpy0 = epsilon0*x1
-    enthalpy1 = epsilon1*(2.0*y2-y1-y3)
-    # Note that the actual equation has: Enthalpy = 2N*epsilon1*(-y1+2y2-y3)
-    # Equivalently: Enthalpy = 2N*epsilon1*(z2+z4+z3+z5)  
-    # I've simplified the Enthalpy to reflect only the y2 interactions, which in this 
-    #   case would be the SINGLE y2 (A-B or B-A), so that
-    #   2y2 = the y2 that is approximately 0.5, where y1 + y2 + y3 = 1.0    
-    
-    freeEnergy = enthalpy0 + enthalpy1 + negS          
 
-        
-    sysValsList = (negS, enthalpy0, enthalpy1, freeEnergy)
 
-    if not debugPrintOff:
-        print ' ' 
-        print ' '
-        print ' The computed thermodynamic quantities:'            
-        print '    h = %.4f' % (h), '    epsilon1 = %.4f' % (epsilon1) 
-        print '    negative entropy s = %.4f' % (negS)
-        print '    enthalpy = %.4f' % (enthalpy1)      
-        print '    free energy = %.4f' % (freeEnergy)
-        print ' ' 
-        print ' '   
-                                  
-    return (sysValsList)   
-         
-    
 ####################################################################################################
 ####################################################################################################
 #
-# Function to compute a set of configuration and thermodynamic variables given specific target
-#  values for x1, along with parameter h. 
-#
-# For prior experiments investigating how the thermodynamic variables behaved in correlation with
-#  the configuration variables, I use a loop to repeat the same calculations for a "numTrials" 
-#  total set of runs; the averages were then reported for a given set of x, h values. 
 #
-# For the perturbation experiments, since the goal is to work with a unitArray that is perturbed,
-#  and then allowed to cascade again into a free energy minimum, the original FOR loops are being 
-#  kept, but numTrials is assigned (in **main**) to have a value of 1. 
+# Function to create a perturbed unitArray, where the fraction perturbFrctn units are flipped.
+#   Exactly int(perturbFrctn*N) distinct units are flipped (see obtainPerturbationSitesBatch), so
+#   the perturbation strength is what perturbFrctn says; no unit is flipped twice.
+#   With runConfig.conservePerturbX1, the flips are made in A/B pairs, so x1 is unchanged.
+#
+#
+####################################################################################################
+####################################################################################################
+
+def perturb (arraySizeList, unitArray, perturbFrctn):
+
+    perturbedUnitArray = perturbBatch (arraySizeList, unitArray, perturbFrctn, 1)[0]
+
+    return (perturbedUnitArray)
+
+
+####################################################################################################
+#
+# Function to choose, for each of numSubsets subsets, subsetSize distinct entries of candidatesArray
+#   in a single vectorized draw: each subset gets its own random keys, and the entries with the
+#   subsetSize smallest keys are chosen (np.argpartition finds them in O(n) steps per subset).
+#   Returns an array with shape (numSubsets, subsetSize).
+#
+####################################################################################################
+
+def selectRandomSubsetsBatch (randomState, candidatesArray, subsetSize, numSubsets):
+
+    totalCandidates = len(candidatesArray)
+
+    if subsetSize >= totalCandidates:
+        return (np.tile(candidatesArray, (numSubsets, 1)))
+    if subsetSize <= 0:
+        return (np.zeros((numSubsets, 0), dtype=candidatesArray.dtype))
+
+    randomKeysStack = randomState.random_sample((numSubsets, totalCandidates))
+    chosenPositionsStack = np.argpartition(randomKeysStack, subsetSize, axis=1)[:, 0:subsetSize]
+
+    return (candidatesArray[chosenPositionsStack])
+
+
+####################################################################################################
+#
+# Function to choose the units to flip, for numReplicas independent perturbations of unitArray.
+#   Returns the (flattened) unit numbers, as an array with shape (numReplicas, flips):
+#     - normally, flips = int(perturbFrctn*N) distinct units, chosen from the whole grid
+#     - with runConfig.conservePerturbX1, flips/2 of the A units and as many of the B units (fewer
+#       if there are not enough A or B units), so that flipping them leaves x1 unchanged
+#
+####################################################################################################
+
+def obtainPerturbationSitesBatch (arraySizeList, unitArray, perturbFrctn, numReplicas):
+
+    totalNodes = arraySizeList.arrayLength*arraySizeList.arrayLayers
+    totalDesiredFlips = int(perturbFrctn*totalNodes)
+    randomState = obtainRandomState (arraySizeList)
+
+    if not arraySizeList.runConfig.conservePerturbX1:
+        return (selectRandomSubsetsBatch (randomState, np.arange(totalNodes), totalDesiredFlips, numReplicas))
+
+    x1UnitsArray = np.flatnonzero(unitArray > 0.1)
+    x2UnitsArray = np.flatnonzero(unitArray <= 0.1)
+    totalPairs = min(totalDesiredFlips//2, len(x1UnitsArray), len(x2UnitsArray))
+
+    x1SitesStack = selectRandomSubsetsBatch (randomState, x1UnitsArray, totalPairs, numReplicas)
+    x2SitesStack = selectRandomSubsetsBatch (randomState, x2UnitsArray, totalPairs, numReplicas)
+
+    return (np.concatenate((x1SitesStack, x2SitesStack), axis=1))
+
+
+####################################################################################################
+#
+# Function to make numReplicas independently perturbed copies of unitArray, each flipped at its
+#   own sites (obtainPerturbationSitesBatch) in one vectorized step.
+#   Returns perturbedUnitArrayStack, with shape (numReplicas, arrayLayers, arrayLength)
+#
+####################################################################################################
+
+def perturbBatch (arraySizeList, unitArray, perturbFrctn, numReplicas):
+
+    totalNodes = arraySizeList.arrayLength*arraySizeList.arrayLayers
+
+    perturbationSitesStack = obtainPerturbationSitesBatch (arraySizeList, unitArray, perturbFrctn, numReplicas)
+
+    perturbedUnitArrayStack = np.repeat(unitArray[np.newaxis], numReplicas, axis=0)
+    perturbedUnitVectorStack = perturbedUnitArrayStack.reshape(numReplicas, totalNodes)
+    replicaNumsArray = np.arange(numReplicas).reshape(numReplicas, 1)
+    perturbedUnitVectorStack[replicaNumsArray, perturbationSitesStack] = 1 - perturbedUnitVectorStack[replicaNumsArray, perturbationSitesStack]
+
+    return (perturbedUnitArrayStack)
+
+
+
+####################################################################################################
+####################################################################################################
+#
+# Perturbation-recovery experiments
+#
+# Instead of one serial perturb / re-minimize / count cycle per trial (as in
+#   computeConfigAndThermVars), numReplicas perturbed copies of the SAME equilibrium grid are made
+#   at once (perturbBatch), re-minimized together as one stack (adjustMatrixFEMinimumBatch), and
+#   compared with the equilibrium grid and with their own starting points (countTotalChangesBatch).
+#   For every replica this gives:
+#     - the recovery distance: the number of units in which the re-minimized replica differs from
+#       the original equilibrium grid
+#     - the relaxation distance: the number of units changed by the re-minimization itself
+#   and the distribution of these over the replicas is reported for each (h, perturbFrctn).
+# Minimizing the equilibrium grids is the expensive part, so for each h they are made once and
+#   reused for every perturbation fraction; the mean and variance of the recovery distance over
+#   (h, perturbFrctn) make up the recovery surface (computeRecoverySurface).
 #
 ####################################################################################################
 ####################################################################################################
 
+####################################################################################################
+#
+# Function to run numReplicas perturbation-recovery replicas of one equilibrium grid.
+#   Returns (recoveryDistancesArray, relaxationDistancesArray), with one entry per replica
+#
+####################################################################################################
 
-def computeConfigAndThermVars(arraySizeList, h, x1TargetVal, maxXDif, numTrials, jrange, maxRange,
-                            perturbFrctn):
+def runPerturbationRecoveryBatch (arraySizeList, baseUnitArray, h, perturbFrctn, numReplicas, totalTrials=200):
 
-    totalUnits = float(arrayLength*arrayLayers)
-    totalUnitsTimesTwo = totalUnits*2.0
-    
- 
-    xArray = np.zeros(numTrials, dtype=np.float)
-    x1Array = np.zeros(numTrials, dtype=np.float)  
-    y1Array = np.zeros(numTrials, dtype=np.float)
-    y2Array = np.zeros(numTrials, dtype=np.float)        
-    y3Array = np.zeros(numTrials, dtype=np.float)
-    w1Array = np.zeros(numTrials, dtype=np.float)
-    w2Array = np.zeros(numTrials, dtype=np.float)        
-    w3Array = np.zeros(numTrials, dtype=np.float)        
-    z1Array = np.zeros(numTrials, dtype=np.float)
-    z2Array = np.zeros(numTrials, dtype=np.float) 
-    z3Array = np.zeros(numTrials, dtype=np.float)
-    z4Array = np.zeros(numTrials, dtype=np.float)     
-    z5Array = np.zeros(numTrials, dtype=np.float)
-    z6Array = np.zeros(numTrials, dtype=np.float)         
-    negSArray = np.zeros(numTrials, dtype=np.float)
-    EnthEps0Array = np.zeros(numTrials, dtype=np.float)         
-    EnthEps1Array = np.zeros(numTrials, dtype=np.float)  
-    freeEnergyArray = np.zeros(numTrials, dtype=np.float) 
+    perturbedUnitArrayStack = perturbBatch (arraySizeList, baseUnitArray, perturbFrctn, numReplicas)
 
-    if not debugPrintOff:
-        print ' '     
-        print ' The thermodynamic quantities plot vs. x1' 
-        print '   The negEntropy is in blue, '
-        print '   The y2 value is in maroon.'
-        print '   The per-unit enthalpy is non-zero, but cannot be determined at this time, '
-        print '   The interaction enthalpy (eps1*y2) is set to zero (eps1 = 0, h = 1)'
-   
+# adjustMatrixFEMinimumBatch returns a new stack, so perturbedUnitArrayStack still holds the
+#   starting perturbed grids
+    recoveredUnitArrayStack = adjustMatrixFEMinimumBatch (arraySizeList, perturbedUnitArrayStack, h, totalTrials)
 
-    sumx1 = 0.0
-    sumy1 = 0.0
-    sumy2 = 0.0
-    sumy3 = 0.0
-    sumw1 = 0.0
-    sumw2 = 0.0
-    sumw3 = 0.0    
-    sumz1 = 0.0
-    sumz2 = 0.0 
-    sumz3 = 0.0
-    sumz4 = 0.0     
-    sumz5 = 0.0
-    sumz6 = 0.0           
-    sumNegS = 0.0      
-    sumEnthEps0   = 0.0
-    sumEnthEps1   = 0.0
-    sumFreeEnergy = 0.0
-    sumTotalChangesPerturbationsArray = 0.0
-    sumTotalChangesEquilibriumArray = 0.0
-    
-    print ' x1Target = ', x1TargetVal, ' h = ', h 
-    print ' Trial  Ttl chngs eqPtrb vs orig   Ttl chngs eqPtrb vs intlPtrb  '        
-    
-    # This loops to obtain average values for x1, y2, and the negative entropy for 
-    #  a specific target x1.    
-    for i in range (0, numTrials, 1):        
+    recoveryDistancesArray = countTotalChangesBatch (arraySizeList, baseUnitArray, recoveredUnitArrayStack)
+    relaxationDistancesArray = countTotalChangesBatch (arraySizeList, perturbedUnitArrayStack, recoveredUnitArrayStack)
 
-        configVarsList = list ()  # empty list
-        unitArray    = initializeMatrix (arraySizeList, h, x1TargetVal, maxXDif)        
-        # debug print: 
-        #    print unitArray  
+    return (recoveryDistancesArray, relaxationDistancesArray)
 
-        # adjust the unit array so that the actual x1 approximately = target x1
-        unitArray = adjustMatrix (arraySizeList, unitArray, h, jrange, maxXDif, x1TargetVal, 
-        beforeAndAfterAdjustedMatrixPrintOff)
 
-        # adjust the unit array so that the configuration variables take values yielding a
-        #  free energy minimum for the given h-value        
-        unitArrayForFEMinimum = adjustMatrixFEMinimum (arraySizeList, unitArray, h, maxRange)
-        
+####################################################################################################
+#
+# Function to run the perturbation-recovery experiment for one x1 value, over the h values in
+#   hValsList and the perturbation fractions in perturbFrctnsList.
+#   For each h, numBaseGrids equilibrium grids are made (obtainEquilibriumUnitArray), once, and each
+#   of them is given numReplicas replicas at every perturbation fraction. Base grid b is made from
+#   the random number stream of sweep cell (x1Index, hIndex, trial b) (see obtainSweepCellGrid), so
+#   it is the same grid that the sweep starts that trial from; its replicas draw from the same
+#   stream.
+#   Returns recoveryResultsList, with one entry per (h, perturbFrctn), in that order:
+#     (h, perturbFrctn, recoveryDistancesArray, relaxationDistancesArray)
+#   where the arrays hold the numBaseGrids*numReplicas replicas of that point.
+#
+####################################################################################################
 
-# Obtain the configuration variables once again (this step was also done while adjusting the array) 
-# The configuration variables list returned from computeConfigVariables is the list of 
-#   RAW COUNTS, meaning that the:
-#   -  x vars need to be divided by the total number of units
-#   -  y, w, and z vars need to be divided by the 2*total number of units, and
-#   -  y2, w2, z2, and z5 vars need to be divided again by 2 to reach their normative values,
-#      so that (e.g.), y1 + 2y2 + y3 = 0, etc. 
-      
-        configVarsList = computeConfigVariables (arraySizeList, unitArrayForFEMinimum)
-                                                                
-# obtain the thermodynamic variables 
-        sysVarsList = computeThermodynamicVars (h, configVarsList)   
+def runPerturbationRecoveryExperiment (arraySizeList, x1TargetVal, x1Index, hValsList, perturbFrctnsList, numReplicas, 
+                                       maxXDif, jrange, maxRange, sweepBaseSeed, numBaseGrids=1):
 
-# store the thermodynamic variables to plot later
-        x1     = float(configVarsList[0])/totalUnits
-        y1     = float(configVarsList[2])/totalUnitsTimesTwo          
-        y2Real = float(configVarsList[3])/(totalUnitsTimesTwo*2.0)        
-        y3     = float(configVarsList[4])/totalUnitsTimesTwo
-        w1     = float(configVarsList[5])/totalUnitsTimesTwo          
-        w2Real = float(configVarsList[6])/(totalUnitsTimesTwo*2.0)         
-        w3     = float(configVarsList[7])/totalUnitsTimesTwo          
-        z1     = float(configVarsList[8])/totalUnitsTimesTwo  
-        z2Real = float(configVarsList[9])/(totalUnitsTimesTwo*2.0) 
-        z3     = float(configVarsList[10])/totalUnitsTimesTwo  
-        z4     = float(configVarsList[11])/totalUnitsTimesTwo 
-        z5Real = float(configVarsList[12])/(totalUnitsTimesTwo*2.0)   
-        z6     = float(configVarsList[13])/totalUnitsTimesTwo 
-                                        
-        xArray[i]       = i  # x1
-        x1Array[i]      = x1  # x1
-        y1Array[i]      = y1
-        y2Array[i]      = y2Real  # y2
-        y3Array[i]      = y3
-        w1Array[i]      = w1
-        w2Array[i]      = w2Real  # w2
-        w3Array[i]      = w3        
-        z1Array[i]      = z1  # z1
-        z2Array[i]      = z2Real  # z2        
-        z3Array[i]      = z3  # z3
-        z4Array[i]      = z4  # z4        
-        z5Array[i]      = z5Real  # z5
-        z6Array[i]      = z6  # z6
-        # sysValsList = (negS, enthalpy0, enthalpy1, freeEnergy)
-        negSArray[i]    = sysVarsList[0] 
-        EnthEps0Array[i]   = sysVarsList[1]         
-        EnthEps1Array[i]   = sysVarsList[2] 
-        freeEnergyArray[i] = sysVarsList[3]         
-#        fEps0Array[i]   = sysVarsList[1]
-#        fEps1Array[i]   = sysVarsList[2]-0.6  
-#        fEnergyArray[i] = sysVarsList[3]-0.6                                                
-        sumx1 = sumx1 + x1
-        sumy1 = sumy1 + y1
-        sumy2 = sumy2 + y2Real
-        sumy3 = sumy3 + y3
-        sumw1 = sumw1 + w1
-        sumw2 = sumw2 + w2Real
-        sumw3 = sumw3 + w3
-        sumz1 = sumz1 + z1
-        sumz2 = sumz2 + z2Real  
-        sumz3 = sumz3 + z3
-        sumz4 = sumz4 + z4 
-        sumz5 = sumz5 + z5Real
-        sumz6 = sumz6 + z6                       
-        sumNegS = sumNegS + sysVarsList[0] 
-        sumEnthEps0   = sumEnthEps0 + sysVarsList[1]
-        sumEnthEps1   = sumEnthEps1 + sysVarsList[2]
-        sumFreeEnergy = sumFreeEnergy + sysVarsList[3]        
-            
-        perturbedUnitArray = perturb (arraySizeList, unitArray, perturbFrctn) 
-    
-        # Store a copy of the starting perturbed array
-        startingPerturbedArray = createIdenticalUnitArray (arraySizeList, perturbedUnitArray)    
-    
-        # Bring the perturbed array to equilibrium
-        # Note that this will make changes to the starting perturbed array
-        #  as well as returning an array called perturbedEqlbrmUnitArray;
-        #  these will now be identical - 
-        #  this is why we made a copy of the starting perturbed array. 
-        perturbedEqlbrmUnitArray = adjustMatrixFEMinimum (arraySizeList, perturbedUnitArray, h, maxRange) 
-    
-        totalChangesPerturbationsArray = countTotalChangesInUnitArray (arraySizeList, startingPerturbedArray, perturbedEqlbrmUnitArray)               
+    recoveryResultsList = list()
+    for hIndex in range (0, len(hValsList)):
+        h = hValsList[hIndex]
 
-        totalChangesEquilibriumArray = countTotalChangesInUnitArray (arraySizeList, unitArray, perturbedEqlbrmUnitArray)  
-        
-        sumTotalChangesPerturbationsArray = sumTotalChangesPerturbationsArray + totalChangesPerturbationsArray
-        sumTotalChangesEquilibriumArray = sumTotalChangesEquilibriumArray + totalChangesEquilibriumArray  
-        
-        print i, '        ', totalChangesPerturbationsArray, '         ', totalChangesEquilibriumArray                                                                                                                                                                                                                                                                                                                                                                                                                                                                                              
-                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                
-                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                
-# END: FOR loop (to compute x1, y2, and negS for a given target x1)
+        baseGridsList = list()
+        for baseNum in range (0, numBaseGrids):
+            cellGrid = obtainSweepCellGrid (arraySizeList, sweepBaseSeed, x1Index, hIndex, baseNum)
+            baseUnitArray = obtainEquilibriumUnitArray (cellGrid, h, x1TargetVal, maxXDif, jrange, maxRange)
+            baseGridsList.append((cellGrid, baseUnitArray))
 
-# Compute the average values for various values
-    denom = float(numTrials)
-    avgx1 = sumx1/denom
-    avgy1 = sumy1/denom
-    avgy2 = sumy2/denom
-    avgy3 = sumy3/denom    
-    avgw1 = sumw1/denom
-    avgw2 = sumw2/denom
-    avgw3 = sumw3/denom  
-    avgz1 = sumz1/denom
-    avgz2 = sumz2/denom    
-    avgz3 = sumz3/denom
-    avgz4 = sumz4/denom 
-    avgz5 = sumz5/denom
-    avgz6 = sumz6/denom     
-    avgNegS = sumNegS/denom
-    avgEnthEps0 = sumEnthEps0/denom
-    avgEnthEps1 = sumEnthEps1/denom    
-    avgFreeEnergy = sumFreeEnergy/denom
-    avgTotalChangesPerturb = sumTotalChangesPerturbationsArray/denom
-    avgTotalChangesEquilibrium = sumTotalChangesEquilibriumArray/denom
-    
-    if not debugPrintOff:
-        print ' '   
+        for perturbFrctn in perturbFrctnsList:
+            recoveryDistancesList = list()
+            relaxationDistancesList = list()
+            for (cellGrid, baseUnitArray) in baseGridsList:
+                (recoveryDistancesArray, relaxationDistancesArray) = runPerturbationRecoveryBatch (cellGrid, baseUnitArray, 
+                    h, perturbFrctn, numReplicas)
+                recoveryDistancesList.append(recoveryDistancesArray)
+                relaxationDistancesList.append(relaxationDistancesArray)
+            recoveryResultsList.append((h, perturbFrctn, np.concatenate(recoveryDistancesList), 
+                                        np.concatenate(relaxationDistancesList)))
 
-    # Print the average results
-        print ' '
-        print ' For a target x1 of: %.4f' % (x1TargetVal) 
-        print '   over a set of ', numTrials, ' trials, the average values are:'
-        print '          x1: %.4f' % (avgx1)     
-        print '          y1: %.4f' % (avgy1) 
-        print '          y2: %.4f' % (avgy2) 
-        print '          z1: %.4f' % (avgz1)
-        print '          z2: %.4f' % (avgz2) 
-        print '          z3: %.4f' % (avgz3)
-        print '          z4: %.4f' % (avgz4)
-        print '          z5: %.4f' % (avgz5)  
-        print '          z6: %.4f' % (avgz6)                                  
-        print '         negS: %.4f' % (avgNegS)   
-        print '    Enthalpy0: %.4f' % (avgEnthEps0) 
-        print '    Enthalpy1: %.4f' % (avgEnthEps1) 
-        print '    Free Engy: %.4f' % (avgFreeEnergy)     
-    # Plot the results from that FOR loop (multiple tests of a random grid for a given x1 value)          
-    #    print '     and the free energy is in red, also shifted by 0.6.'   
-        pylab.figure(1)
-        pylab.plot (xArray,negSArray)    
-        pylab.plot (xArray, y2Array, 'm')
-    # #   pylab.plot (xArray,fEps1Array,'m')
-    # #   pylab.plot (xArray,fEnergyArray,'r')
-        pylab.show()  
-    # END: FOR loop (to test for a range of target x1 values) 
- 
-    
-            
-    newList = (avgx1, avgy1, avgy2, avgy3, avgw1, avgw2, avgw3, avgz1, avgz2, avgz3, avgz4, avgz5, avgz6, 
-               avgNegS, avgEnthEps0, avgEnthEps1, avgFreeEnergy, unitArrayForFEMinimum,
-               avgTotalChangesPerturb, avgTotalChangesEquilibrium)
-    
+    return (recoveryResultsList)
 
-                                                                    
-    return (newList) 
-    # END - return a set of values for a single trial with x1TargetVal   
 
+####################################################################################################
+#
+# Function to build the recovery surface from recoveryResultsList: the mean and the variance of the
+#   recovery distance (the Hamming distance to the original equilibrium grid), over the replicas of
+#   each (h, perturbFrctn).
+#   Returns (recoveryMeanSurface, recoveryVarianceSurface), each with shape
+#   (len(hValsList), len(perturbFrctnsList))
+#
+####################################################################################################
+
+def computeRecoverySurface (hValsList, perturbFrctnsList, recoveryResultsList):
+
+    recoveryMeanSurface = np.zeros((len(hValsList), len(perturbFrctnsList)), dtype=np.float)
+    recoveryVarianceSurface = np.zeros((len(hValsList), len(perturbFrctnsList)), dtype=np.float)
 
+    for resultNum in range (0, len(recoveryResultsList)):
+        (hIndex, frctnIndex) = divmod(resultNum, len(perturbFrctnsList))
+        recoveryDistancesArray = recoveryResultsList[resultNum][2]
+        recoveryMeanSurface[hIndex, frctnIndex] = recoveryDistancesArray.mean()
+        recoveryVarianceSurface[hIndex, frctnIndex] = recoveryDistancesArray.var()
 
+    return (recoveryMeanSurface, recoveryVarianceSurface)
+
+
+####################################################################################################
+#
+# Function to write the recovery surface to a NumPy .npz file, with the arrays hVals, 
+#   perturbFrctns, recoveryMean, and recoveryVariance (and the scalars x1TargetVal and totalUnits)
+#
 ####################################################################################################
+
+def saveRecoverySurface (surfaceFileName, arraySizeList, x1TargetVal, hValsList, perturbFrctnsList, 
+                         recoveryMeanSurface, recoveryVarianceSurface):
+
+    np.savez(surfaceFileName, hVals=np.array(hValsList), perturbFrctns=np.array(perturbFrctnsList), 
+             recoveryMean=recoveryMeanSurface, recoveryVariance=recoveryVarianceSurface, 
+             x1TargetVal=x1TargetVal, totalUnits=arraySizeList.arrayLength*arraySizeList.arrayLayers)
+    print ' Saved the recovery surface to', surfaceFileName
+
+
 ####################################################################################################
 #
+# Function to print the distribution of the recovery distances (and the mean relaxation distance)
+#   for each (h, perturbFrctn) in recoveryResultsList
 #
-# Function to create a perturbed unitArray, where the fraction perturbFrctn units are flipped
+####################################################################################################
+
+def printRecoveryDistributions (arraySizeList, x1TargetVal, recoveryResultsList):
+
+    totalUnits = arraySizeList.arrayLength*arraySizeList.arrayLayers
+
+    print ' '
+    print ' Perturbation-recovery distributions, for the case where:'
+    print '  - the target x1 value is    %.4f' % (x1TargetVal)
+    print '  - the grid has %d units; distances are in units that differ' % (totalUnits)
+    print ' '
+    print '     h    prtrb  replicas |  recovery distance:  mean     std     min     10%     50%     90%     max  | relax mean'
+    for (h, perturbFrctn, recoveryDistancesArray, relaxationDistancesArray) in recoveryResultsList:
+        percentilesArray = np.percentile(recoveryDistancesArray, [0, 10, 50, 90, 100])
+        print '   %.2f   %.3f   %6d  |                  %7.2f %7.2f %7.1f %7.1f %7.1f %7.1f %7.1f  |  %7.2f' % (h, 
+            perturbFrctn, len(recoveryDistancesArray), recoveryDistancesArray.mean(), recoveryDistancesArray.std(), 
+            percentilesArray[0], percentilesArray[1], percentilesArray[2], percentilesArray[3], percentilesArray[4], 
+            relaxationDistancesArray.mean())
+    print ' '
+
+
+####################################################################################################
 #
+# Function to print the recovery surface (mean and variance of the recovery distance, by h and
+#   perturbation fraction), and to plot the recovery curves: the mean recovery distance against the
+#   perturbation fraction, one curve per h value
 #
 ####################################################################################################
+
+def plotAndPrintRecoverySurface (arraySizeList, x1TargetVal, hValsList, perturbFrctnsList, 
+                                 recoveryMeanSurface, recoveryVarianceSurface):
+
+    print ' '
+    print ' Recovery surface: mean (variance) of the recovery distance, for the target x1 value %.4f' % (x1TargetVal)
+    print ' '
+    print '     h   ' + ''.join(['     prtrb %.3f  ' % (perturbFrctn) for perturbFrctn in perturbFrctnsList])
+    for hIndex in range (0, len(hValsList)):
+        print '   %.2f  ' % (hValsList[hIndex]) + ''.join(['  %7.2f (%6.1f)' % (recoveryMeanSurface[hIndex, frctnIndex], 
+            recoveryVarianceSurface[hIndex, frctnIndex]) for frctnIndex in range (0, len(perturbFrctnsList))])
+    print ' '
+
+    if arraySizeList.runConfig.plotMode == 'off':
+        return
+
+    pylab = obtainPylab (arraySizeList)
+    pylab.figure(2)
+    for hIndex in range (0, len(hValsList)):
+        pylab.plot (perturbFrctnsList, recoveryMeanSurface[hIndex])
+
+    print ' The recovery curves: the mean recovery distance against the perturbation fraction,'
+    print '   one curve for each h value, in the order of the table above'
+    print ' '
+
+    finishFigure (arraySizeList, pylab, 'recovery-curves')
+
+
+####################################################################################################
+#
+# Function to print and plot the results of the ascending and descending continuation sweeps for
+#   one x1 value (upResultsList[hVal] and downResultsList[hVal] are the newLists for the hVal'th h
+#   value); where the two differ by more than the trial-to-trial scatter, the sweep shows
+#   hysteresis. The two directions do not have the same minimizer trials at every h (see
+#   runContinuationSweep); the points that started from a random grid with 200 trials, rather
+#   than with continuationTrials from a warm start, are marked with a *.
+#
 ####################################################################################################
 
-def perturb (arraySizeList, unitArray, perturbFrctn):
-    
-    localArrayLength = arraySizeList[0]
-    localArrayLayers = arraySizeList[1]
+def plotAndPrintHysteresisResults (arraySizeList, x1TargetVal, hValsList, upResultsList, downResultsList, 
+                                   continuationTrials):
 
-    totalNodes = localArrayLength*localArrayLayers
-    totalDesiredFlips = int(perturbFrctn*totalNodes)    
+    freeEnergyUpArray = np.array([newList[16] for newList in upResultsList])
+    freeEnergyDownArray = np.array([newList[16] for newList in downResultsList])
+    y2UpArray = np.array([newList[2] for newList in upResultsList])
+    y2DownArray = np.array([newList[2] for newList in downResultsList])
 
-    flipYesProb = perturbFrctn
-    flipNoProb  = 1.0 - flipYesProb
-    
-    perturbedUnitArray = createIdenticalUnitArray (arraySizeList, unitArray)
-
-    expectedFlips = int(perturbFrctn*localArrayLength*localArrayLayers)    
-    totalFlips = 0
-
-    for i in range (0, totalDesiredFlips):
-        randRow = np.random.choice([0, localArrayLength-1])
-        randCol = np.random.choice([0, localArrayLayers-1])
-        if perturbedUnitArray[randRow,randCol] ==1: perturbedUnitArray[randRow,randCol] = 0
-        else: perturbedUnitArray[randRow,randCol] =1
-        totalFlips = totalFlips + 1
-                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                                 
-    return (perturbedUnitArray)
+    print ' '
+    print ' Hysteresis: the continuation sweep with increasing h (up) and with decreasing h (down),'
+    print '   for the target x1 value %.4f' % (x1TargetVal)
+    print ' '
+    print '     h       FreeEnergy up   FreeEnergy down   Difference       y2 up     y2 down'
+    for hIndex in range (0, len(hValsList)):
+        upMark = '*' if hIndex == 0 else ' '
+        downMark = '*' if hIndex == len(hValsList) - 1 else ' '
+        print '   %.2f      %10.5f%s     %10.5f%s    %10.5f     %8.4f    %8.4f' % (hValsList[hIndex], 
+            freeEnergyUpArray[hIndex], upMark, freeEnergyDownArray[hIndex], downMark, 
+            freeEnergyDownArray[hIndex] - freeEnergyUpArray[hIndex], y2UpArray[hIndex], y2DownArray[hIndex])
+    print ' '
+    print '   * started from a random grid, with 200 minimizer trials; every other point started from'
+    print '     the grid of the h value before it, with', continuationTrials, 'trials. The two curves therefore'
+    print '     compare unequal trial budgets: at each h, the two chains have had different numbers of'
+    print '     trials in total.'
+    print ' '
+
+    if arraySizeList.runConfig.plotMode == 'off':
+        return
+
+    pylab = obtainPylab (arraySizeList)
+    pylab.figure(3)
+    pylab.plot (hValsList, freeEnergyUpArray, 'b')
+    pylab.plot (hValsList, freeEnergyDownArray, 'r')
+
+    print ' The free energy against h: the increasing-h sweep is in blue, the decreasing-h sweep in red'
+    print ' '
+
+    finishFigure (arraySizeList, pylab, 'hysteresis')
 
 
 
@@ -3555,10 +6159,13 @@ def perturb (arraySizeList, unitArray, perturbFrctn):
 
 def prettyPrintArray (arraySizeList, unitArray):
 
+    pairs = arraySizeList.pairs
+    blnkspc = arraySizeList.runConfig.blnkspc
+
     localArrayLength = arraySizeList[0]
     localArrayLayers = arraySizeList[1]
 
-    # NOTE: pairs is the number of pairs of layers, defined in **main**
+    # NOTE: pairs is the number of pairs of layers, defined by CVMGrid
     #       as pairs = int(arrayLayers/2.0)
     
     print ' '        
@@ -3578,53 +6185,115 @@ def prettyPrintArray (arraySizeList, unitArray):
                 print 'X', blnkspc,
             else: print '-', blnkspc,            
         print ' '
+    if not arraySizeList.evenLayers:
+        lastRowNum = 2*pairs
+        print 'Row', lastRowNum, ':', blnkspc, 
+        for j in range(0,localArrayLength):
+            if unitArray[lastRowNum,j] ==1:
+                print 'X', blnkspc,
+            else: print '-', blnkspc,
+        print ' '
                 
                 
 
 ####################################################################################################
 ####################################################################################################
 #
-# Procedure to create a visually more intuitive depiction of the changes in the population of a 
-#   perturbed unitArray.
-#   A change from 0 to 1 is shown as an "W", and a change from a 1 to a 0 is shown as an "M"  
-#
-#    Inputs:    arraySizeList, unitArray, perturbedUnitArray
+# Function to count the units that differ between two grids (the Hamming distance between them).
+#   The two grids are compared as A/B patterns with a single XOR over the whole array, and the
+#   units that differ are counted in the same pass.
 #
+#    Inputs:    arraySizeList, unitArray1, unitArray2
 #
 ####################################################################################################
 ####################################################################################################
 
 def countTotalChangesInUnitArray (arraySizeList, unitArray1, unitArray2):
 
-    localArrayLength = arraySizeList[0]
-    localArrayLayers = arraySizeList[1]
-
-    # NOTE: pairs is the number of pairs of layers, defined in **main**
-    #       as pairs = int(arrayLayers/2.0)
-    
-    totalChanges = 0      
-    for i in range (0, pairs):
-        actualEvenRowNum = 2*i 
-        for j in range(0,localArrayLength):
-            if unitArray1[actualEvenRowNum,j] == 1:
-                if unitArray2[actualEvenRowNum,j] == 0:
-                    totalChanges = totalChanges + 1
-            else: # unitArray element == 0
-                if unitArray2[actualEvenRowNum,j] == 1:
-                    totalChanges = totalChanges + 1                
-        actualOddRowNum = 2*i+1
-        for j in range(0,localArrayLength):
-            if unitArray1[actualOddRowNum,j] ==1:
-                if unitArray2[actualOddRowNum,j] == 0:
-                    totalChanges = totalChanges + 1                    
-            else: # unitArray element == 0
-                if unitArray2[actualOddRowNum,j] == 1:
-                    totalChanges = totalChanges + 1                      
-                                                              
+    totalChanges = np.count_nonzero(np.logical_xor(unitArray1 > 0.1, unitArray2 > 0.1))
 
     return totalChanges
 
+
+####################################################################################################
+#
+# Function to count, for every grid in unitArrayStack, the units that differ from unitArray (which
+#   may itself be a stack of the same shape). Returns an integer array with one count per grid.
+#
+####################################################################################################
+
+def countTotalChangesBatch (arraySizeList, unitArray, unitArrayStack):
+
+    numGrids = unitArrayStack.shape[0]
+    changedUnitsStack = np.logical_xor(unitArray > 0.1, unitArrayStack > 0.1).reshape(numGrids, -1)
+
+    return (np.count_nonzero(changedUnitsStack, axis=1))
+
      
+####################################################################################################
+####################################################################################################
+#
+# Plotting
+#
+# Matplotlib is only imported when a figure is actually made, and runConfig.plotMode decides what
+#   happens to each figure:
+#   'show' - the figure is shown on screen (pylab.show() blocks until the window is closed)
+#   'save' - matplotlib is switched to its non-GUI 'Agg' backend, and the figure is written to
+#            runConfig.plotDirectory as figureName.png (figureName-2.png, ... for later figures
+#            with the same name in the same run); nothing blocks
+#   'off'  - no figures are made, and matplotlib is never imported
+#
+####################################################################################################
+####################################################################################################
+
+savedFigureCountsDict = dict()
+
+####################################################################################################
+#
+# Function to import pylab (the first time it is needed) and return it
+#
+####################################################################################################
+
+def obtainPylab (arraySizeList):
+
+    if arraySizeList.runConfig.plotMode == 'save':
+        import matplotlib
+        matplotlib.use('Agg')
+    import pylab
+
+    return (pylab)
+
+
+####################################################################################################
+#
+# Function to show, or save, the figure that has just been drawn
+#
+####################################################################################################
+
+def finishFigure (arraySizeList, pylab, figureName):
+
+    plotMode = arraySizeList.runConfig.plotMode
+    plotDirectory = arraySizeList.runConfig.plotDirectory
+
+    if plotMode == 'show':
+        pylab.show()
+        return
+
+    if not os.path.isdir(plotDirectory):
+        os.makedirs(plotDirectory)
+
+    savedFigureCountsDict[figureName] = savedFigureCountsDict.get(figureName, 0) + 1
+    if savedFigureCountsDict[figureName] == 1:
+        figureFileName = os.path.join(plotDirectory, figureName + '.png')
+    else:
+        figureFileName = os.path.join(plotDirectory, '%s-%d.png' % (figureName, savedFigureCountsDict[figureName]))
+
+    pylab.savefig(figureFileName)
+    pylab.close()
+    print ' Saved the plot to', figureFileName
+
+
+
 ####################################################################################################
 ####################################################################################################
 #
@@ -3634,7 +6303,7 @@ def countTotalChangesInUnitArray (arraySizeList, unitArray1, unitArray2):
 ####################################################################################################
 
 
-def plotAndPrintPerturbationResults (x1TargetVal, hArray, hTotalSteps, hStep, 
+def plotAndPrintPerturbationResults (arraySizeList, x1TargetVal, hArray, hTotalSteps, hStep, 
                 avgTotalChangesPerturbationsArray, avgTotalChangesEquilibriumArray):
 
     hStart = hArray[0]
@@ -3655,7 +6324,11 @@ def plotAndPrintPerturbationResults (x1TargetVal, hArray, hTotalSteps, hStep,
         print '   %.2f' % (hArray[k]), '          ', '   %.2f' % (avgTotalChangesPerturbationsArray[k]), '          ', '   %.2f' % (avgTotalChangesEquilibriumArray[k]) 
         
 
-                                                                      
+
+    if arraySizeList.runConfig.plotMode == 'off':
+        return
+
+    pylab = obtainPylab (arraySizeList)
     pylab.figure(1)
     pylab.plot (hArray, avgTotalChangesPerturbationsArray)          
     pylab.plot (hArray, avgTotalChangesEquilibriumArray, 'g')
@@ -3673,7 +6346,7 @@ def plotAndPrintPerturbationResults (x1TargetVal, hArray, hTotalSteps, hStep,
  
     print ' ' 
            
-    pylab.show()      
+    finishFigure (arraySizeList, pylab, 'perturbation-results')
     
     
     
@@ -3780,7 +6453,7 @@ def printConfigVarsComparison(h, configVarsList, configVarsListDelta):
 ####################################################################################################
 
 
-def printUnitArrayModificationResults (x1ValsArray, y2ValsArray, 
+def printUnitArrayModificationResults (arraySizeList, x1ValsArray, y2ValsArray, 
         z1ValsArray, z3ValsArray, negSValsArray, enthalpy1Array, freeEnergyArray, h, totalTrials, 
         findFEMinimumValsBoolOff):  
 
@@ -3803,7 +6476,11 @@ def printUnitArrayModificationResults (x1ValsArray, y2ValsArray,
             print '   %.4f' % (x1ValsArray[j]), '  %.4f' % (y2ValsArray[j]), '  %.4f' % (z1ValsArray[j]), '  %.4f' % (z3ValsArray[j]), '  %.4f' % (negSValsArray[j]), '  %.4f' % (enthalpy1Array[j]), '  %.4f' % (freeEnergyArray[j])          
 
     # Plot the results from that FOR loop (adjusting the unitArray to achieve free energy minimization)                                             
-                                                                                                
+
+    if arraySizeList.runConfig.plotMode == 'off':
+        return
+
+    pylab = obtainPylab (arraySizeList)
     pylab.figure(1)
     pylab.plot (trialNumArray, negSValsArray)          
     pylab.plot (trialNumArray, y2ValsArray-0.8, 'g')     
@@ -3819,7 +6496,7 @@ def printUnitArrayModificationResults (x1ValsArray, y2ValsArray,
     print '  The probabilistic y2 values (minus 0.8) are in green,' 
     print '  The probabilistic enthalpy(1) (minus 0.5) values are in red. ' 
     print '  The probabilistic free energy values are in black. '        
-    pylab.show()                          
+    finishFigure (arraySizeList, pylab, 'fe-minimization-trials')
                                                 
 #   END printUnitArrayModificationResults 
                                                                                                                    
@@ -4064,22 +6741,16 @@ def main():
 
     welcome()
 
-    global debugPrintOff
-    global detailedDebugPrintOff
-    global detailedAdjustMatrixPrintOff
-    global beforeAndAfterAdjustedMatrixPrintOff
-    global ZDebugPrintOff
-    global blnkspc
-    global arrayLength
-    global arrayLayers
-    global evenLayers
-    global pairs
-    evenLayers = True
+# All of the settings for this run are kept in runConfig, and the grid geometry in arraySizeList
+#   (a CVMGrid, which also carries runConfig); both are passed explicitly to the functions above,
+#   rather than being held in global variables
+    runConfig = CVMRunConfig ()
             
-    arraySizeList = list() # empty list
-    arraySizeList = obtainArraySizeSpecs ()
-    arrayLength = arraySizeList[0]
-    arrayLayers = arraySizeList [1]
+# The grid size is 16 x 16 unless --length N and/or --layers M are given (see obtainArraySizeSpecs)
+    arraySizeSpecs = obtainArraySizeSpecs ()
+    arrayLength = arraySizeSpecs[0]
+    arrayLayers = arraySizeSpecs [1]
+    arraySizeList = CVMGrid (arrayLength, arrayLayers, runConfig)
     sysVarsList = list()
 
 
@@ -4090,25 +6761,84 @@ def main():
                        # desired value of x1 = x1TargetVal  
     jrange = 200        # maximal number of steps allowed to improve the x1 distribution
 
-    blnkspc=' '
-
-    if arrayLayers % 2 == 0: evenLayers == True #then an even number of layers
-
-    # Determine the total number of PAIRS of zigzag chains
-    pairsLayers = arrayLayers/2
-    pairs = int(pairsLayers) 
-
-    debugPrintOff = True
-    detailedDebugPrintOff = True
-    ZDebugPrintOff = True
-    detailedAdjustMatrixPrintOff = True
-
-# This is a local variable; it will be passed to computeConfigVariables
+    runConfig.blnkspc=' '
+
+# The total number of PAIRS of zigzag chains (arraySizeList.pairs), and whether there is an even
+#   number of layers (arraySizeList.evenLayers), are worked out by CVMGrid
+
+    runConfig.debugPrintOff = True
+    runConfig.detailedDebugPrintOff = True
+    runConfig.ZDebugPrintOff = True
+    runConfig.detailedAdjustMatrixPrintOff = True
+
+# Select how each starting unitArray is made: True places exactly round(x1*N) A units at random
+#   (initializeExactCompositionMatrix); False generates the units one by one with probability x1,
+#   and then adjusts the array until x1 is within maxXDif of the target (adjustMatrix)
+    runConfig.useExactCompositionInit = True
+
+# Select the engine used to count the configuration variables: True uses the whole-array NumPy
+#   engine (computeConfigVariablesVectorized), False uses the original cell-by-cell loops
+    runConfig.useVectorizedConfigVars = True
+
+# Select the backend for the whole-array engine: 'numba' counts each grid in one JIT-compiled pass
+#   (countConfigVariablesKernel), 'numpy' uses the NumPy gathers, and 'auto' uses Numba when it is
+#   installed. Without Numba, the NumPy engine is always used.
+    runConfig.configVarsBackend = 'auto'
+
+# Select what happens to the plots: 'show' opens them on screen (each one blocks until its window
+#   is closed), 'save' writes them as .png files to plotDirectory using a non-GUI backend, and 'off'
+#   makes no plots (matplotlib is not even imported). Running the program with --headless selects
+#   'save', and with --no-plots selects 'off', for unattended batch runs.
+    runConfig.plotMode = 'show'
+    if '--headless' in sys.argv[1:]:
+        runConfig.plotMode = 'save'
+    if '--no-plots' in sys.argv[1:]:
+        runConfig.plotMode = 'off'
+    runConfig.plotDirectory = 'cvm-plots'
+
+# Select whether the run is profiled: the wall time, call count, and evaluations per second of
+#   each phase (see profiledPhasesList) are printed at the end of the run, and written as JSON to
+#   profileFileName. Running the program with --profile turns this on.
+    runConfig.useProfiling = '--profile' in sys.argv[1:]
+    runConfig.profileFileName = 'cvm-perturb-profile.json'
+    runStartTime = timeit.default_timer()
+    if runConfig.useProfiling:
+        enableProfiling ()
+
+# Select how adjustMatrixFEMinimum evaluates each trial swap: True keeps running totals of the
+#   configuration variables and recounts only the pairs and triplets touching the two swapped
+#   units (adjustMatrixFEMinimumLocal); False recounts the whole grid twice per trial
+    runConfig.useLocalFEUpdate = True
+
+# Select the Kawasaki-swap Metropolis sampler (adjustMatrixFEMinimumKawasaki) in place of the
+#   greedy trials in adjustMatrixFEMinimum. The temperature is for the free energy of the whole
+#   grid; a sweep is one proposed swap per unit. After the burn-in sweeps, the observables of
+#   every kawasakiThinning'th sweep are reported.
+    runConfig.useKawasakiSampler = False
+    runConfig.kawasakiTemperature = 0.1
+    runConfig.kawasakiTotalSweeps = 20
+    runConfig.kawasakiBurnInSweeps = 10
+    runConfig.kawasakiThinning = 1
+
+# Select how perturb flips its int(perturbFrctn*N) distinct units: False picks them anywhere in the
+#   grid; True flips them in A/B pairs (half A units, half B units), so that x1 is conserved
+    runConfig.conservePerturbX1 = False
+
+# Select the equilibrium-grid cache (see obtainEquilibriumUnitArray): every FE-minimized grid is
+#   saved to equilibriumCacheDirectory, so that a later run with the same settings reads it back
+#   instead of minimizing it again; the least recently used grids are removed once the cache holds
+#   more than equilibriumCacheMaxBytes. Running the program with --cache turns this on.
+    runConfig.equilibriumCacheDirectory = None
+    if '--cache' in sys.argv[1:]:
+        runConfig.equilibriumCacheDirectory = 'cvm-equilibrium-cache'
+    runConfig.equilibriumCacheMaxBytes = 64*1024*1024
+
+# This setting will be passed to computeConfigVariables
 #  It will determine whether we print the contents of the x-array at the
 #  beginning and end of the adjust-matrix step. 
-    beforeAndAfterAdjustedMatrixPrintOff = True
+    runConfig.beforeAndAfterAdjustedMatrixPrintOff = True
         
-    if not debugPrintOff:
+    if not runConfig.debugPrintOff:
         print ' '
         print 'Debug printing is on'  #debugPrintOff false
     else: 
@@ -4232,6 +6962,110 @@ def main():
     perturbFrctn = 0.1  # amt of perturbation given as a fraction here; 
     #  if the program were revised to accept the perturbPrcnt from user, it should be taken in 
     #    as an integer and then converted to a fraction
+
+# Select whether the (x1, h, trial) cells are run on a pool of worker processes (runParallelSweep);
+#   sweepWorkers = None uses every CPU. sweepBaseSeed fixes the random numbers of every cell: each
+#   cell has its own generator, seeded from (sweepBaseSeed, x1 index, h index, trial number), in
+#   the pool and in the serial loop alike.
+    useParallelSweep = True
+    sweepWorkers = None
+    sweepBaseSeed = 2018
+    hInitial = 1.0
+
+# Select the continuation sweep (runContinuationSweep) in place of the cell-by-cell sweep: each
+#   (x1, trial) steps through the h values in order, and each h value starts from the FE-minimized
+#   grid of the one before it, with only continuationTrials minimizer swap trials (the first h value
+#   starts from a random grid, with the usual 200). With useHysteresisSweep, the h values are
+#   also stepped through in decreasing order, and the two directions are compared (with unequal
+#   trial budgets near the ends of the range; see runContinuationSweep). Running the program with
+#   --continuation turns on the continuation sweep, and with --hysteresis both;
+#   --continuation-trials N sets continuationTrials.
+# Fewer trials is a trade-off, not a free saving: on a 16 x 16 grid (x1 = 0.45, h = 1.0 ... 1.9),
+#   50 trials cut the sweep time by about 30%, but where the equilibrium moves quickly with h
+#   (h = 1.1 ... 1.4) the warm-started free energy stays above that of a fresh 200-trial
+#   minimization; only at larger h, where 200 fresh trials are far from converged, is it lower.
+#   With 20 trials the warm-started chain lags behind over most of the range.
+    useContinuationSweep = '--continuation' in sys.argv[1:] or '--hysteresis' in sys.argv[1:]
+    useHysteresisSweep = '--hysteresis' in sys.argv[1:]
+    continuationTrials = 50
+    continuationTrialsOption = obtainOptionValue ('--continuation-trials')
+    if continuationTrialsOption is not None:
+        if not continuationTrialsOption.isdigit() or int(continuationTrialsOption) < 1:
+            raise ValueError('--continuation-trials needs a whole number of trials, not %s' % (continuationTrialsOption))
+        continuationTrials = int(continuationTrialsOption)
+
+# Select whether the sweep saves its completed cells (or continuation chains) to
+#   checkpointFileName (every checkpointInterval cells or chains); running the program with
+#   --checkpoint FILE turns this on, and --resume as well picks up a stopped sweep from FILE,
+#   instead of starting over (without --resume, an existing FILE is not overwritten). The
+#   decreasing-h pass of useHysteresisSweep is saved to FILE.down. checkpointFileName = None turns
+#   checkpointing off. The serial loop (useParallelSweep = False, without the continuation sweep)
+#   is not checkpointed, so --checkpoint is refused there.
+    checkpointFileName = obtainOptionValue ('--checkpoint')
+    checkpointInterval = 10
+    resumeFromCheckpoint = '--resume' in sys.argv[1:]
+    if resumeFromCheckpoint and checkpointFileName is None:
+        raise ValueError('--resume needs the checkpoint file, given with --checkpoint FILE')
+    if checkpointFileName is not None and not (useParallelSweep or useContinuationSweep):
+        raise ValueError('--checkpoint needs the parallel or continuation sweep; the serial loop is not checkpointed')
+
+# Select the results store for the sweep: one row per (x1, h, eps0, trial, sweep direction) is
+#   written to resultsFileBaseName (.parquet, or -chunk-NNNNN.npz files when pyarrow is not
+#   installed); with useHysteresisSweep, the rows of both directions go in the one store. Running
+#   the program with --results BASENAME turns this on. An existing store with that name is only
+#   replaced when --overwrite-results is given as well. resultsFileBaseName = None writes no
+#   results store. The serial loop writes no store, so --results is refused there.
+    resultsFileBaseName = obtainOptionValue ('--results')
+    overwriteResults = '--overwrite-results' in sys.argv[1:]
+    if resultsFileBaseName is not None and not (useParallelSweep or useContinuationSweep):
+        raise ValueError('--results needs the parallel or continuation sweep; the serial loop writes no results store')
+
+# Select the perturbation-recovery experiment (runPerturbationRecoveryExperiment): after the sweep,
+#   for the last x1 value and each h, recoveryBaseGrids equilibrium grids are made once, and each
+#   is perturbed recoveryReplicas times at every fraction in perturbFrctnsList; all of the
+#   replicas are re-minimized together. The distribution of the recovery distances is printed for
+#   every (h, perturbFrctn), and the recovery surface (their mean and variance) is printed,
+#   plotted, and written to recoverySurfaceFileName. Running the program with --recovery turns
+#   this on.
+    useRecoveryExperiment = '--recovery' in sys.argv[1:]
+    recoveryBaseGrids = 4
+    recoveryReplicas = 50
+    perturbFrctnsList = [0.01, 0.02, 0.05, 0.1, 0.2, 0.3, 0.4, 0.5]
+    recoverySurfaceFileName = 'cvm-perturb-recovery-surface.npz'
+
+    if useParallelSweep or useContinuationSweep:
+        resultsWriter = None
+        if resultsFileBaseName is not None:
+            resultsWriter = CVMResultsWriter (resultsFileBaseName, overwrite=overwriteResults)
+        # The same x1 and h values as the loops below step through
+        x1TargetValsList = list()
+        x1SweepVal = x1TargetVal
+        for j in range (0, x1TotalSteps, step):
+            x1SweepVal = x1SweepVal - x1TargetIncrement
+            x1TargetValsList.append(x1SweepVal)
+        hValsList = list()
+        hSweepVal = hInitial - hIncrement
+        for hVal in range (0, hTotalSteps, hStep):
+            hSweepVal = hSweepVal + hIncrement
+            hValsList.append(hSweepVal)
+        if useContinuationSweep:
+            sweepResultsList = runContinuationSweep (arraySizeList, x1TargetValsList, hValsList, numTrials, maxXDif, 
+                        jrange, maxRange, continuationTrials, perturbFrctn, sweepBaseSeed, sweepWorkers, 'up', 
+                        checkpointFileName, checkpointInterval, resumeFromCheckpoint, resultsWriter)
+        else:
+            sweepResultsList = runParallelSweep (arraySizeList, x1TargetValsList, hValsList, numTrials, maxXDif, 
+                        jrange, maxRange, perturbFrctn, sweepBaseSeed, sweepWorkers, checkpointFileName, 
+                        checkpointInterval, resumeFromCheckpoint, resultsWriter)
+        if useHysteresisSweep:
+            descendingCheckpointFileName = None
+            if checkpointFileName is not None:
+                descendingCheckpointFileName = checkpointFileName + '.down'
+            descendingResultsList = runContinuationSweep (arraySizeList, x1TargetValsList, hValsList, numTrials, 
+                        maxXDif, jrange, maxRange, continuationTrials, perturbFrctn, sweepBaseSeed, sweepWorkers, 
+                        'down', descendingCheckpointFileName, checkpointInterval, resumeFromCheckpoint, 
+                        resultsWriter)
+        if resultsWriter is not None:
+            resultsWriter.close ()
     
     for j in range (0, x1TotalSteps, step):     
         x1TargetVal = x1TargetVal - x1TargetIncrement
@@ -4243,7 +7077,6 @@ def main():
         print '    The current x1TargetVal is: %.4f' % (x1TargetVal) 
         print '  About to start the loop through h values ' 
 
-        hInitial = 1.0
         h = hInitial - hIncrement
         for hVal in range (0, hTotalSteps, hStep):
             h = h + hIncrement
@@ -4251,8 +7084,16 @@ def main():
             print '    In the h loop with h = ', h
             # newArrayList == (avgx1, avgy2, avgz1, avgz3, avgNegS, avgEnthEps0, avgEnthEps1, avgFreeEnergy,
             #                 avgTotalChangesPerturbations, avgTotalChangesEquilibrium)
-            newArrayList = computeConfigAndThermVars(arraySizeList, h, x1TargetVal, maxXDif, numTrials, jrange, 
-                        maxRange, perturbFrctn)
+            if useParallelSweep or useContinuationSweep:
+                newArrayList = sweepResultsList[j][hVal]
+            else:
+                # Each trial uses the same random number stream as the matching cell of runParallelSweep
+                trialResultsList = list()
+                for trialNum in range (0, numTrials):
+                    cellGrid = obtainSweepCellGrid (arraySizeList, sweepBaseSeed, j, hVal, trialNum)
+                    trialResultsList.append(computeConfigAndThermVars(cellGrid, h, x1TargetVal, maxXDif, 1, jrange, 
+                        maxRange, perturbFrctn))
+                newArrayList = combineSweepCellResults (trialResultsList)
             x1ValsArray[hVal]    = newArrayList[0]
             y1ValsArray[hVal]    = newArrayList[1]
             y2ValsArray[hVal]    = newArrayList[2]
@@ -4278,9 +7119,30 @@ def main():
             
     print ' ' 
     print ' Perturbation Results Summary'
-    plotAndPrintPerturbationResults (x1TargetVal, hArray, hTotalSteps, hStep, 
+    plotAndPrintPerturbationResults (arraySizeList, x1TargetVal, hArray, hTotalSteps, hStep, 
                     avgTotalChangesPerturbationsArray, avgTotalChangesEquilibriumArray)                                               
     print ' '                                                                                                                     
+
+    if useHysteresisSweep:
+        plotAndPrintHysteresisResults (arraySizeList, x1TargetVal, hValsList, sweepResultsList[j], 
+                        descendingResultsList[j], continuationTrials)
+
+    if useRecoveryExperiment:
+        recoveryHValsList = list(hArray)
+        recoveryResultsList = runPerturbationRecoveryExperiment (arraySizeList, x1TargetVal, j, recoveryHValsList, 
+                        perturbFrctnsList, recoveryReplicas, maxXDif, jrange, maxRange, sweepBaseSeed, recoveryBaseGrids)
+        printRecoveryDistributions (arraySizeList, x1TargetVal, recoveryResultsList)
+        (recoveryMeanSurface, recoveryVarianceSurface) = computeRecoverySurface (recoveryHValsList, perturbFrctnsList, 
+                        recoveryResultsList)
+        plotAndPrintRecoverySurface (arraySizeList, x1TargetVal, recoveryHValsList, perturbFrctnsList, 
+                        recoveryMeanSurface, recoveryVarianceSurface)
+        saveRecoverySurface (recoverySurfaceFileName, arraySizeList, x1TargetVal, recoveryHValsList, perturbFrctnsList, 
+                        recoveryMeanSurface, recoveryVarianceSurface)
+
+    if runConfig.useProfiling:
+        totalWallTime = timeit.default_timer() - runStartTime
+        printProfileReport (totalWallTime)
+        saveProfileJson (runConfig.profileFileName, arraySizeList, totalWallTime)
                                                                                                 
 ####################################################################################################
 # Conclude specification of the MAIN procedure
@@ -8,11 +8,9 @@
 import random
 import itertools
 import numpy as np
-import pylab
-import matplotlib
 from math import exp
 from math import log
-from matplotlib import pyplot as plt
+# pylab (matplotlib) is imported inside the plotting procedures, only when a plot is made
 from random import randrange, uniform #(not sure this is needed, since I'm importing random)
 
 
@@ -3411,6 +3409,7 @@ def computeConfigAndThermVars(arraySizeList, h, x1TargetVal, maxXDif, numTrials,
         print '    Free Engy: %.4f' % (avgFreeEnergy)     
     # Plot the results from that FOR loop (multiple tests of a random grid for a given x1 value)          
     #    print '     and the free energy is in red, also shifted by 0.6.'   
+        import pylab
         pylab.figure(1)
         pylab.plot (xArray,negSArray)    
         pylab.plot (xArray, y2Array, 'm')
@@ -3578,6 +3577,7 @@ def printX1ProbAndAnalyticResults (x1ValsArray, y2ValsArray, z1ValsArray, negSVa
     # Plot the results from that FOR loop (multiple tests of a random grid for a given x1 value)          
     #    print '     and the free energy is in red, also shifted by 0.6.'       
     
+    import pylab
     pylab.figure(1)
     pylab.plot (x1TargetValsArray,negSValsArray)
     pylab.plot (x1TargetValsArray, negSAnalyticValsArray, 'm')            
@@ -3642,6 +3642,7 @@ def printUnitArrayModificationResults (x1ValsArray, y2ValsArray,
 
     # Plot the results from that FOR loop (adjusting the unitArray to achieve free energy minimization)                                             
                                                                                                 
+    import pylab
     pylab.figure(1)
     pylab.plot (trialNumArray, negSValsArray)          
     pylab.plot (trialNumArray, y2ValsArray-0.8, 'g')     
@@ -3712,6 +3713,7 @@ def printEntropyDetailedResults (x1ValsArray, y1ValsArray, y2ValsArray, y3ValsAr
         print '   %.2f' % (hArray[k]), '  %.4f' % (xNegSArray[k]),  '  %.4f' % (yNegSArray[k]), ' %.4f' % (wNegSArray[k]) , ' %.4f' % (zNegSArray[k]),' %.4f' % (negSValsArray[k])  
         
                                                                         
+    import pylab
     pylab.figure(1)
     pylab.plot (hArray, negSValsArray)          
     pylab.plot (hArray, xNegSArray, 'g')
@@ -3784,6 +3786,7 @@ def printResults (x1ValsArray, y1ValsArray, y2ValsArray, y3ValsArray, z1ValsArra
 
     
             
+    import pylab
     pylab.figure(1)
     pylab.plot (hArray, negSValsArray)          
     pylab.plot (hArray, y2ValsArray, 'g')
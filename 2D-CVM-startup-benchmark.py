@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+####################################################################################################
+# Computing configuration variables for the Cluster Variation Method
+# Startup-time benchmark for the 2-D CVM scripts
+####################################################################################################
+#
+# Every sweep worker is a fresh Python process that loads one of the 2-D CVM scripts, so the time
+#   to load a script (its imports and its function definitions; main() is not run) is paid once
+#   per worker. This benchmark measures that time for every 2D-CVM*.py script in this directory:
+#   each script is loaded in a new interpreter, repeats times, and the median wall time is
+#   reported, together with whether matplotlib was imported while loading.
+#
+# For comparison it also measures a bare interpreter, "import numpy", and "import numpy, pylab";
+#   the difference between the last two is the cost that a script pays if it imports pylab at the
+#   top instead of only when a plot is made.
+#
+# Usage:   python 2D-CVM-startup-benchmark.py [--repeats 5] [--python /path/to/python]
+#   Scripts written for a different Python version than the chosen interpreter are reported as
+#   not loading.
+#
+####################################################################################################
+
+from __future__ import print_function
+
+import os
+import sys
+import glob
+import time
+import argparse
+import subprocess
+
+
+####################################################################################################
+#
+# The code run in each new interpreter to load a script as a module (so main() is not run), and
+#   to report whether matplotlib was imported along the way
+#
+####################################################################################################
+
+loadScriptCode = """
+import sys
+scriptFileName = sys.argv[1]
+if sys.version_info[0] < 3:
+    import imp
+    imp.load_source('cvmScript', scriptFileName)
+else:
+    import importlib.util
+    scriptSpec = importlib.util.spec_from_file_location('cvmScript', scriptFileName)
+    scriptModule = importlib.util.module_from_spec(scriptSpec)
+    scriptSpec.loader.exec_module(scriptModule)
+sys.stdout.write('matplotlib-loaded' if 'matplotlib' in sys.modules else 'matplotlib-not-loaded')
+"""
+
+
+####################################################################################################
+#
+# Function to time one command in new interpreters; returns (median seconds, output of the last
+#   run), or (None, error text) if the command fails
+#
+####################################################################################################
+
+def timeCommand (commandList, repeats):
+
+    elapsedList = list()
+    commandOutput = ''
+    for repeatNum in range (0, repeats):
+        startTime = time.time()
+        commandProcess = subprocess.Popen(commandList, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        (commandOutput, commandErrors) = commandProcess.communicate()
+        elapsedList.append(time.time() - startTime)
+        if commandProcess.returncode != 0:
+            errorLinesList = commandErrors.decode('latin-1').strip().splitlines()
+            return (None, errorLinesList[-1] if errorLinesList else 'failed')
+
+    elapsedList.sort()
+    medianElapsed = elapsedList[len(elapsedList)//2]
+
+    return (medianElapsed, commandOutput.decode('latin-1'))
+
+
+####################################################################################################
+#
+# Main procedure
+#
+####################################################################################################
+
+def main():
+
+    argumentParser = argparse.ArgumentParser(description='Startup-time benchmark for the 2-D CVM scripts')
+    argumentParser.add_argument('--repeats', type=int, default=5, help='new interpreters per measurement')
+    argumentParser.add_argument('--python', default=sys.executable, help='the interpreter to measure')
+    arguments = argumentParser.parse_args()
+
+    pythonExecutable = arguments.python
+    repeats = arguments.repeats
+
+    scriptDirectory = os.path.dirname(os.path.abspath(__file__))
+    scriptFileNamesList = sorted(scriptFileName for scriptFileName in glob.glob(os.path.join(scriptDirectory, '2D-CVM*.py'))
+                                 if 'benchmark' not in os.path.basename(scriptFileName))
+
+    print(' ')
+    print(' Startup times for', pythonExecutable, '(median of', repeats, 'runs)')
+    print(' ')
+
+    baselinesList = (('bare interpreter', 'pass'),
+                     ('import numpy', 'import numpy'),
+                     ('import numpy, pylab', 'import numpy, pylab'))
+    baselineTimesDict = dict()
+    for (baselineName, baselineCode) in baselinesList:
+        (medianElapsed, commandOutput) = timeCommand ([pythonExecutable, '-c', baselineCode], repeats)
+        baselineTimesDict[baselineName] = medianElapsed
+        if medianElapsed is None:
+            print('   %-70s   (not available: %s)' % (baselineName, commandOutput))
+        else:
+            print('   %-70s   %.3f s' % (baselineName, medianElapsed))
+
+    if baselineTimesDict['import numpy, pylab'] is not None:
+        print(' ')
+        print('   Importing pylab at the top of a script would add %.3f s to every worker' %
+              (baselineTimesDict['import numpy, pylab'] - baselineTimesDict['import numpy']))
+
+    print(' ')
+    for scriptFileName in scriptFileNamesList:
+        (medianElapsed, commandOutput) = timeCommand ([pythonExecutable, '-c', loadScriptCode, scriptFileName], repeats)
+        if medianElapsed is None:
+            print('   %-70s   (does not load: %s)' % (os.path.basename(scriptFileName), commandOutput))
+        else:
+            print('   %-70s   %.3f s   %s' % (os.path.basename(scriptFileName), medianElapsed, commandOutput))
+    print(' ')
+
+
+if __name__ == "__main__": main()
@@ -5,14 +5,13 @@
 ####################################################################################################
 # Import the following Python packages
 
+import os
+import sys
 import random
 import itertools
 import numpy as np
-import pylab
-import matplotlib
 from math import exp
 from math import log
-from matplotlib import pyplot as plt
 from random import randrange, uniform #(not sure this is needed, since I'm importing random)
 
 
@@ -869,6 +868,56 @@ def print_thermodynamic_plot_statement(pattern_select):
     return
 
 
+####################################################################################################
+####################################################################################################
+#
+# Plotting
+#
+# Matplotlib is only imported when a figure is actually made, and the global plot_mode (set in 
+#   **main**) decides what happens to each figure:
+#   'show' - the figure is shown on screen (pylab.show() blocks until the window is closed)
+#   'save' - matplotlib is switched to its non-GUI 'Agg' backend, and the figure is written to
+#            plot_directory as figure_name.png (figure_name-2.png, ... for later figures with the
+#            same name in the same run); nothing blocks
+#   'off'  - no figures are made, and matplotlib is never imported
+#
+####################################################################################################
+####################################################################################################
+
+plot_mode = 'show'
+plot_directory = 'cvm-plots'
+saved_figure_counts = dict()
+
+def obtain_pylab ():
+
+    if plot_mode == 'save':
+        import matplotlib
+        matplotlib.use('Agg')
+    import pylab
+
+    return (pylab)
+
+
+def finish_figure (pylab, figure_name):
+
+    if plot_mode == 'show':
+        pylab.show()
+        return
+
+    if not os.path.isdir(plot_directory):
+        os.makedirs(plot_directory)
+
+    saved_figure_counts[figure_name] = saved_figure_counts.get(figure_name, 0) + 1
+    if saved_figure_counts[figure_name] == 1:
+        figure_file_name = os.path.join(plot_directory, figure_name + '.png')
+    else:
+        figure_file_name = os.path.join(plot_directory, '%s-%d.png' % (figure_name, saved_figure_counts[figure_name]))
+
+    pylab.savefig(figure_file_name)
+    pylab.close()
+    print( ' Saved the plot to', figure_file_name)
+
+
 ####################################################################################################
 ####################################################################################################
 #
@@ -888,13 +937,16 @@ def print_thermodynamic_plot_statement(pattern_select):
 
 def plot_thermodynamic_vals (h_array, neg_S_array, f_eps0_array, f_eps1_array, f_energy_array):
 
+    if plot_mode == 'off':
+        return
                                                                                                                                      
+    pylab = obtain_pylab ()
     pylab.figure(1)
     pylab.plot (h_array,neg_S_array) 
     pylab.plot (h_array,f_eps0_array,'c')
     pylab.plot (h_array,f_eps1_array,'m')
     pylab.plot (h_array,f_energy_array,'r')
-    pylab.show()  
+    finish_figure (pylab, 'thermodynamic-vals')
     return
 
 ####################################################################################################
@@ -914,11 +966,15 @@ def plot_thermodynamic_vals (h_array, neg_S_array, f_eps0_array, f_eps1_array, f
 
 def plot_analytic_vals (h_array, z1_array, z3_array, y2_array): 
 
+    if plot_mode == 'off':
+        return
+
+    pylab = obtain_pylab ()
     pylab.figure(2)
     pylab.plot (h_array,z1_array, 'g')    
     pylab.plot (h_array,z3_array,'r')
     pylab.plot (h_array,y2_array,'m')
-    pylab.show()  
+    finish_figure (pylab, 'analytic-vals')
     return
 
 
@@ -953,13 +1009,17 @@ def plot_thermodynamic_vals_vs_trials (trial_array, neg_S_array, f_eps0_array, f
     print( ' - The interaction enthalpy (eps1*(2*y2 - y1 - y3)) is in maroon,' ) 
     print( ' - The free energy is in red.'  ) 
     print()  
+
+    if plot_mode == 'off':
+        return
                                                                                                                                    
+    pylab = obtain_pylab ()
     pylab.figure(1)
     pylab.plot (trial_array,neg_S_array) 
     pylab.plot (trial_array,f_eps0_array,'c')
     pylab.plot (trial_array,f_eps1_array,'m')
     pylab.plot (trial_array,f_energy_array,'r')
-    pylab.show()  
+    finish_figure (pylab, 'thermodynamic-vals-vs-trials')
     return
 
 
@@ -3250,6 +3310,10 @@ def compute_config_variables (array_size_list, unit_array):
     if not debug_print_off:
         print ("In compute_config_variables")
 
+# The whole-array NumPy engine gives identical counts and is much faster; it is selected in main()
+    if use_vectorized_config_vars:
+        return compute_config_variables_vectorized (array_size_list, unit_array)
+
 #   Initialize the empty list for the full set of configuration variables
     config_vars_list = list() # empty list
     
@@ -3292,6 +3356,73 @@ def compute_config_variables (array_size_list, unit_array):
 
 
 
+####################################################################################################
+####################################################################################################
+#
+# Function to compute the fourteen configuration variables with whole-array NumPy operations;
+#   this is a drop-in replacement for compute_config_variables, returning the same list:
+#   config_vars_list = (X1, X2, Y1, Y2, Y3, W1, W2, W3, Z1, Z2, Z3, Z4, Z5, Z6, unit_array)
+#
+# Each zigzag chain (top row i and next row i+1, the last row wrapping to row 0) is laid out as a
+#   ring of 2*array_length units, walked in the same order as the loop-based functions:
+#     - EVEN top row: top[0], next[0], top[1], next[1], ...
+#     - ODD top row:  next[0], top[0], next[1], top[1], ...
+#   The y pairs are consecutive units on a ring and the z triplets are three consecutive units;
+#   they are encoded as 2*U + NN and 4*U + 2*NN + NNN and counted with np.bincount.
+#
+####################################################################################################
+####################################################################################################
+
+def compute_config_variables_vectorized (array_size_list, unit_array):
+
+    array_length = array_size_list[0]
+    array_layers = array_size_list[1]
+
+# Same "> 0.1" test as the loop-based functions to decide if a unit is A (1) or B (0)
+    active_array = (unit_array > 0.1).astype(np.int64)
+    next_row_array = np.roll(active_array, -1, axis=0)
+
+    even_rows = (np.arange(array_layers) % 2 == 0)
+    odd_rows = np.logical_not(even_rows)
+    chain_array = np.zeros((array_layers, 2*array_length), dtype=np.int64)
+    chain_array[even_rows, 0::2] = active_array[even_rows]
+    chain_array[even_rows, 1::2] = next_row_array[even_rows]
+    chain_array[odd_rows, 0::2] = next_row_array[odd_rows]
+    chain_array[odd_rows, 1::2] = active_array[odd_rows]
+
+    chain_NN_array = np.roll(chain_array, -1, axis=1)
+    chain_NNN_array = np.roll(chain_array, -2, axis=1)
+
+# Pair codes: 3 = A-A, 2 = A-B, 1 = B-A, 0 = B-B
+    y_counts = np.bincount((2*chain_array + chain_NN_array).ravel(), minlength=4)
+    w_horizontal_codes = 2*active_array + np.roll(active_array, -1, axis=1)
+    w_vertical_codes = 2*active_array + np.roll(active_array, -2, axis=0)
+    w_counts = np.bincount(w_horizontal_codes.ravel(), minlength=4) + np.bincount(w_vertical_codes.ravel(), minlength=4)
+
+# Triplet codes: 7 = A-A-A, 6 = A-A-B, 5 = A-B-A, 4 = A-B-B, 3 = B-A-A, 2 = B-A-B, 1 = B-B-A, 0 = B-B-B
+    z_counts = np.bincount((4*chain_array + 2*chain_NN_array + chain_NNN_array).ravel(), minlength=8)
+
+    X1 = int(np.count_nonzero(active_array))
+    X2 = int(active_array.size) - X1
+    Y1 = int(y_counts[3])
+    Y2 = int(y_counts[2] + y_counts[1])
+    Y3 = int(y_counts[0])
+    W1 = int(w_counts[3])
+    W2 = int(w_counts[2] + w_counts[1])
+    W3 = int(w_counts[0])
+    Z1 = int(z_counts[7])
+    Z2 = int(z_counts[6] + z_counts[3])
+    Z3 = int(z_counts[5])
+    Z4 = int(z_counts[2])
+    Z5 = int(z_counts[1] + z_counts[4])
+    Z6 = int(z_counts[0])
+
+    config_vars_list = (X1, X2, Y1, Y2, Y3, W1, W2, W3, Z1, Z2, Z3, Z4, Z5, Z6, unit_array)
+
+    return (config_vars_list)
+
+
+
 
 
 
@@ -3653,25 +3784,86 @@ def compute_thermodynamic_vars(eps0, h, config_vars_frac_list):
 
 
 ####################################################################################################
+####################################################################################################
+#
+# Function to compute the entropy, enthalpy, and free energy over a whole grid of h and eps0 values
+#    in one call, instead of one call to compute_thermodynamic_vars per point
+#   Inputs:  eps0_array - one or more values for eps0
+#            h_array - one or more values for h
+#            config_vars_frac_array - one configuration-fraction list (14 values, as returned by 
+#                compute_config_vars_fractions), or a stack of them with shape (..., 14)
+#   Returns: sys_vals_list = (negS, enthalpy0, enthalpy1, free_energy), as in 
+#            compute_thermodynamic_vars; each is an array with shape
+#                (config stack shape) + (h_array shape) + (eps0_array shape)
+#            so that, for a single fraction list, free_energy[i, k] is the value for h_array[i]
+#            and eps0_array[k]
 #
-# Function to fill a new unit matrix so it is identical to the starting matrix
+# The negative entropy depends only on the fractions, so it is computed once per fraction list 
+#    (as one weighted sum of Lf values) and broadcast over the h and eps0 axes.
 #
 ####################################################################################################
+####################################################################################################
+
+def compute_thermodynamic_vars_grid(eps0_array, h_array, config_vars_frac_array):
+
+    eps0_array = np.asarray(eps0_array, dtype=np.float)
+    h_array = np.asarray(h_array, dtype=np.float)
+    config_vars_frac_array = np.asarray(config_vars_frac_array, dtype=np.float)
     
-def create_identical_unit_array (array_size_list, unit_array):
+    frac_shape = config_vars_frac_array.shape[:-1]
+
+# negS = -(2*Lfy + Lfw - Lfx - 2*Lfz), written as one weight per fraction (x1, x2, y1, y2, y3, 
+#    w1, w2, w3, z1, ... z6), with the factors of 2 for y2, w2, z2, and z5 folded in
+    neg_S_weights = np.array([1., 1., -2., -4., -2., -1., -2., -1., 2., 4., 2., 2., 4., 2.])
+
+# Lf(v) = v*log(v) - v for every fraction at once; Lf(0) is taken as its limit, 0
+    safe_frac_array = np.where(config_vars_frac_array > 0.0, config_vars_frac_array, 1.0)
+    Lf_array = config_vars_frac_array*np.log(safe_frac_array) - config_vars_frac_array
+    negS = np.dot(Lf_array, neg_S_weights)
+
+    x1 = config_vars_frac_array[..., 0]
+    y1 = config_vars_frac_array[..., 2]
+    y2 = config_vars_frac_array[..., 3]
+    y3 = config_vars_frac_array[..., 4]
+
+# Add trailing axes so that the fraction-only terms broadcast over the h and eps0 axes
+    h_axes = (1,)*h_array.ndim
+    eps0_axes = (1,)*eps0_array.ndim
+    x1 = x1.reshape(frac_shape + h_axes + eps0_axes)
+    y_term = (2.*y2 - y1 - y3).reshape(frac_shape + h_axes + eps0_axes)
+    negS = negS.reshape(frac_shape + h_axes + eps0_axes)
+
+# As in compute_thermodynamic_vars, epsilon1 = log(h)/2.0
+    epsilon1 = (np.log(h_array)/2.0).reshape(h_array.shape + eps0_axes)
+
+    grid_shape = frac_shape + h_array.shape + eps0_array.shape
+    enthalpy0 = np.broadcast_to(eps0_array*x1, grid_shape).copy()
+    enthalpy1 = np.broadcast_to(2.*epsilon1*y_term, grid_shape).copy()
+    negS = np.broadcast_to(negS, grid_shape).copy()
     
-    local_array_length = array_size_list[0]
-    local_array_layers = array_size_list[1]
-    new_unit_array = np.random.choice([0, 1],size=(local_array_layers,local_array_length))
-
-#  How to copy a list: b = [x for x in a] 
-#  Another way: b = list(a)   
+    free_energy = enthalpy0 + enthalpy1 + negS
+        
+    sys_vals_list = (negS, enthalpy0, enthalpy1, free_energy)
+                                  
+    return (sys_vals_list)   
          
-# We have an  L x M array of units, where M (across) =', localArrayLength, 'and L (layers) =', localArrayLayers
-             
-    for row in range (0, local_array_layers, 1):
-        for column in range (0, local_array_length, 1): 
-            new_unit_array[row, column] =  unit_array[row, column]              
+
+
+####################################################################################################
+#
+# Function to fill a new unit matrix so it is identical to the starting matrix.
+#   The whole grid is copied in one NumPy operation (no random fill first, and no per-unit loop).
+#   When a preallocated new_unit_array (of the same shape) is passed in, the units are copied into
+#   it and it is returned, so a caller can reuse one buffer instead of allocating a new grid.
+#
+####################################################################################################
+    
+def create_identical_unit_array (array_size_list, unit_array, new_unit_array=None):
+    
+    if new_unit_array is None:
+        return np.array(unit_array, copy=True)
+
+    new_unit_array[:, :] = unit_array
                         
     return new_unit_array
 
@@ -3768,6 +3960,11 @@ def titillate_to_reach_FEMinimum (array_size_list, new_unit_array, eps0, h, max_
 # Typical value for max_node_tests is about 30
 
     
+# In the local-update mode (selected in main()), only the pairs and triplets touching the two
+#   swapped nodes are recounted for each trial
+    if use_local_FE_update:
+        return titillate_to_reach_FEMinimum_local (array_size_list, new_unit_array, eps0, h, max_node_tests, max_trials)
+    
     titillate_FEminimum_vals_Bool_off = True
     titillate_FEMinimum_vals_details_Bool_off = True 
     
@@ -3989,6 +4186,247 @@ def titillate_to_reach_FEMinimum (array_size_list, new_unit_array, eps0, h, max_
        
     return new_unit_array
     # END titillate_to_reach_FEMinimum      
+
+
+
+####################################################################################################
+####################################################################################################
+#
+# Function to list the configuration-variable "clusters" (y pairs, w pairs, and z triplets) that
+#   contain a given node. Each cluster is identified by a key that is unique within the grid:
+#     ('y', chain, start) - the nearest-neighbor pair at ring positions start, start+1
+#     ('z', chain, start) - the triplet at ring positions start, start+1, start+2
+#     ('wh', row, col)    - the horizontal next-nearest-neighbor pair (row, col), (row, col+1)
+#     ('wv', row, col)    - the vertical next-nearest-neighbor pair (row, col), (row+2, col)
+#   where "chain" is the top row of a zigzag chain, and the ring positions follow the layout used
+#   in compute_config_variables_vectorized.
+#
+####################################################################################################
+####################################################################################################
+
+def obtain_unit_cluster_keys (array_size_list, unit_row, unit_col):
+
+    array_length = array_size_list[0]
+    array_layers = array_size_list[1]
+    ring_length = 2*array_length
+
+    cluster_keys = list()
+
+# The chain for which this node is in the top row, and the chain for which it is in the next row
+    own_chain = unit_row
+    if unit_row % 2 == 0: own_position = 2*unit_col
+    else: own_position = 2*unit_col + 1
+    above_chain = (unit_row - 1) % array_layers
+    if above_chain % 2 == 0: above_position = 2*unit_col + 1
+    else: above_position = 2*unit_col
+
+    for (chain, position) in ((own_chain, own_position), (above_chain, above_position)):
+        for offset in range (0, 2):
+            cluster_keys.append(('y', chain, (position - offset) % ring_length))
+        for offset in range (0, 3):
+            cluster_keys.append(('z', chain, (position - offset) % ring_length))
+
+    cluster_keys.append(('wh', unit_row, unit_col))
+    cluster_keys.append(('wh', unit_row, (unit_col - 1) % array_length))
+    cluster_keys.append(('wv', unit_row, unit_col))
+    cluster_keys.append(('wv', (unit_row - 2) % array_layers, unit_col))
+
+    return cluster_keys
+
+
+####################################################################################################
+#
+# Function to return the (row, column) of the node at a given position on a zigzag-chain ring
+#
+####################################################################################################
+
+def obtain_chain_unit_position (array_size_list, chain, position):
+
+    array_length = array_size_list[0]
+    array_layers = array_size_list[1]
+
+    position = position % (2*array_length)
+    unit_col = position // 2
+# For an EVEN chain the ring starts on the top row; for an ODD chain it starts on the next row
+    if (position % 2 == 0) == (chain % 2 == 0):
+        unit_row = chain
+    else:
+        unit_row = (chain + 1) % array_layers
+
+    return (unit_row, unit_col)
+
+
+####################################################################################################
+#
+# Function to convert a cluster key into the (row, column) positions of its nodes, in order
+#
+####################################################################################################
+
+def obtain_cluster_units (array_size_list, cluster_key):
+
+    array_length = array_size_list[0]
+    array_layers = array_size_list[1]
+
+    kind = cluster_key[0]
+    if kind == 'y':
+        return (obtain_chain_unit_position (array_size_list, cluster_key[1], cluster_key[2]),
+                obtain_chain_unit_position (array_size_list, cluster_key[1], cluster_key[2]+1))
+    if kind == 'z':
+        return (obtain_chain_unit_position (array_size_list, cluster_key[1], cluster_key[2]),
+                obtain_chain_unit_position (array_size_list, cluster_key[1], cluster_key[2]+1),
+                obtain_chain_unit_position (array_size_list, cluster_key[1], cluster_key[2]+2))
+    unit_row = cluster_key[1]
+    unit_col = cluster_key[2]
+    if kind == 'wh':
+        return ((unit_row, unit_col), (unit_row, (unit_col + 1) % array_length))
+    return ((unit_row, unit_col), ((unit_row + 2) % array_layers, unit_col))
+
+
+####################################################################################################
+#
+# Function to count the configuration variables contributed by a set of clusters only; returns
+#   a 14-element array laid out as config_vars_list (the x counts are left at zero)
+#
+####################################################################################################
+
+def compute_cluster_config_variables (unit_array, cluster_units_list):
+
+    y_index_table = (4, 3, 3, 2)                     # B-B, B-A, A-B, A-A
+    w_index_table = (7, 6, 6, 5)                     # B--B, B--A, A--B, A--A
+    z_index_table = (13, 12, 11, 9, 12, 10, 9, 8)    # B-B-B, B-B-A, B-A-B, B-A-A, A-B-B, A-B-A, A-A-B, A-A-A
+
+    cluster_counts = np.zeros(14, dtype=np.int64)
+
+    for (kind, cluster_units) in cluster_units_list:
+        code = 0
+        for (unit_row, unit_col) in cluster_units:
+            code = 2*code + int(unit_array[unit_row, unit_col] > 0.1)
+        if kind == 'y':
+            cluster_counts[y_index_table[code]] += 1
+        elif kind == 'z':
+            cluster_counts[z_index_table[code]] += 1
+        else:
+            cluster_counts[w_index_table[code]] += 1
+
+    return cluster_counts
+
+
+####################################################################################################
+####################################################################################################
+#
+# Function to compute the change in all the configuration variables caused by swapping the node at
+#   (x1_row, x1_col) with the node at (x2_row, x2_col), without recounting the whole grid.
+#   Only the pairs and triplets containing one of the two nodes are counted, before and after the
+#   swap; the unit_array is returned to its original state.
+#
+####################################################################################################
+####################################################################################################
+
+def compute_swap_delta_config_variables (array_size_list, unit_array, x1_row, x1_col, x2_row, x2_col):
+
+# Collect the clusters touching either node; a cluster containing both nodes is counted once
+    cluster_keys = set(obtain_unit_cluster_keys (array_size_list, x1_row, x1_col))
+    cluster_keys.update(obtain_unit_cluster_keys (array_size_list, x2_row, x2_col))
+    cluster_units_list = [(cluster_key[0], obtain_cluster_units (array_size_list, cluster_key)) for cluster_key in cluster_keys]
+
+    old_x1_value = unit_array[x1_row, x1_col]
+    old_x2_value = unit_array[x2_row, x2_col]
+
+    counts_before = compute_cluster_config_variables (unit_array, cluster_units_list)
+    unit_array[x1_row, x1_col] = old_x2_value
+    unit_array[x2_row, x2_col] = old_x1_value
+    counts_after = compute_cluster_config_variables (unit_array, cluster_units_list)
+    unit_array[x1_row, x1_col] = old_x1_value
+    unit_array[x2_row, x2_col] = old_x2_value
+
+    config_vars_delta = counts_after - counts_before
+
+    return config_vars_delta
+
+
+####################################################################################################
+####################################################################################################
+#
+# Function to titillate the array (keeping x1, x2 constant) to reach a free energy minimum, using
+#   running totals of the configuration variables. It makes the same random draws and the same
+#   accept/reject decisions as titillate_to_reach_FEMinimum, but each trial only recounts the
+#   pairs and triplets touching the two swapped nodes, so a trial costs O(1) instead of O(N).
+#
+####################################################################################################
+####################################################################################################
+
+def titillate_to_reach_FEMinimum_local (array_size_list, new_unit_array, eps0, h, max_node_tests, max_trials):
+
+    titillate_FEMinimum_vals_details_Bool_off = True 
+
+    step = 1 
+
+    config_vars_frac_list_new = list()
+
+    trial_array    = np.zeros(max_trials, dtype=np.float)    
+    negS_array     = np.zeros(max_trials, dtype=np.float)
+    enthalpy0_array     = np.zeros(max_trials, dtype=np.float)
+    enthalpy1_array     = np.zeros(max_trials, dtype=np.float)
+    free_energy_array   = np.zeros(max_trials, dtype=np.float)  
+
+# Count the configuration variables once; these running totals are updated after each accepted swap
+    config_vars_list_old = compute_config_variables (array_size_list, new_unit_array)
+    config_vars_counts_old = np.array(config_vars_list_old[0:14], dtype=np.int64)
+    config_vars_frac_list_old = compute_config_vars_fractions (config_vars_counts_old, list())
+    sys_vals_list_old = compute_thermodynamic_vars(eps0, h, config_vars_frac_list_old)
+
+    successful_flips = 0
+
+    for i in range (0, max_trials, step): 
+        trial_num = i+1
+
+        x1_candidate_row_col_list = find_candidate_x1_node (array_size_list, new_unit_array, max_node_tests, titillate_FEMinimum_vals_details_Bool_off)
+        x1_row          = x1_candidate_row_col_list[0]
+        x1_col          = x1_candidate_row_col_list[1]
+        x1_success_Bool = x1_candidate_row_col_list[3] 
+
+        x2_candidate_row_col_list = find_candidate_x2_node (array_size_list, new_unit_array, max_node_tests, titillate_FEMinimum_vals_details_Bool_off)
+        x2_row          = x2_candidate_row_col_list[0]
+        x2_col          = x2_candidate_row_col_list[1]
+        x2_success_Bool = x2_candidate_row_col_list[3] 
+
+        if x1_success_Bool == 1 and x2_success_Bool == 1:
+            config_vars_delta = compute_swap_delta_config_variables (array_size_list, new_unit_array, x1_row, x1_col, x2_row, x2_col)
+            config_vars_counts_new = config_vars_counts_old + config_vars_delta
+            config_vars_frac_list_new = compute_config_vars_fractions (config_vars_counts_new, config_vars_frac_list_new)
+            sys_vals_list_new = compute_thermodynamic_vars(eps0, h, config_vars_frac_list_new)
+            FE_old = sys_vals_list_old[3]
+            FE_new = sys_vals_list_new[3]
+
+            trial_array[i]          = trial_num
+            negS_array[i]           = sys_vals_list_new[0]
+            enthalpy0_array[i]      = sys_vals_list_new[1]
+            enthalpy1_array[i]      = sys_vals_list_new[2]
+            free_energy_array[i]    = FE_new 
+
+            if FE_new < FE_old:
+                new_unit_array[x1_row, x1_col] = 0
+                new_unit_array[x2_row, x2_col] = 1
+                config_vars_counts_old = config_vars_counts_new
+                sys_vals_list_old = sys_vals_list_new
+                successful_flips = successful_flips + 1
+                if not titillate_FEMinimum_vals_details_Bool_off:                                                                                                                                       
+                    print()
+                    print( ' Successful flip: free energy reduced, keeping the change' )        
+            else:
+                if not titillate_FEMinimum_vals_details_Bool_off:                                                                                                                                       
+                    print()
+                    print( ' Unsuccessful flip: free energy increased, NOT keeping the change')        
+
+        else: # no success finding a swappable pair for this trial                                                                                                         
+            if not titillate_FEMinimum_vals_details_Bool_off:                                                                                                                                           
+                print()
+                print( ' Did not attempt a node swap for this trial') 
+
+    plot_thermodynamic_vals_vs_trials (trial_array, negS_array, enthalpy0_array, enthalpy1_array, free_energy_array)
+
+    return new_unit_array
+    # END titillate_to_reach_FEMinimum_local
       
 
         
@@ -4069,6 +4507,10 @@ def main():
     global z_debug_print_off
     global show_progress_adjust_matrix_off
     global explanation_thermodynamic_plot_off
+    global use_vectorized_config_vars
+    global use_local_FE_update
+    global plot_mode
+    global plot_directory
 
     even_layers = True
 
@@ -4082,6 +4524,26 @@ def main():
     explanation_thermodynamic_plot_off = True
     perform_analytics = True
 
+# Select the configuration-variable engine: True uses the whole-array NumPy engine
+#   (compute_config_variables_vectorized), False uses the original cell-by-cell loops
+    use_vectorized_config_vars = True
+
+# Select how titillate_to_reach_FEMinimum evaluates each trial swap: True keeps running totals of
+#   the configuration variables and recounts only the pairs and triplets touching the two swapped
+#   nodes; False recounts the whole grid twice per trial
+    use_local_FE_update = True
+
+# Select what happens to the plots: 'show' opens them on screen (each one blocks until its window
+#   is closed), 'save' writes them as .png files to plot_directory using a non-GUI backend, and 
+#   'off' makes no plots (matplotlib is not even imported). Running the program with --headless 
+#   selects 'save', and with --no-plots selects 'off', for unattended batch runs.
+    plot_mode = 'show'
+    if '--headless' in sys.argv[1:]:
+        plot_mode = 'save'
+    if '--no-plots' in sys.argv[1:]:
+        plot_mode = 'off'
+    plot_directory = 'cvm-plots'
+
 # This is a local variable; it will be passed to compute_config_variables
 #  It will determine whether we print the contents of the x-array at the
 #  beginning and end of the adjust-matrix step. 
@@ -4210,58 +4672,21 @@ def main():
         zero_activation_analytic_config_vars_list = compute_zero_activation_analytic_config_variables (zero_activation_analytic_config_vars_list, h)
         print_config_vars_comparison (config_vars_frac_list, zero_activation_analytic_config_vars_list, h)
 
-        h = h - h_incr        
-        for i in range (0, h_range, 1):        
-            h = h + h_incr
-
-    # Use the initial value of eps0a .. c for eps0
-            eps0 = eps0a                                                                     
-    # obtain the thermodynamic variables 
-            sys_vals_list = compute_thermodynamic_vars (eps0, h, config_vars_frac_list) 
-            
-# Detailed print statement, not needed after trace            
-#            print_thermodynamic_values (h, eps0, sys_vals_list)  
-            
-    # store the thermodynamic variables to plot later
-            h_array[i]=h
-            neg_S_array1[i]    = sys_vals_list[0] 
-            f_eps0_array1[i]   = sys_vals_list[1]
-            f_eps1_array1[i]   = sys_vals_list[2]    
-            f_energy_array1[i] = sys_vals_list[3]                                                  
-
-    # Use the second value of eps0a .. c for eps0
-            eps0 = eps0b                                                                     
-    # obtain the thermodynamic variables 
-            sys_vals_list = compute_thermodynamic_vars (eps0, h, config_vars_frac_list)   
-
-# Detailed print statement, not needed after trace
-#            print_thermodynamic_values (h, eps0, sys_vals_list)  
+    # obtain the thermodynamic variables for every (h, eps0) pair in one call; 
+    #    column k of each result holds the values for eps0a, eps0b, eps0c respectively
+        h_array = h0 + h_incr*np.arange(h_range)
+        eps0_vals_array = np.array([eps0a, eps0b, eps0c])
+        sys_vals_grid = compute_thermodynamic_vars_grid (eps0_vals_array, h_array, config_vars_frac_list) 
             
     # store the thermodynamic variables to plot later
-            h_array[i]=h
-            neg_S_array2[i]    = sys_vals_list[0] 
-            f_eps0_array2[i]   = sys_vals_list[1]
-            f_eps1_array2[i]   = sys_vals_list[2]    
-            f_energy_array2[i] = sys_vals_list[3]   
-
-    # Use the thirdl value of eps0a .. c for eps0
-            eps0 = eps0c                                                                    
-    # obtain the thermodynamic variables 
-            sys_vals_list = compute_thermodynamic_vars (eps0, h, config_vars_frac_list)  
-            
-# Detailed print statement, not needed after trace
-#            print_thermodynamic_values (h, eps0, sys_vals_list)   
-            
-    # store the thermodynamic variables to plot later
-            h_array[i]=h
-            neg_S_array3[i]    = sys_vals_list[0] 
-            f_eps0_array3[i]   = sys_vals_list[1]
-            f_eps1_array3[i]   = sys_vals_list[2]    
-            f_energy_array3[i] = sys_vals_list[3]   
-
-
-
+        (neg_S_array1, neg_S_array2, neg_S_array3) = sys_vals_grid[0].T
+        (f_eps0_array1, f_eps0_array2, f_eps0_array3) = sys_vals_grid[1].T
+        (f_eps1_array1, f_eps1_array2, f_eps1_array3) = sys_vals_grid[2].T
+        (f_energy_array1, f_energy_array2, f_energy_array3) = sys_vals_grid[3].T
 
+    # leave h and eps0 at their final loop values, as used further on
+        h = h_array[-1]
+        eps0 = eps0c
 
     if pattern_select > 0:   
         h = h0 - h_incr        
@@ -4276,18 +4701,14 @@ def main():
         h = h + h_incr 
         orig_sys_vals_list = compute_thermodynamic_vars (eps0, h, orig_config_vars_frac_list)  
 
-        for i in range (0, h_range, 1):        
-            h = h + h_incr        
-            sys_vals_list = compute_thermodynamic_vars (eps0, h, orig_config_vars_frac_list)   
+    # obtain the thermodynamic variables for every h value in one call
+        h_array = h + h_incr*np.arange(1, h_range+1)
+        sys_vals_grid = compute_thermodynamic_vars_grid (eps0, h_array, orig_config_vars_frac_list)   
 #            zero_activation_analytic_config_vars_list = compute_zero_activation_analytic_config_variables (h)
 #            print_config_vars_comparison (config_vars_frac_list, zero_activation_analytic_config_vars_list) 
-#            print_thermodynamic_values (h, eps0, sys_vals_list)
     # store the thermodynamic variables to plot later
-            h_array[i]=h
-            neg_S_array1[i]    = sys_vals_list[0] 
-            f_eps0_array1[i]   = sys_vals_list[1]
-            f_eps1_array1[i]   = sys_vals_list[2]    
-            f_energy_array1[i] = sys_vals_list[3]                                                
+        (neg_S_array1, f_eps0_array1, f_eps1_array1, f_energy_array1) = sys_vals_grid
+        h = h_array[-1]
 
     # end loop of computing configuration variables and thermodyanamic quantities for various values of h
 
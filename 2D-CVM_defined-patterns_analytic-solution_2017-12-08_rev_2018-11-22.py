@@ -8,11 +8,9 @@
 import random
 import itertools
 import numpy as np
-import pylab
-import matplotlib
 from math import exp
 from math import log
-from matplotlib import pyplot as plt
+# pylab (matplotlib) is imported inside the plotting procedures, only when a plot is made
 from random import randrange, uniform #(not sure this is needed, since I'm importing random)
 
 
@@ -3431,6 +3429,7 @@ def main():
     print( '   The per-unit enthalpy is zero, and is not shown, ' )
     print( '   The interaction enthalpy (eps1*y2) is in maroon, and is shifted by 0.6,' ) 
     print( '     and the free energy is in red, also shifted by 0.6.'  ) 
+    import pylab
     pylab.figure(1)
     pylab.plot (x_array,neg_S_array)    
     pylab.plot (x_array,f_eps1_array,'m')